@@ -1,7 +1,9 @@
 """A script to create motions statistics CSV files for individual tournaments."""
 import pandas as pd
 import re
-from typing import List
+from dataset_store import DEFAULT_STORE, BP_POSITIONS, load_motions, load_results
+from instrumentation import timed
+from typing import Optional
 
 
 def generate_motion_statistics(tournament_name: str) -> None:
@@ -10,79 +12,74 @@ def generate_motion_statistics(tournament_name: str) -> None:
     teams_df = pd.read_csv(tournament_name + " - Teams.csv")  # load team tab df
     motions_df = pd.read_csv(tournament_name + " - Motions.csv")  # load motions df
 
-    rounds_scores = []  # to fill with the scores from the rounds
-    for row in motions_df['Round']:  # for each round as shown in motions
-        # calculate the position scores from each round and add them to rounds_scores
-        round_scores = calculate_round_positions(teams_df, motions_df, row)
-        rounds_scores.append(round_scores)
-    motions_df['Position Scores'] = rounds_scores  # create a new df column for scores
-
-    gov_scores, opp_scores, opening_scores, closing_scores = [], [], [], []
-    for index, row in motions_df.iterrows():
-        # form a list of integers of scores for each round
-        scores = [int(score) for score in list(row['Position Scores'])]
-        gov_scores.append(scores[0] + scores[2])  # add gov scores
-        opp_scores.append(scores[1] + scores[3])  # add gov scores
-        opening_scores.append(scores[0] + scores[1])  # add gov scores
-        closing_scores.append(scores[2] + scores[3])  # add gov scores
-    motions_df['Gov'] = gov_scores
-    motions_df['Opp'] = opp_scores
-    motions_df['Opening'] = opening_scores
-    motions_df['Closing'] = closing_scores
+    # position scores of every round in the team tab, computed in one pass
+    scores_df = calculate_position_scores(teams_df)
+    # find each motion's round in the team tab; rounds missing from it get NaN scores
+    round_columns = [get_round_column(round, scores_df.index) for round in motions_df['Round']]
+    scores_df = scores_df.reindex(round_columns).set_axis(motions_df.index)
 
+    motions_df = pd.concat([motions_df, add_side_scores(scores_df)], axis=1)
     motions_df.to_csv(tournament_name + ' - Motions Tab.csv')
 
 
-def calculate_round_positions(teams_df: pd.DataFrame, motions_df: pd.DataFrame, round: str) \
-        -> List[int]:
-    """Return a list containing the total scores that each position (e.g. OG) achieved in the given
-    round."""
-    scores = [0, 0, 0, 0]  # four indices for four positions
-
-    # each row corresponds to a team
-    for index, row in teams_df.iterrows():
-        # if the team didn't partake in the round
-        # TODO: what if the round name is not in the teams csv?
-        if round not in row or row['Team'] not in row[round]:
-            continue
-        # calculating the team's score
-        score = int(row[round][-1])
-        # splitting the round data by team position e.g. by the string '(OG)'
-        # remove last item, which is round results
-        teams_in_debate = re.split(r'\([OC][GO]\)', row[round])[:-1]
-        teams_in_debate = [team.strip() for team in teams_in_debate]
-
-        # add the team's score to the list
-        team_position = teams_in_debate.index(row['Team'])
-        scores[team_position] = scores[team_position] + score
-
-    return scores
-
-
-def calculate_round_positions2(teams_df: pd.DataFrame, motions_df: pd.DataFrame, round: str)\
-        -> List[int]:
-    """Return a list containing the total scores that each position (e.g. OG) achieved in the given
-    round."""
-    scores = [0, 0, 0, 0]  # four indices for four positions
-
-    # each row corresponds to a team
-    for index, row in teams_df.iterrows():
-        # if the team didn't partake in the round
-        # TODO: what if the round name is not in the teams csv?
-        if round not in row or row['Team'] not in row[round]:
-            continue
-        # calculating the team's score
-        score = int(row[round][-1])
-        # splitting the round data by team position e.g. by the string '(OG)'
-        # remove last item, which is round results
-        teams_in_debate = re.split(r'\([OC][GO]\)', row[round])[:-1]
-        teams_in_debate = [team.strip() for team in teams_in_debate]
-
-        # add the team's score to the list
-        team_position = teams_in_debate.index(row['Team'])
-        scores[team_position] = scores[team_position] + score
-
-    return scores
+def calculate_position_scores(teams_df: pd.DataFrame) -> pd.DataFrame:
+    """Return a dataframe with one row per round of the team tab, containing the total scores that
+    each position (e.g. OG) achieved in that round.
+
+    Each team tab cell looks like 'A (OG) B (OO) C (CG) D (CO) <speaks> <points>'. The tab is
+    melted into one row per team per round, and every team in every cell is extracted at once."""
+    cells = teams_df.melt(id_vars='Team', var_name='Round', value_name='Cell')
+    cells = cells.dropna(subset=['Cell'])
+    cells['Cell'] = cells['Cell'].astype(str)
+    # a team's score for the round is the last character of its cell
+    cells['Score'] = pd.to_numeric(cells['Cell'].str[-1], errors='coerce')
+
+    # one row per (cell, team in debate) with the team name and its position
+    debates = cells['Cell'].str.extractall(r'\s*(?P<Debater>.*?)\s*\((?P<Position>[OC][GO])\)')
+    debates = debates.droplevel('match').join(cells[['Team', 'Round', 'Score']])
+    # only keep the entry of the team whose row the cell is in
+    debates = debates[debates['Debater'] == debates['Team']]
+
+    scores = debates.groupby(['Round', 'Position'], sort=False)['Score'].sum()
+    return scores.unstack('Position').reindex(columns=BP_POSITIONS).fillna(0).astype(int)
+
+
+def get_round_column(round: str, columns: pd.Index) -> Optional[str]:
+    """Return the team tab column of the given motions round, e.g. 'R3' for 'Round 3', or None if
+    the team tab doesn't have that round."""
+    if round in columns:
+        return round
+    number = re.search(r'\d+', str(round))
+    if number and 'R' + number.group() in columns:
+        return 'R' + number.group()
+    return None
+
+
+def add_side_scores(scores_df: pd.DataFrame) -> pd.DataFrame:
+    """Return the given OG, OO, CG and CO scores with the Gov, Opp, Opening and Closing totals
+    added as columns."""
+    return scores_df.assign(Gov=scores_df['OG'] + scores_df['CG'],
+                            Opp=scores_df['OO'] + scores_df['CO'],
+                            Opening=scores_df['OG'] + scores_df['OO'],
+                            Closing=scores_df['CG'] + scores_df['CO'])
+
+
+@timed
+def get_motion_statistics(path: str = DEFAULT_STORE, **filters) -> pd.DataFrame:
+    """Return the motions of every BP tournament in the store with the total scores of each
+    position and side in their round, computed from the stored results in one aggregation.
+
+    Tournaments can be filtered as in dataset_store.load_results, e.g. year=2021."""
+    filters['format'] = 'BP'
+    results_df = load_results(path, **filters)
+    motions_df = load_motions(path, **filters)
+
+    scores_df = results_df.groupby(['tournament_id', 'round', 'position'],
+                                   observed=True)['points'].sum()
+    scores_df = scores_df.unstack('position').reindex(columns=BP_POSITIONS)
+    scores_df = add_side_scores(scores_df).reset_index()
+    # motions whose round has no results keep NaN scores
+    return motions_df.merge(scores_df, how='left', on=['tournament_id', 'round'])
 
 
 if __name__ == '__main__':
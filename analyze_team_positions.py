@@ -1,80 +1,55 @@
 """Analyzes results files for data."""
 import pandas as pd
-import os
-import re
-from pathlib import Path
-
-
-def get_team_positions_list() -> None:
-    two_teams_positions_list = [0, 0]  # list for two-team formats e.g. Australs
-    four_teams_positions_list = [0, 0, 0, 0]  # list for four-team formats e.g. BP
-    set_of_team_positions = set()  # to find the unique list of team positions
-
-    # get filepath for scraped data directory
-    filepath = Path('scraped_data/')
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    for file in os.listdir(filepath):  # iterate through all the scraped data
-        if file[-14:] == ' - Results.csv':  # if results file
-            # find the file's filepath and get the dataframe
-            filepath = Path('scraped_data/' + file)
-            filepath.parent.mkdir(parents=True, exist_ok=True)
-            results_df = pd.read_csv(filepath)
-
-            for room in results_df['Rankings']:  # for every room in the file
-                teams = room.split('\', \'')  # split teams by commas
-                teams[0] = teams[0][2:]  # remove the [' at the start
-                teams[-1] = teams[-1][:-2]  # remove the '] at the end
-                for team in teams:  # for each team in the room
-                    position = re.search(r'\([A-Z]+\)', team[-4:])  # find team position substring
-                    # add the score in team[0] to the appropriate list slot
-                    if position in {'(P)', '(G)', '(A)'}:
-                        two_teams_positions_list[0] += int(team[0])
-                    elif position in {'(O)', '(N)'}:
-                        two_teams_positions_list[1] += int(team[0])
-                    elif position == '(OG)':
-                        four_teams_positions_list[0] += int(team[0])
-                    elif position == '(OO)':
-                        four_teams_positions_list[1] += int(team[0])
-                    elif position == '(CG)':
-                        four_teams_positions_list[2] += int(team[0])
-                    elif position == '(CO)':
-                        four_teams_positions_list[3] += int(team[0])
-
-    # get average team position scores for two team format
-    normalized_two = [score * 3 / (two_teams_positions_list[0] + two_teams_positions_list[1])
-                      for score in two_teams_positions_list]
-    # get average team position scores for four team format
-    normalized_four = [score * 6 / (four_teams_positions_list[0] + four_teams_positions_list[1] +
-                                    four_teams_positions_list[2] + four_teams_positions_list[3])
-                       for score in four_teams_positions_list]
-    # get average side scores for four team format
-    normalized_bp_two = [(normalized_four[0] + normalized_four[2]) / 2,
-                         (normalized_four[1] + normalized_four[3]) / 2]
-    # print stats
-    print(normalized_two)
-    print(normalized_four)
-    print(normalized_bp_two)
-
-
-def count_debates(folder: str) -> int:
-    """Count total number of debates in the given folder.
-
-    Preconditions
-        - folder starts without '/' and ends with '/'"""
-    # find folder containing debates data
-    filepath = Path(folder)
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-
-    debate_count = 0
-
-    for file in os.listdir(filepath):  # for every file in the given folder
-        if file[-14:] == ' - Results.csv':  # if results file
-            # get file's filepath
-            filepath = Path(folder + file)
-            filepath.parent.mkdir(parents=True, exist_ok=True)
-            df = pd.read_csv(filepath)  # convert file to dataframe
-            debate_count += len(df['Rankings'])  # add number of rooms to debate_count
-    return debate_count
+from dataset_store import DEFAULT_STORE, BP_POSITIONS, TWO_TEAM_POSITIONS, load_results
+from debate_counts import count_debates
+from instrumentation import timed
+from typing import List, Optional
+
+
+# which side and half of the room each position is on
+POSITION_SIDES = {'OG': 'Gov', 'CG': 'Gov', 'OO': 'Opp', 'CO': 'Opp',
+                  'G': 'Gov', 'P': 'Gov', 'A': 'Gov', 'O': 'Opp', 'N': 'Opp'}
+POSITION_HALVES = {'OG': 'Opening', 'OO': 'Opening', 'CG': 'Closing', 'CO': 'Closing'}
+INROUND_PATTERN = r'^(?:round|rodada|ラウンド|r)\s*\d'  # e.g. 'Round 3', 'Rodada 1', 'Round 1A'
+
+
+def get_round_types(rounds: pd.Series) -> pd.Series:
+    """Returns 'inround' or 'outround' for each of the given round names."""
+    rounds = rounds.astype('category')  # match each distinct round name only once
+    categories = rounds.cat.categories
+    is_inround = pd.Series(categories.str.contains(INROUND_PATTERN, case=False), index=categories)
+    return rounds.map(is_inround.map({True: 'inround', False: 'outround'}))
+
+
+@timed
+def get_position_averages(results_df: pd.DataFrame, by: Optional[List[str]] = None) \
+        -> pd.DataFrame:
+    """Returns the average points of each position (OG, OO, CG, CO, or the 2-team positions), side
+    (Gov, Opp) and half (Opening, Closing) in the given results, one row per format.
+
+    by adds further columns to group on, e.g. ['year'], ['circuit'], ['tournament'] or
+    ['round_type'], where round_type tells inrounds from outrounds."""
+    by = ['format'] + list(by or [])
+    if 'round_type' in by and 'round_type' not in results_df.columns:
+        results_df = results_df.assign(round_type=get_round_types(results_df['round']))
+    results_df = results_df.assign(side=results_df['position'].map(POSITION_SIDES),
+                                   half=results_df['position'].map(POSITION_HALVES))
+
+    tables = [results_df.groupby(by + [column], observed=True)['points'].mean().unstack(column)
+              for column in ['position', 'side', 'half']]
+    df = pd.concat(tables, axis=1)
+    columns = BP_POSITIONS + TWO_TEAM_POSITIONS + ['Gov', 'Opp', 'Opening', 'Closing']
+    return df[[column for column in columns if column in df.columns]]
+
+
+def get_team_positions_list(path: str = DEFAULT_STORE, by: Optional[List[str]] = None,
+                            **filters) -> None:
+    """Prints the average points of each team position across every tournament in the store.
+
+    Tournaments can be filtered as in dataset_store.load_results, e.g. year=2021, and the averages
+    split further with by, as in get_position_averages."""
+    results_df = load_results(path, **filters)  # results of every tournament in one query
+    print(get_position_averages(results_df, by).round(3).to_string())
 
 
 if __name__ == '__main__':
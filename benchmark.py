@@ -0,0 +1,215 @@
+"""Offline benchmarks of the scrapers and analyses.
+
+The scrapers are timed on the real pages recorded in benchmark_fixtures/ by
+recorded_pages.record_fixtures: the landing, motions, motion statistics, results and speaker tab
+pages of calicotab and herokuapp tournaments, saved as the sites sent them. Pages are read from the
+files, or served by a local HTTP server to include the network stack, so no benchmark touches a
+live tab site. Tournaments that aren't recorded are left out. The analyses are timed on a store
+imported from scraped_data/.
+
+Every benchmark reports its pages and rows per second and its peak memory, and the scrapers are
+run with each installed BeautifulSoup parser backend. Results can be saved and compared with an
+earlier run to catch regressions."""
+
+import importlib.util
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import pandas as pd
+import parsing
+from analyze_motions import get_motion_statistics
+from analyze_team_positions import get_position_averages
+from contextlib import contextmanager
+from dataset_store import import_csv_directory, load_results
+from fetchers import Fetcher, HttpFetcher
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from motion_clusters import get_motion_clusters
+from ratings import rate_store
+from recorded_pages import FIXTURES, FIXTURES_DIR, FixtureFetcher, is_recorded
+from scrape_motions import scrape_motions
+from scrape_results import scrape_results
+from scrape_speaker_tab import scrape_speaker_tab
+from site_map import get_site_map
+from speaker_analytics import get_speaker_statistics
+from urllib.parse import urlsplit
+
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+BENCHMARK_RESULTS = 'benchmark_results.json'
+PARSERS = ['lxml', 'html.parser']  # benchmarked if installed
+REPEAT = 3  # runs of each benchmark; the fastest is reported
+TOLERANCE = 0.25  # how much slower or bigger than the baseline counts as a regression
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    """Serves the fixture folder as a proxy: a request for http://<host>/<path> is answered with
+    <folder>/<host>/<path>, so pages keep their own URLs and links."""
+    extensions_map = {**SimpleHTTPRequestHandler.extensions_map,
+                      '.html': 'text/html; charset=utf-8'}  # as tabbycat sends them
+
+    def translate_path(self, path: str) -> str:
+        parts = urlsplit(path)
+        return super().translate_path('/' + parts.netloc.lower() + parts.path)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@contextmanager
+def serve_fixtures(folder: str = FIXTURES_DIR) -> Iterator[str]:
+    """Serves the fixture folder on a local port while in the context, to be used as the HTTP
+    proxy of the fetcher. Yields the server's URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_FixtureHandler, directory=folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:' + str(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def measure(function: Callable[[], int], fetcher: Optional[Fetcher] = None,
+            repeat: int = REPEAT) -> Dict[str, float]:
+    """Returns the fastest time of the given function over repeat runs, the pages it fetched and
+    rows it returned per run, and its peak memory, traced in one extra run since tracing slows
+    it down."""
+    pages = fetcher.pages if fetcher is not None else 0
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = function()
+        seconds = min(seconds, time.perf_counter() - start)
+    pages = (fetcher.pages - pages) // repeat if fetcher is not None else 0
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds, 'pages': pages, 'rows': rows,
+            'pages_per_second': pages / seconds, 'rows_per_second': rows / seconds,
+            'peak_mb': peak / 2 ** 20}
+
+
+def benchmark_scrapers(fetcher: Fetcher, urls: List[str], repeat: int = REPEAT) -> List[Dict]:
+    """Returns the measurements of every scraper on the recorded tournaments at the given URLs,
+    with the given fetcher."""
+    measurements = []
+    for url in urls:
+        site_map = get_site_map(url, fetcher)
+        statistics_map = site_map._replace(motions='')  # as for tournaments without a motions tab
+        benchmarks = {
+            'site map': lambda: len(get_site_map(url, fetcher).rounds),
+            'motions': lambda: len(scrape_motions(url, fetcher, site_map=site_map)),
+            'motion statistics': lambda: len(scrape_motions(url, fetcher,
+                                                            site_map=statistics_map)),
+            'results': lambda: sum(len(scrape_results(round_url, fetcher))
+                                   for round_url in site_map.rounds),
+            'speaker tab': lambda: len(scrape_speaker_tab(url, fetcher, site_map=site_map)),
+        }
+        for name, function in benchmarks.items():
+            measurements.append({'benchmark': name, 'fixture': url.split('://')[-1],
+                                 **measure(function, fetcher, repeat)})
+    return measurements
+
+
+def benchmark_analyses(folder: str = 'scraped_data/', repeat: int = REPEAT) -> List[Dict]:
+    """Returns the measurements of importing the scraped CSV files in the given folder into a
+    store and of every analysis of that store."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'store.sqlite')
+
+        def import_store() -> int:
+            if os.path.exists(path):
+                os.remove(path)
+            import_csv_directory(folder, None, path)
+            return len(load_results(path))
+
+        benchmarks = {
+            'import csv directory': import_store,
+            'position averages': lambda: len(get_position_averages(load_results(path),
+                                                                   ['round_type'])),
+            'motion statistics analysis': lambda: len(get_motion_statistics(path)),
+            'motion clusters': lambda: len(get_motion_clusters(None, path)),
+            'speaker statistics': lambda: len(get_speaker_statistics(path, adjusted=True)),
+            'team ratings': lambda: len(rate_store(path, persist=False).ids),
+            'speaker ratings': lambda: len(rate_store(path, speakers=True, persist=False).ids),
+        }
+        return [{'benchmark': name, 'fixture': folder, **measure(function, repeat=repeat)}
+                for name, function in benchmarks.items()]
+
+
+def run_benchmarks(transport: str = 'files', parsers: Optional[List[str]] = None,
+                   repeat: int = REPEAT, fixtures: str = FIXTURES_DIR,
+                   folder: Optional[str] = 'scraped_data/') -> pd.DataFrame:
+    """Returns the measurements of the scrapers with each parser backend (by default every
+    installed one in PARSERS), and of the analyses of the scraped CSV files in folder unless it is
+    None.
+
+    transport is 'files' to read the recorded pages in fixtures from disk or 'http' to serve them
+    locally. Only the tournaments of recorded_pages.FIXTURES that are recorded are benchmarked."""
+    if parsers is None:
+        parsers = [parser for parser in PARSERS
+                   if parser == 'html.parser' or importlib.util.find_spec(parser) is not None]
+    urls = [url for url in FIXTURES if is_recorded(url, fixtures)]
+    if len(urls) == 0:
+        print('No recorded pages in', fixtures + ', so the scrapers are not benchmarked. Record '
+              'them with: python recorded_pages.py')
+
+    measurements = []
+    original_parser = parsing.PARSER
+    try:
+        for parser in parsers:
+            parsing.set_parser(parser)
+            if transport == 'http':
+                fetcher = HttpFetcher()
+                with serve_fixtures(fixtures) as proxy_url:
+                    fetcher.session.proxies = {'http': proxy_url}
+                    # plain HTTP, so that the proxy sees each request's URL
+                    rows = benchmark_scrapers(fetcher, [url.replace('https://', 'http://', 1)
+                                                        for url in urls], repeat)
+            else:
+                fetcher = FixtureFetcher(fixtures)
+                rows = benchmark_scrapers(fetcher, urls, repeat)
+            fetcher.close()
+            measurements += [{'parser': parser, 'transport': transport, **row} for row in rows]
+    finally:
+        parsing.set_parser(original_parser)
+    if folder is not None:
+        measurements += [{'parser': None, 'transport': None, **row}
+                         for row in benchmark_analyses(folder, repeat)]
+    return pd.DataFrame(measurements)
+
+
+def compare_results(results: pd.DataFrame, baseline: pd.DataFrame,
+                    tolerance: float = TOLERANCE) -> pd.DataFrame:
+    """Returns the benchmarks that got slower or used more memory than in the baseline by more
+    than the given share, with their baseline seconds and peak memory."""
+    keys = ['benchmark', 'fixture', 'parser', 'transport']
+    df = results.merge(baseline[keys + ['seconds', 'peak_mb']], on=keys,
+                       suffixes=('', '_baseline'))
+    slower = df['seconds'] > df['seconds_baseline'] * (1 + tolerance)
+    bigger = df['peak_mb'] > df['peak_mb_baseline'] * (1 + tolerance)
+    return df[slower | bigger]
+
+
+def save_results(results: pd.DataFrame, path: str = BENCHMARK_RESULTS) -> None:
+    """Saves benchmark results to a JSON file, to be loaded with load_results_file as a baseline."""
+    results.to_json(path, orient='records', indent=1)
+
+
+def load_results_file(path: str = BENCHMARK_RESULTS) -> pd.DataFrame:
+    """Returns the benchmark results saved to the given JSON file."""
+    return pd.read_json(path, orient='records', dtype={'parser': object, 'transport': object})
+
+
+if __name__ == '__main__':
+    results = run_benchmarks()
+    print(results.round(3).to_string())
+    if os.path.exists(BENCHMARK_RESULTS):
+        print(compare_results(results, load_results_file()).round(3).to_string())
+    save_results(results)
@@ -0,0 +1,204 @@
+"""One command line for crawling, re-parsing and querying the tabs.
+
+    python cli.py crawl --mode pipelined --workers 8 --max-per-host 2
+    python cli.py parse-cache --cache-dir page_cache/
+    python cli.py stats speakers --store debate_tabs.sqlite --year 2021 --top 20
+    python cli.py search "social media" --limit 10
+    python cli.py count --store debate_tabs.sqlite
+
+Each subcommand imports what it needs when it runs, so that quick queries don't pay for pandas,
+bs4, requests or Selenium: count only uses the standard library. Defaults left unset on the
+command line are the defaults of the functions called, e.g. dataset_store.DEFAULT_STORE."""
+
+import argparse
+import os
+import sys
+
+from typing import Any, Dict, List, Optional
+
+
+CRAWL_MODES = ['pipelined', 'concurrent', 'serial']
+STATS = ['positions', 'motions', 'speakers', 'teams', 'speaker-ratings']
+MIN_ROUNDS = 3  # rounds (or rated rooms) below which speakers and teams aren't ranked
+FILTERS = ['tournament', 'year', 'circuit', 'format']  # dataset_store filters
+
+
+def get_options(args: argparse.Namespace, names: Dict[str, str]) -> Dict[str, Any]:
+    """Returns the given arguments that were set, keyed by the parameter each one is passed as."""
+    return {parameter: getattr(args, name) for name, parameter in names.items()
+            if getattr(args, name, None) is not None}
+
+
+def get_crawl_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """Returns the options shared by the crawl and parse-cache subcommands."""
+    options = get_options(args, {'cache_dir': 'cache_dir', 'report': 'report_path'})
+    if args.no_report:
+        options['report_path'] = None
+    if getattr(args, 'no_manifest', False):
+        options['manifest_path'] = None
+    elif getattr(args, 'manifest', None) is not None:
+        options['manifest_path'] = args.manifest
+    return options
+
+
+def crawl(args: argparse.Namespace) -> None:
+    if args.driver_path is not None:
+        from driver_pool import DRIVER_PATH_VARIABLE
+        os.environ[DRIVER_PATH_VARIABLE] = args.driver_path
+    options = get_crawl_options(args)
+    if args.mode == 'pipelined':
+        from pipeline import save_tournaments_pipelined
+        save_tournaments_pipelined(args.csv, args.backend, **options, **get_options(args, {
+            'workers': 'fetch_workers', 'parse_workers': 'parse_workers',
+            'max_per_host': 'max_per_host', 'folder': 'folder'}))
+    elif args.mode == 'concurrent':
+        from scrape_tournaments import save_tournaments_concurrently
+        save_tournaments_concurrently(args.csv, backend=args.backend, **options, **get_options(
+            args, {'workers': 'workers', 'max_per_host': 'max_per_host',
+                   'min_interval': 'min_interval', 'browsers': 'browsers'}))
+    else:
+        from scrape_tournaments import save_tournaments_from_file_tabbycat
+        save_tournaments_from_file_tabbycat(args.csv, args.backend, **options)
+
+
+def parse_cache(args: argparse.Namespace) -> None:
+    options = get_crawl_options(args)
+    if args.mode == 'pipelined':
+        from pipeline import save_tournaments_pipelined
+        save_tournaments_pipelined(args.csv, offline=True, **options, **get_options(
+            args, {'parse_workers': 'parse_workers', 'folder': 'folder'}))
+    else:
+        from scrape_tournaments import save_tournaments_from_file_tabbycat
+        save_tournaments_from_file_tabbycat(args.csv, offline=True, **options)
+
+
+def stats(args: argparse.Namespace) -> None:
+    import dataset_store
+    path = args.store or dataset_store.DEFAULT_STORE
+    if args.import_folder is not None:
+        print(dataset_store.import_csv_directory(args.import_folder, path=path),
+              'tournaments imported')
+    filters = get_options(args, {name: name for name in FILTERS})
+
+    if args.statistic == 'positions':
+        from analyze_team_positions import get_team_positions_list
+        get_team_positions_list(path, args.by, **filters)
+        return
+    elif args.statistic == 'motions':
+        from analyze_motions import get_motion_statistics
+        df = get_motion_statistics(path, **filters)
+    elif args.statistic == 'speakers':
+        from speaker_analytics import get_speaker_statistics
+        df = get_speaker_statistics(path, args.adjusted, **filters)
+        df = df[df['rounds'] >= args.min_rounds].sort_values('trimmed_mean', ascending=False)
+    else:
+        from entity_index import EntityIndex
+        from ratings import rate_store
+        speakers = args.statistic == 'speaker-ratings'
+        ratings = rate_store(path, speakers, persist=False, **filters)
+        index = EntityIndex(path)
+        df = ratings.get_table(index.get_names('speaker' if speakers else 'team'))
+        df = df[df['rooms'] >= args.min_rounds]
+        index.close()
+    print(df.head(args.top).to_string())
+
+
+def search(args: argparse.Namespace) -> None:
+    import motion_search
+    path = args.index or motion_search.DEFAULT_SEARCH_INDEX
+    if args.update:
+        from dataset_store import MASTER_CSV
+        motion_search.index_master_csv(MASTER_CSV, path)
+        motion_search.index_csv_directory(args.folder, path)
+    try:
+        df = motion_search.search(' '.join(args.query), path, args.limit, args.phrase, args.raw)
+    except ValueError as error:
+        args.parser.error(str(error))
+    print(df[['motion', 'tournament', 'date']].to_string())
+
+
+def count(args: argparse.Namespace) -> None:
+    from debate_counts import count_debates, count_debates_in_store
+    print(count_debates_in_store(args.store) if args.store else count_debates(args.folder))
+
+
+def add_crawl_arguments(parser: argparse.ArgumentParser, modes: List[str]) -> None:
+    """Adds the arguments shared by the crawl and parse-cache subcommands."""
+    parser.add_argument('--csv', default='Debating_Motions - Motions (Grey-_Added).csv',
+                        help='the motions CSV listing the tournaments')
+    parser.add_argument('--mode', choices=modes, default='pipelined')
+    parser.add_argument('--parse-workers', type=int, help='parsing processes (pipelined mode)')
+    parser.add_argument('--folder', help='where tabs are saved (pipelined mode)')
+    parser.add_argument('--cache-dir', help='the page cache folder')
+    parser.add_argument('--report', help='the run report file; .prom for Prometheus text')
+    parser.add_argument('--no-report', action='store_true', help="don't save a run report")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser('crawl', help='scrape the tournaments of the motions CSV')
+    add_crawl_arguments(crawl_parser, CRAWL_MODES)
+    crawl_parser.add_argument('--backend', choices=['auto', 'http', 'selenium'], default='auto')
+    crawl_parser.add_argument('--workers', type=int, help='fetch threads or crawl workers')
+    crawl_parser.add_argument('--max-per-host', type=int)
+    crawl_parser.add_argument('--min-interval', type=float,
+                              help="seconds between requests to a host (concurrent mode)")
+    crawl_parser.add_argument('--browsers', type=int, help='headless browsers (concurrent mode)')
+    crawl_parser.add_argument('--driver-path', help='the msedgedriver executable')
+    crawl_parser.add_argument('--manifest', help='the crawl manifest file')
+    crawl_parser.add_argument('--no-manifest', action='store_true')
+    crawl_parser.set_defaults(run=crawl)
+
+    cache_parser = subparsers.add_parser('parse-cache',
+                                         help='re-parse every tournament from the page cache')
+    add_crawl_arguments(cache_parser, ['pipelined', 'serial'])
+    cache_parser.set_defaults(run=parse_cache)
+
+    stats_parser = subparsers.add_parser('stats', help='print statistics of the dataset store')
+    stats_parser.add_argument('statistic', choices=STATS)
+    stats_parser.add_argument('--store', help='the dataset store file')
+    stats_parser.add_argument('--import', dest='import_folder', metavar='FOLDER',
+                              help='import the scraped CSV files in FOLDER first')
+    stats_parser.add_argument('--tournament', action='append')
+    stats_parser.add_argument('--year', type=int, action='append')
+    stats_parser.add_argument('--circuit', action='append')
+    stats_parser.add_argument('--format', choices=['BP', '2-team'])
+    stats_parser.add_argument('--by', action='append',
+                              help='columns to split position averages by, e.g. round_type')
+    stats_parser.add_argument('--adjusted', action='store_true',
+                              help='adjust speaker scores for round difficulty')
+    stats_parser.add_argument('--top', type=int, default=20)
+    stats_parser.add_argument('--min-rounds', type=int, default=MIN_ROUNDS,
+                              help='leave out speakers and teams with fewer rounds '
+                                   '(default: %(default)s)')
+    stats_parser.set_defaults(run=stats)
+
+    search_parser = subparsers.add_parser('search', help='full-text search of the motions')
+    search_parser.add_argument('query', nargs='+')
+    search_parser.add_argument('--index', help='the motion search index file')
+    search_parser.add_argument('--limit', type=int, default=20)
+    search_parser.add_argument('--phrase', action='store_true', help='search an exact phrase')
+    search_parser.add_argument('--raw', action='store_true',
+                               help='search FTS5 syntax, e.g. "social media" OR internet')
+    search_parser.add_argument('--update', action='store_true',
+                               help='index the motions CSV and scraped motions first')
+    search_parser.add_argument('--folder', default='scraped_data/')
+    search_parser.set_defaults(run=search, parser=search_parser)
+
+    count_parser = subparsers.add_parser('count', help='count the scraped debates')
+    count_parser.add_argument('--folder', default='scraped_data/')
+    count_parser.add_argument('--store', help='count the debates in this dataset store instead')
+    count_parser.set_defaults(run=count)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = make_parser().parse_args(argv)
+    args.run(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
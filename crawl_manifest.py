@@ -0,0 +1,223 @@
+"""A manifest of crawled pages, so reruns only re-parse what changed and crashes lose nothing.
+
+For every page a scraper parses, the manifest keeps the hash of its content and the records parsed
+from it. Pages parsed recently are reused without fetching at all, which lets an interrupted crawl
+resume from the last completed page. Older pages are fetched again (cheaply, through the page
+cache's revalidation) and only re-parsed if their content hash changed. Tournaments and hosts found
+dead are remembered too, so that later runs skip them rather than wait on them again."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from fetchers import Fetcher
+from instrumentation import METRICS, parse_timed
+from page_cache import hash_text
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+DEFAULT_MANIFEST = 'crawl_manifest.sqlite'
+REFRESH_AFTER = 24 * 60 * 60  # a day, in seconds: completed pages younger than this are reused
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    tournament TEXT,
+    kind TEXT,  -- what was parsed from the page, e.g. 'motions', 'results' or 'speaker rounds'
+    status TEXT,  -- 'done' or 'failed'
+    content_hash TEXT,
+    records TEXT,  -- JSON of what was parsed from the page
+    checked_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS tournaments (
+    name TEXT,
+    kind TEXT,
+    completed_at REAL,
+    PRIMARY KEY (name, kind)
+);
+CREATE TABLE IF NOT EXISTS sites (  -- the links found on each tournament's landing page
+    url TEXT PRIMARY KEY,
+    tournament TEXT,
+    links TEXT,  -- JSON of the site map
+    checked_at REAL
+);
+CREATE TABLE IF NOT EXISTS dead_hosts (  -- hosts that refused connections, skipped until dead_until
+    host TEXT PRIMARY KEY,
+    trips INTEGER,  -- times the host was found dead in a row
+    dead_until REAL
+);
+CREATE TABLE IF NOT EXISTS dead_tournaments (  -- tournaments whose pages kept failing
+    url TEXT PRIMARY KEY,  -- the tournament's base URL
+    trips INTEGER,
+    dead_until REAL
+);
+"""
+
+
+class CrawlManifest:
+    """The crawl state of every page and tournament, stored in SQLite. Safe to share between
+    threads."""
+
+    def __init__(self, path: str = DEFAULT_MANIFEST, refresh_after: float = REFRESH_AFTER) -> None:
+        self.refresh_after = refresh_after
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock, self._conn:  # commit every change, so a crash keeps it
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_page(self, url: str) -> Optional[dict]:
+        """Returns the stored state of the given URL, or None if it was never crawled."""
+        rows = self._execute('SELECT kind, status, content_hash, records, checked_at FROM pages '
+                             'WHERE url = ?', (url,))
+        if len(rows) == 0:
+            return None
+        return dict(zip(['kind', 'status', 'content_hash', 'records', 'checked_at'], rows[0]))
+
+    def record_page(self, url: str, tournament: str, kind: str, content_hash: str,
+                    records: Any) -> None:
+        """Stores the records parsed from the given page."""
+        self._execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (url, tournament, kind, 'done', content_hash, json.dumps(records),
+                       time.time(), None))
+
+    def record_failure(self, url: str, tournament: str, kind: str, error: str) -> None:
+        """Marks the given page as failed, keeping any records it had before."""
+        self._execute('INSERT INTO pages (url, tournament, kind, status, checked_at, error) '
+                      'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                      'status = excluded.status, checked_at = excluded.checked_at, '
+                      'error = excluded.error',
+                      (url, tournament, kind, 'failed', time.time(), error))
+
+    def get_records(self, url: str, kind: str, content_hash: Optional[str] = None) -> Any:
+        """Returns the records stored for the given page if they were parsed as the given kind and
+        are still valid: checked within refresh_after seconds or, if content_hash is given, parsed
+        from content with that hash, in which case the page is marked as checked. Returns None if
+        the page has to be fetched or parsed again."""
+        page = self.get_page(url)
+        # records parsed as another kind (e.g. by an older parser) are parsed again
+        if page is None or page['status'] != 'done' or page['kind'] != kind:
+            return None
+        if content_hash is None:
+            if time.time() - page['checked_at'] >= self.refresh_after:
+                return None
+        elif page['content_hash'] != content_hash:
+            return None
+        else:
+            self.touch_page(url)
+        return json.loads(page['records'])
+
+    def touch_page(self, url: str) -> None:
+        """Marks the given page as checked and unchanged."""
+        self._execute('UPDATE pages SET checked_at = ? WHERE url = ?', (time.time(), url))
+
+    def complete_tournament(self, name: str, kind: str) -> None:
+        """Marks the given tab (e.g. 'results') of the tournament as fully crawled."""
+        self._execute('INSERT OR REPLACE INTO tournaments VALUES (?, ?, ?)',
+                      (name, kind, time.time()))
+
+    def get_completed_at(self, name: str, kind: str) -> Optional[float]:
+        """Returns when the given tab of the tournament was last fully crawled, or None if it
+        never was."""
+        rows = self._execute('SELECT completed_at FROM tournaments WHERE name = ? AND kind = ?',
+                             (name, kind))
+        return rows[0][0] if len(rows) > 0 else None
+
+    def is_tournament_fresh(self, name: str, kind: str) -> bool:
+        """Returns whether the given tab of the tournament was fully crawled within
+        refresh_after seconds."""
+        completed_at = self.get_completed_at(name, kind)
+        return completed_at is not None and time.time() - completed_at < self.refresh_after
+
+    def get_site_map(self, url: str) -> Optional[dict]:
+        """Returns the site map stored for the given landing page if it was checked within
+        refresh_after seconds, and None otherwise."""
+        rows = self._execute('SELECT links, checked_at FROM sites WHERE url = ?', (url,))
+        if len(rows) == 0 or time.time() - rows[0][1] >= self.refresh_after:
+            return None
+        return json.loads(rows[0][0])
+
+    def record_site_map(self, url: str, tournament: str, links: dict) -> None:
+        """Stores the site map found on the given landing page."""
+        self._execute('INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?)',
+                      (url, tournament, json.dumps(links), time.time()))
+
+    def get_dead_hosts(self) -> Dict[str, Tuple[int, float]]:
+        """Returns the number of trips and the time until which it is skipped of every host found
+        dead, whether or not that time has passed."""
+        return {host: (trips, dead_until) for host, trips, dead_until
+                in self._execute('SELECT host, trips, dead_until FROM dead_hosts')}
+
+    def record_dead_host(self, host: str, trips: int, dead_until: float) -> None:
+        """Marks the given host as dead until the given time."""
+        self._execute('INSERT OR REPLACE INTO dead_hosts VALUES (?, ?, ?)',
+                      (host, trips, dead_until))
+
+    def clear_dead_host(self, host: str) -> None:
+        """Forgets that the given host was dead, once it answers again."""
+        self._execute('DELETE FROM dead_hosts WHERE host = ?', (host,))
+
+    def get_dead_tournaments(self) -> Dict[str, Tuple[int, float]]:
+        """Returns the trips and skip time of every tournament found dead, by base URL, as
+        get_dead_hosts does for hosts."""
+        return {url: (trips, dead_until) for url, trips, dead_until
+                in self._execute('SELECT url, trips, dead_until FROM dead_tournaments')}
+
+    def record_dead_tournament(self, url: str, trips: int, dead_until: float) -> None:
+        """Marks the tournament at the given base URL as dead until the given time."""
+        self._execute('INSERT OR REPLACE INTO dead_tournaments VALUES (?, ?, ?)',
+                      (url, trips, dead_until))
+
+    def clear_dead_tournament(self, url: str) -> None:
+        """Forgets that the tournament at the given base URL was dead, once a page of it loads."""
+        self._execute('DELETE FROM dead_tournaments WHERE url = ?', (url,))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def is_tab_saved(filepath: os.PathLike, tournament: str, kind: str,
+                 manifest: Optional[CrawlManifest] = None) -> bool:
+    """Returns whether the given tab of the tournament (e.g. 'results'), saved at filepath, needs
+    no crawl. Tabs the manifest crawled are refreshed once it considers them stale. Tabs saved
+    without the manifest, e.g. before it existed, are kept as they are, so that a first run with a
+    new manifest doesn't crawl every saved tournament again."""
+    if manifest is not None and manifest.get_completed_at(tournament, kind) is not None:
+        return manifest.is_tournament_fresh(tournament, kind)
+    return os.path.exists(filepath)
+
+
+def fetch_and_parse(url: str, fetcher: Fetcher, parse: Callable[[str], Any],
+                    manifest: Optional[CrawlManifest] = None, tournament: str = '',
+                    kind: str = '') -> Any:
+    """Returns parse(html) for the page at the given URL.
+
+    With a manifest, the page's previous records are returned without fetching if they were
+    checked recently, and without parsing if the page's content hasn't changed since. Parsing is
+    recorded in instrumentation.METRICS under the given kind."""
+    if manifest is None:
+        return parse_timed(parse, fetcher.get(url), url, kind)
+
+    records = manifest.get_records(url, kind)
+    if records is not None:
+        METRICS.increment('manifest_hits', scraper=kind)
+        return records
+
+    try:
+        html = fetcher.get(url)
+        content_hash = hash_text(html)
+        records = manifest.get_records(url, kind, content_hash)
+        if records is not None:
+            METRICS.increment('manifest_hits', scraper=kind)
+            return records
+        records = parse_timed(parse, html, url, kind)
+    except Exception as error:
+        manifest.record_failure(url, tournament, kind, repr(error))
+        raise
+    manifest.record_page(url, tournament, kind, content_hash, records)
+    return records
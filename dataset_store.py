@@ -0,0 +1,334 @@
+"""A single SQLite store for every scraped tournament.
+
+Instead of one CSV per tournament and tab, all motions, results and speakers live in one
+database, each row tagged with its tournament, whose date, year, circuit and format are columns of
+the tournaments table. Loaders filter on those columns in SQL, so e.g. "BP tournaments in 2021" is
+one query rather than hundreds of file reads."""
+
+import ast
+import os
+import re
+import sqlite3
+import pandas as pd
+from pathlib import Path
+from instrumentation import METRICS, timed
+from tournament_index import load_tournament_index
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+
+DEFAULT_STORE = 'debate_tabs.sqlite'
+MASTER_CSV = 'Debating_Motions - Motions (Grey-_Added).csv'
+TAB_KINDS = ['Motions', 'Results', 'Speakers']  # the ' - <kind>.csv' files scraped per tournament
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tournaments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,  -- '<date> <tournament>', as in the scraped file names
+    date TEXT,
+    year INTEGER,
+    circuit TEXT,
+    format TEXT  -- 'BP' or '2-team', from the team positions in the results
+);
+CREATE INDEX IF NOT EXISTS tournaments_year ON tournaments (year);
+CREATE INDEX IF NOT EXISTS tournaments_circuit ON tournaments (circuit);
+CREATE INDEX IF NOT EXISTS tournaments_format ON tournaments (format);
+
+CREATE TABLE IF NOT EXISTS motions (
+    tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+    round TEXT,
+    info_slide TEXT,
+    motion TEXT
+);
+CREATE INDEX IF NOT EXISTS motions_tournament ON motions (tournament_id);
+
+CREATE TABLE IF NOT EXISTS results (  -- one row per team per room
+    tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+    round TEXT,
+    room INTEGER,  -- numbers the rooms of each round from 0
+    panel TEXT,
+    team TEXT,
+    position TEXT,  -- 'OG', 'OO', 'CG', 'CO' in BP; 'G'/'P'/'A' and 'O'/'N' in 2-team formats
+    points INTEGER,
+    team_id INTEGER,  -- entity_index id of the team, NULL until the store is indexed
+    ambiguous_room INTEGER  -- 1 if the room's teams were grouped by position only, see
+                            -- scrape_results.process_row; NULL in results scraped before
+);
+CREATE INDEX IF NOT EXISTS results_tournament ON results (tournament_id);
+
+CREATE TABLE IF NOT EXISTS result_adjudicators (  -- one row per adjudicator per room
+    tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+    round TEXT,
+    room INTEGER,  -- joins the results rows with the same tournament_id, round and room
+    adjudicator_id INTEGER NOT NULL,  -- entity_index id of the adjudicator
+    role TEXT  -- 'chair', 'wing', 'trainee' or 'panellist' from their marker, NULL if unmarked
+);
+CREATE INDEX IF NOT EXISTS result_adjudicators_tournament ON result_adjudicators (tournament_id);
+
+CREATE TABLE IF NOT EXISTS speakers (
+    tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+    speaker INTEGER,  -- numbers the speakers of each tournament from 0
+    name TEXT,
+    team TEXT,
+    categories TEXT,
+    team_id INTEGER,  -- entity_index ids, NULL until the store is indexed
+    speaker_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS speakers_tournament ON speakers (tournament_id);
+
+CREATE TABLE IF NOT EXISTS speaker_scores (  -- one row per speaker per round
+    tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+    speaker INTEGER,
+    round TEXT,  -- 'R1', 'R2', ...
+    score REAL,  -- NULL if the speaker missed the round
+    speaker_id INTEGER  -- entity_index id of the speaker, NULL until the store is indexed
+);
+CREATE INDEX IF NOT EXISTS speaker_scores_tournament ON speaker_scores (tournament_id);
+"""
+
+# the column names of each table in the scraped CSV files
+CSV_COLUMNS = {
+    'motions': {'Round': 'round', 'Info Slide': 'info_slide', 'Motion': 'motion'},
+    'results': {'Round Name': 'round', 'Room': 'room', 'Panel': 'panel', 'Team': 'team',
+                'Position': 'position', 'Points': 'points', 'Ambiguous Room': 'ambiguous_room'},
+    'speakers': {'Speaker': 'speaker', 'Name': 'name', 'Team': 'team',
+                 'Categories': 'categories'},
+    'speaker_scores': {'Speaker': 'speaker', 'Round': 'round', 'Score': 'score'},
+}
+# a scraped speaker tab's columns before its rounds (R1, R2, ...)
+SPEAKER_TAB_COLUMNS = ['Name', 'Team', 'Categories']
+
+# columns added to the tables since the first version of the store, added to older stores on connect
+ADDED_COLUMNS = {'results': {'team_id': 'INTEGER', 'ambiguous_room': 'INTEGER'},
+                 'speakers': {'team_id': 'INTEGER', 'speaker_id': 'INTEGER'},
+                 'speaker_scores': {'speaker_id': 'INTEGER'}}
+
+BP_POSITIONS = ['OG', 'OO', 'CG', 'CO']
+TWO_TEAM_POSITIONS = ['G', 'P', 'A', 'O', 'N']  # Government/Proposition/Affirmative vs. the rest
+
+Filter = Union[None, Any, Iterable[Any]]  # a value, or a list of accepted values
+
+
+def connect(path: str = DEFAULT_STORE) -> sqlite3.Connection:
+    """Opens the store at the given path, creating its tables if needed."""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    for table, columns in ADDED_COLUMNS.items():
+        add_missing_columns(conn, table, columns)
+    return conn
+
+
+def add_missing_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    """Adds the given columns, by name with their SQL type, to the table if it lacks them."""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(' + table + ')')}
+    for column, column_type in columns.items():
+        if column not in existing:
+            conn.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + column + ' ' + column_type)
+
+
+def get_results_format(positions: Iterable[str]) -> Optional[str]:
+    """Returns 'BP' or '2-team' depending on the given team positions, or None if there are
+    none."""
+    positions = set(positions)
+    if positions & set(BP_POSITIONS):
+        return 'BP'
+    if positions & set(TWO_TEAM_POSITIONS):
+        return '2-team'
+    return None
+
+
+def rankings_to_results(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts results scraped in the old format, one row per room with a 'Rankings' list of
+    '<points> <team> (<position>)' strings, into one row per team per room. Rooms whose Rankings
+    can't be read and rankings in any other shape are skipped, and counted as 'skipped_rankings'
+    in the instrumentation."""
+    records = []
+    rooms = {}  # number of rooms seen so far in each round
+    for round_name, panel, rankings in zip(df['Round Name'], df['Panel'], df['Rankings']):
+        room = rooms.get(round_name, 0)
+        rooms[round_name] = room + 1
+        try:
+            teams = ast.literal_eval(rankings)  # the list was saved as its Python repr
+        except (ValueError, SyntaxError):  # e.g. a missing or cut off list
+            METRICS.increment('skipped_rankings', reason='unreadable room')
+            continue
+        for team in teams:
+            match = re.fullmatch(r'(\d+) (.*) \(([A-Z]+)\)', str(team))
+            if match is None:
+                METRICS.increment('skipped_rankings', reason='unknown shape')
+                continue
+            records.append({'Round Name': round_name, 'Room': room, 'Panel': panel,
+                            'Team': match.group(2), 'Position': match.group(3),
+                            'Points': int(match.group(1))})
+    return pd.DataFrame.from_records(records, columns=list(CSV_COLUMNS['results']))
+
+
+def speaker_scores_to_rounds(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts a speaker tab scraped in the old format, with a 'Speaker Scores' list of score
+    strings per speaker, into one float column per round (R1, R2, ...), NaN for missed rounds."""
+    scores = [ast.literal_eval(scores) for scores in df['Speaker Scores']]
+    rounds = pd.DataFrame(scores, index=df.index).apply(pd.to_numeric, errors='coerce')
+    rounds.columns = ['R' + str(i + 1) for i in range(rounds.shape[1])]
+    return pd.concat([df[SPEAKER_TAB_COLUMNS], rounds], axis=1)
+
+
+def split_speaker_tab(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits a scraped speaker tab into its speakers, numbered from 0, and their scores, one row
+    per speaker per round."""
+    if 'Speaker Scores' in df.columns:
+        df = speaker_scores_to_rounds(df)
+    df = df.reset_index(drop=True).rename_axis('Speaker').reset_index()
+    rounds = [column for column in df.columns if column not in CSV_COLUMNS['speakers']]
+    scores_df = df.melt(id_vars='Speaker', value_vars=rounds, var_name='Round', value_name='Score')
+    scores_df['Score'] = pd.to_numeric(scores_df['Score'], errors='coerce')
+    return df[list(CSV_COLUMNS['speakers'])], scores_df
+
+
+def save_tournament(conn: sqlite3.Connection, name: str, circuit: Optional[str] = None,
+                    motions_df: Optional[pd.DataFrame] = None,
+                    results_df: Optional[pd.DataFrame] = None,
+                    speakers_df: Optional[pd.DataFrame] = None) -> int:
+    """Adds or updates the tournament with the given '<date> <tournament>' name, replacing any of
+    its tables that are given as scraped dataframes. Returns the tournament's id."""
+    date = name[:10] if re.match(r'\d{4}-\d{2}-\d{2} ', name) else None
+    year = int(date[:4]) if date else None
+    if results_df is not None and 'Rankings' in results_df.columns:
+        results_df = rankings_to_results(results_df)
+    results_format = None if results_df is None else get_results_format(results_df['Position'])
+    scores_df = None
+    if speakers_df is not None:
+        speakers_df, scores_df = split_speaker_tab(speakers_df)
+
+    conn.execute('INSERT INTO tournaments (name, date, year, circuit, format) '
+                 'VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET '
+                 'circuit = coalesce(excluded.circuit, circuit), '
+                 'format = coalesce(excluded.format, format)',
+                 (name, date, year, circuit, results_format))
+    tournament_id = conn.execute('SELECT id FROM tournaments WHERE name = ?', (name,)).fetchone()[0]
+
+    for table, df in [('motions', motions_df), ('results', results_df),
+                      ('speakers', speakers_df), ('speaker_scores', scores_df)]:
+        if df is None:
+            continue
+        columns = CSV_COLUMNS[table]
+        df = df[[column for column in columns if column in df.columns]].rename(columns=columns)
+        df = df.astype(object).where(df.notna(), None)  # store missing values as NULL
+        df.insert(0, 'tournament_id', tournament_id)
+        conn.execute('DELETE FROM ' + table + ' WHERE tournament_id = ?', (tournament_id,))
+        conn.executemany('INSERT INTO ' + table + ' (' + ', '.join(df.columns) + ') VALUES (' +
+                         ', '.join('?' * len(df.columns)) + ')', df.itertuples(index=False))
+    if results_df is not None:  # its rooms are linked to their adjudicators again when indexed
+        conn.execute('DELETE FROM result_adjudicators WHERE tournament_id = ?', (tournament_id,))
+    return tournament_id
+
+
+def get_circuits(master_csv: str = MASTER_CSV) -> Dict[str, str]:
+    """Returns a dictionary mapping each '<date> <tournament>' name in the motions master CSV to its
+    circuit."""
+    index = load_tournament_index(master_csv).dropna(subset=['circuit'])
+    return dict(zip(index['name'], index['circuit']))
+
+
+@timed
+def import_csv_directory(folder: str = 'scraped_data/', master_csv: Optional[str] = MASTER_CSV,
+                         path: str = DEFAULT_STORE) -> int:
+    """Imports every '<date> <tournament> - <kind>.csv' file in the given folder into the store,
+    taking circuits from the motions master CSV. Returns the number of tournaments imported."""
+    circuits = get_circuits(master_csv) if master_csv is not None else {}
+
+    tournaments: Dict[str, Dict[str, Path]] = {}  # tournament name to its files by kind
+    for file in os.listdir(folder):
+        match = re.fullmatch(r'(.+) - (' + '|'.join(TAB_KINDS) + r')\.csv', file)
+        if match:
+            tournaments.setdefault(match.group(1), {})[match.group(2)] = Path(folder) / file
+
+    conn = connect(path)
+    with conn:  # one transaction for the whole import
+        for name, files in tournaments.items():
+            dfs = {kind: pd.read_csv(files[kind], index_col=0) if kind in files else None
+                   for kind in TAB_KINDS}
+            save_tournament(conn, name, circuits.get(name), dfs['Motions'], dfs['Results'],
+                            dfs['Speakers'])
+    conn.close()
+    return len(tournaments)
+
+
+def _make_filters(tournament: Filter = None, year: Filter = None, circuit: Filter = None,
+                  format: Filter = None) -> Tuple[str, List[Any]]:
+    """Returns a SQL WHERE clause on the tournaments table t and its parameters."""
+    clauses, params = [], []
+    for column, value in [('name', tournament), ('year', year), ('circuit', circuit),
+                          ('format', format)]:
+        if value is None:
+            continue
+        values = [value] if isinstance(value, (str, int)) else list(value)
+        clauses.append('t.' + column + ' IN (' + ', '.join('?' * len(values)) + ')')
+        params.extend(values)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _load(table: str, path: str, filters: Dict[str, Filter]) -> pd.DataFrame:
+    """Returns the rows of the given table joined with their tournament's details."""
+    where, params = _make_filters(**filters)
+    conn = connect(path)
+    df = pd.read_sql_query('SELECT t.id AS tournament_id, t.name AS tournament, t.date, t.year, '
+                           't.circuit, t.format, x.* FROM ' + table + ' x '
+                           'JOIN tournaments t ON t.id = x.tournament_id' + where +
+                           ' ORDER BY x.rowid', conn, params=params)
+    conn.close()
+    df = df.loc[:, ~df.columns.duplicated()]  # x.tournament_id repeats t.id
+    df['date'] = pd.to_datetime(df['date'])
+    df['year'] = df['year'].astype('Int64')
+    for column in ['tournament', 'circuit', 'format']:
+        df[column] = df[column].astype('category')
+    for column in ADDED_COLUMNS.get(table, []):
+        df[column] = df[column].astype('Int64')  # entity ids, missing until indexed
+    if table == 'results':
+        df['room'] = df['room'].astype('int32')
+        df['points'] = df['points'].astype('int8')
+        df['position'] = pd.Categorical(df['position'], BP_POSITIONS + TWO_TEAM_POSITIONS)
+    elif table == 'speaker_scores':
+        df['speaker'] = df['speaker'].astype('int32')
+        df['round'] = df['round'].astype('category')
+        df['score'] = df['score'].astype('float64')  # NaN for missed rounds
+    return df
+
+
+def load_tournaments(path: str = DEFAULT_STORE, **filters: Filter) -> pd.DataFrame:
+    """Returns the tournaments in the store, filtered by any of tournament, year, circuit and
+    format, e.g. load_tournaments(format='BP', year=2021)."""
+    where, params = _make_filters(**filters)
+    conn = connect(path)
+    df = pd.read_sql_query('SELECT * FROM tournaments t' + where + ' ORDER BY t.date', conn,
+                           params=params)
+    conn.close()
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def load_motions(path: str = DEFAULT_STORE, **filters: Filter) -> pd.DataFrame:
+    """Returns the motions of every matching tournament. See load_tournaments for filters."""
+    return _load('motions', path, filters)
+
+
+def load_results(path: str = DEFAULT_STORE, **filters: Filter) -> pd.DataFrame:
+    """Returns the results of every matching tournament, one row per team per room with its round,
+    room, panel, team, position, points, team_id (see entity_index.index_store) and
+    ambiguous_room. See load_tournaments for filters."""
+    return _load('results', path, filters)
+
+
+def load_speakers(path: str = DEFAULT_STORE, **filters: Filter) -> pd.DataFrame:
+    """Returns the speakers of every matching tournament with their team, categories, team_id and
+    speaker_id, numbered from 0 in each tournament. See load_tournaments for filters."""
+    return _load('speakers', path, filters)
+
+
+def load_speaker_scores(path: str = DEFAULT_STORE, **filters: Filter) -> pd.DataFrame:
+    """Returns the speaker scores of every matching tournament, one row per speaker per round with
+    a float score, NaN if the speaker missed the round. See load_tournaments for filters."""
+    return _load('speaker_scores', path, filters)
+
+
+if __name__ == '__main__':
+    print(import_csv_directory(), 'tournaments imported')
@@ -0,0 +1,39 @@
+"""Counts debates in the scraped tabs without pandas, so that quick queries start fast.
+
+Importing pandas takes most of a second, which dwarfs reading a folder of results files or one
+SQL count. These counters only use the standard library, and analyze_team_positions re-exports
+them."""
+
+import csv
+import os
+import sqlite3
+from pathlib import Path
+
+
+def count_debates(folder: str) -> int:
+    """Count total number of debates in the given folder.
+
+    Preconditions
+        - folder starts without '/' and ends with '/'"""
+    debate_count = 0
+    for file in os.listdir(folder):  # for every file in the given folder
+        if file[-14:] == ' - Results.csv':  # if results file
+            with open(Path(folder) / file, newline='', encoding='utf-8') as results_file:
+                reader = csv.DictReader(results_file)
+                if 'Rankings' in (reader.fieldnames or []):  # old format, one row per room
+                    debate_count += sum(1 for _ in reader)
+                else:  # one row per team per room
+                    debate_count += len({(row['Round Name'], row['Room']) for row in reader})
+    return debate_count
+
+
+def count_debates_in_store(path: str) -> int:
+    """Count total number of debates in the store at the given path, 0 if it has no results."""
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'results'").fetchone() is None:
+            return 0
+        return conn.execute('SELECT count(*) FROM (SELECT DISTINCT tournament_id, round, room '
+                            'FROM results)').fetchone()[0]
+    finally:
+        conn.close()
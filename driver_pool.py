@@ -0,0 +1,158 @@
+"""A pool of headless Edge drivers for pages that really need a browser.
+
+Drivers are health-checked when leased and replaced after a number of pages or once the browser
+uses too much memory, so a long crawl doesn't slowly leak memory through one browser."""
+
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from typing import Iterator, Optional
+
+
+DRIVER_PATH_VARIABLE = 'EDGE_DRIVER_PATH'  # environment variable overriding the driver download
+
+
+def get_driver_path() -> str:
+    """Returns the msedgedriver path from the EDGE_DRIVER_PATH environment variable, or installs
+    the matching driver with webdriver_manager."""
+    if os.environ.get(DRIVER_PATH_VARIABLE):
+        return os.environ[DRIVER_PATH_VARIABLE]
+    from webdriver_manager.microsoft import EdgeChromiumDriverManager
+    return EdgeChromiumDriverManager().install()  # get the latest Edge driver for Selenium
+
+
+class PooledDriver:
+    """A driver in the pool, with how many pages it has loaded."""
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+        self.pages = 0
+
+
+class DriverPool:
+    """Hands out up to size Edge drivers, one per caller at a time."""
+
+    def __init__(self, size: int = 2, headless: bool = True, driver_path: Optional[str] = None,
+                 max_pages: int = 200, max_memory_mb: float = 1024, page_timeout: float = 30) \
+            -> None:
+        self.size = size
+        self.headless = headless
+        self.driver_path = driver_path
+        self.max_pages = max_pages  # recycle a driver after this many pages
+        self.max_memory_mb = max_memory_mb  # or once its browser uses this much memory
+        self.page_timeout = page_timeout  # seconds before a page load is abandoned
+        self._idle: 'queue.Queue[Optional[PooledDriver]]' = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)  # slots start empty and drivers are started on first use
+        self._lock = threading.Lock()
+        self._drivers = set()  # every live driver, so close() can quit them
+
+    def _start_driver(self) -> PooledDriver:
+        from selenium import webdriver
+        from selenium.webdriver.edge.service import Service
+
+        if self.driver_path is None:
+            self.driver_path = get_driver_path()
+        options = webdriver.EdgeOptions()
+        if self.headless:
+            options.add_argument('--headless=new')
+        driver = webdriver.Edge(service=Service(self.driver_path), options=options)
+        driver.set_page_load_timeout(self.page_timeout)
+        pooled = PooledDriver(driver)
+        with self._lock:
+            self._drivers.add(pooled)
+        return pooled
+
+    def _quit(self, pooled: PooledDriver) -> None:
+        with self._lock:
+            self._drivers.discard(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception:  # the browser may already be gone
+            pass
+
+    def _is_healthy(self, pooled: PooledDriver) -> bool:
+        """Returns whether the driver's browser still responds."""
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def get_memory_mb(self, pooled: PooledDriver) -> Optional[float]:
+        """Returns the memory used by the driver's browser processes, or None if psutil isn't
+        installed."""
+        try:
+            import psutil
+        except ImportError:
+            return None
+        try:
+            process = psutil.Process(pooled.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / 1024 ** 2
+        except (psutil.Error, AttributeError):
+            return None
+
+    def _needs_recycling(self, pooled: PooledDriver) -> bool:
+        if pooled.pages >= self.max_pages:
+            return True
+        memory = self.get_memory_mb(pooled)
+        return memory is not None and memory > self.max_memory_mb
+
+    @contextmanager
+    def lease(self) -> Iterator:
+        """Lends a healthy driver for the duration of the with block, waiting for one to be free.
+        The driver counts one page load per lease."""
+        pooled = self._idle.get()
+        try:
+            if pooled is not None and not self._is_healthy(pooled):
+                self._quit(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = self._start_driver()
+            yield pooled.driver
+            pooled.pages += 1
+        except Exception:
+            if pooled is not None and not self._is_healthy(pooled):  # don't return a dead driver
+                self._quit(pooled)
+                pooled = None
+            raise
+        finally:
+            if pooled is not None and self._needs_recycling(pooled):
+                self._quit(pooled)
+                pooled = None
+            self._idle.put(pooled)
+
+    def close(self) -> None:
+        """Quits every driver in the pool."""
+        with self._lock:
+            drivers = list(self._drivers)
+        for pooled in drivers:
+            self._quit(pooled)
+
+
+_shared_pool: Optional[DriverPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool(**kwargs) -> DriverPool:
+    """Returns the pool shared by every Selenium fetcher, creating it with the given DriverPool
+    arguments on the first call."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = DriverPool(**kwargs)
+            atexit.register(_shared_pool.close)
+        return _shared_pool
+
+
+def close_shared_pool() -> None:
+    """Quits the shared pool's drivers. A new pool is created on the next get_shared_pool call."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is not None:
+            _shared_pool.close()
+            _shared_pool = None
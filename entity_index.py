@@ -0,0 +1,287 @@
+"""Stable ids for the teams, speakers, adjudicators and institutions of every scraped tournament.
+
+Names are free text that differs between tabs ('Daniel G Yim' vs. 'Daniel Yim', accents, case,
+the Ⓒ/Ⓦ/Ⓣ markers after adjudicator names), so every spelling seen is kept as an alias of one
+entity. A new name is first looked up exactly, after normalization. Failing that, it is only
+compared with the entities sharing its blocking key (for people, their first and last name), so
+resolving stays linear in the number of names rather than comparing every pair.
+
+Some names don't identify anyone across tournaments: teams ('CUDS A' is a different team every
+year) and placeholders ('Speaker 1', 'Swing A', 'Redacted'). These are scoped: a team is an entity
+of its tournament, and a placeholder person one of their tournament and team.
+
+The index lives in the dataset store, and index_store writes the ids onto the rows of its results,
+speakers and speaker scores, and links each room of the results to its adjudicators. Ids never
+change once given, so results, speakers and ratings can be joined across tournaments on
+integers."""
+
+import re
+import sqlite3
+import unicodedata
+from itertools import repeat
+import pandas as pd
+from dataset_store import DEFAULT_STORE, add_missing_columns, connect
+from instrumentation import timed
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+ENTITY_KINDS = ['team', 'speaker', 'adjudicator', 'institution']
+PEOPLE_KINDS = {'speaker', 'adjudicator'}  # kinds whose names can be matched loosely
+# the role of each marker after adjudicator names in results panels
+ADJUDICATOR_ROLES = {'Ⓒ': 'chair', 'Ⓣ': 'trainee', 'Ⓦ': 'wing', 'Ⓟ': 'panellist'}
+ADJUDICATOR_MARKERS = ''.join(ADJUDICATOR_ROLES)
+# the institution and code of a team name, e.g. 'Oxford A' or 'Monash 1'
+INSTITUTION_PATTERN = re.compile(r'^(.+?)\s+(?:[A-Z]{1,2}|\d{1,2})$')
+# normalized names standing in for a person, e.g. 'speaker 2', 'swing 1a', 'name redacted'
+PERSON_PLACEHOLDER = re.compile(r'^(?:(?:name|tech|swing) )?(?:speaker|swings?|redacted)'
+                                r'(?: speaker)?(?: ?[a-z]?\d*[a-z]?)?$')
+# normalized names of swing, redacted and bye teams, e.g. 'swing b', 'sjii swing', 'team 1120'
+TEAM_PLACEHOLDER = re.compile(r'^(?:swings?|redacted|bye)\b|\bswing(?: [a-z]| ?\d+[a-z]?)?$|'
+                              r'^(?:covid bye|team \d+)$')
+
+# a tournament id and optionally a narrower scope within it, e.g. a placeholder speaker's team
+Scope = Tuple[int, Optional[str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,  -- 'team', 'speaker', 'adjudicator' or 'institution'
+    name TEXT NOT NULL,  -- the first spelling seen
+    block TEXT NOT NULL,  -- blocking key; only entities sharing it are compared
+    tournament_id INTEGER  -- the tournament of a scoped entity, NULL for the others
+);
+CREATE INDEX IF NOT EXISTS entities_block ON entities (kind, block);
+CREATE TABLE IF NOT EXISTS entity_aliases (
+    kind TEXT NOT NULL,
+    alias TEXT NOT NULL,  -- a normalized spelling, prefixed with '<scope>|' for scoped entities
+    entity_id INTEGER NOT NULL REFERENCES entities (id),
+    PRIMARY KEY (kind, alias)
+);
+"""
+
+
+def normalize_name(name: str) -> str:
+    """Returns the name without accents, markers or punctuation, in lowercase with single spaces,
+    e.g. 'jose garcia' for ' José García Ⓒ'. Names made only of symbols, like the team '🥺', are
+    kept as their symbols."""
+    name = str(name).translate(str.maketrans('', '', ADJUDICATOR_MARKERS))
+    symbols = ''.join(char for char in name if unicodedata.category(char) == 'So')
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r'[^\w\s]', ' ', name.casefold())
+    return ' '.join(name.split()) or symbols
+
+
+def is_placeholder(kind: str, name: str) -> bool:
+    """Returns whether the given team or person name is a placeholder rather than a name, like
+    'Speaker 1', '[Redacted]' or the team 'Swing A'."""
+    pattern = TEAM_PLACEHOLDER if kind in ('team', 'institution') else PERSON_PLACEHOLDER
+    return pattern.search(normalize_name(name)) is not None
+
+
+def get_block(kind: str, alias: str) -> str:
+    """Returns the blocking key of the given normalized name: a person's first and last name, or
+    the whole name for teams and institutions."""
+    words = alias.split()
+    if kind in PEOPLE_KINDS and len(words) > 1:
+        return words[0] + ' ' + words[-1]
+    return alias
+
+
+def is_same_person(alias: str, other: str) -> bool:
+    """Returns whether two names with the same first and last name can be the same person: their
+    middle names must match, allowing initials and a missing middle name."""
+    middle, other_middle = alias.split()[1:-1], other.split()[1:-1]
+    return all(a.startswith(b) or b.startswith(a) for a, b in zip(middle, other_middle))
+
+
+def get_panel_roles(panel: str) -> List[Tuple[str, Optional[str]]]:
+    """Returns the adjudicators in the given results panel with their roles, e.g.
+    [('Seamus Dove', 'chair'), ('Margaret Tsai', 'trainee')] for 'Seamus DoveⒸ , Margaret TsaiⓉ'.
+    Adjudicators without a marker have the role None."""
+    adjudicators = []
+    for name in str(panel).split(','):
+        roles = [role for marker, role in ADJUDICATOR_ROLES.items() if marker in name]
+        name = name.translate(str.maketrans('', '', ADJUDICATOR_MARKERS)).strip()
+        if name != '':
+            adjudicators.append((name, roles[0] if len(roles) > 0 else None))
+    return adjudicators
+
+
+def split_panel(panel: str) -> List[str]:
+    """Returns the adjudicator names in the given results panel, e.g. ['Seamus Dove',
+    'Margaret Tsai'] for 'Seamus DoveⒸ , Margaret TsaiⓉ'."""
+    return [name for name, _ in get_panel_roles(panel)]
+
+
+def get_institution(team: str) -> Optional[str]:
+    """Returns the institution in a team name like 'Oxford A' or 'Monash 1', or None for names
+    without an institution code and for swing teams."""
+    match = INSTITUTION_PATTERN.match(str(team).strip())
+    return match.group(1) if match and not is_placeholder('team', team) else None
+
+
+class EntityIndex:
+    """The entities and aliases stored in the dataset store at the given path."""
+
+    def __init__(self, path: str = DEFAULT_STORE) -> None:
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        add_missing_columns(self.conn, 'entities', {'tournament_id': 'INTEGER'})
+        self._aliases: Dict[str, Dict[str, int]] = {}  # kind to alias to id, loaded lazily
+        self._blocks: Dict[str, Dict[str, List[int]]] = {}  # kind to block to ids
+        self._members: Dict[int, List[str]] = {}  # id to aliases, for people
+
+    def _load(self, kind: str) -> None:
+        if kind in self._aliases:
+            return
+        self._aliases[kind] = dict(self.conn.execute(
+            'SELECT alias, entity_id FROM entity_aliases WHERE kind = ?', (kind,)))
+        for alias, entity_id in self._aliases[kind].items():
+            self._members.setdefault(entity_id, []).append(alias)
+        self._blocks[kind] = {}
+        for entity_id, block in self.conn.execute('SELECT id, block FROM entities WHERE kind = ?',
+                                                  (kind,)):
+            self._blocks[kind].setdefault(block, []).append(entity_id)
+
+    def _find(self, kind: str, alias: str) -> Optional[int]:
+        """Returns the id of the entity that the given new alias belongs to, if any."""
+        if kind not in PEOPLE_KINDS:
+            return None  # only exact matches, which are aliases already
+        for entity_id in self._blocks[kind].get(get_block(kind, alias), []):
+            if all(is_same_person(alias, other) for other in self._members[entity_id]):
+                return entity_id
+        return None
+
+    def resolve(self, kind: str, names: Iterable[str],
+                scopes: Optional[Iterable[Scope]] = None) -> List[Optional[int]]:
+        """Returns the id of the entity of each of the given names, adding new entities and
+        aliases as needed. Call commit to save them.
+
+        Teams and placeholder names (see is_placeholder) are only resolved within their scope, one
+        per name, and placeholder teams and people get no id (None) without one, like blank
+        names. Teams without a scope are matched exactly across tournaments."""
+        self._load(kind)
+        aliases, blocks = self._aliases[kind], self._blocks[kind]
+        ids = []
+        for name, scope in zip(names, scopes if scopes is not None else repeat(None)):
+            alias = normalize_name(name) if isinstance(name, str) else ''
+            placeholder = alias != '' and is_placeholder(kind, alias)
+            if alias == '' or placeholder and scope is None:
+                ids.append(None)
+                continue
+            tournament_id = None
+            if scope is not None and (kind == 'team' or placeholder):
+                tournament_id, within = int(scope[0]), scope[1]
+                prefix = str(tournament_id) if within is None else \
+                    str(tournament_id) + ' ' + normalize_name(within)
+                alias = prefix + '|' + alias
+            if alias not in aliases:
+                entity_id = self._find(kind, alias) if tournament_id is None else None
+                if entity_id is None:
+                    block = alias if tournament_id is not None else get_block(kind, alias)
+                    entity_id = self.conn.execute(
+                        'INSERT INTO entities (kind, name, block, tournament_id) '
+                        'VALUES (?, ?, ?, ?)', (kind, name.strip(), block, tournament_id)).lastrowid
+                    blocks.setdefault(block, []).append(entity_id)
+                self.conn.execute('INSERT INTO entity_aliases VALUES (?, ?, ?)',
+                                  (kind, alias, entity_id))
+                aliases[alias] = entity_id
+                self._members.setdefault(entity_id, []).append(alias)
+            ids.append(aliases[alias])
+        return ids
+
+    def get_names(self, kind: str) -> Dict[int, str]:
+        """Returns the name of every entity of the given kind by id, followed by its tournament
+        for scoped entities, e.g. 'CUDS A (2021-10-16 Hart House IV 2021)'."""
+        return dict(self.conn.execute(
+            "SELECT e.id, e.name || coalesce(' (' || t.name || ')', '') FROM entities e "
+            'LEFT JOIN tournaments t ON t.id = e.tournament_id WHERE e.kind = ?', (kind,)))
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+def _get_ids(index: EntityIndex, kind: str, df: pd.DataFrame, column: str,
+             scopes: List[Scope]) -> pd.Series:
+    """Returns the entity id of the name in the given column of each row of df, as resolved within
+    the row's scope."""
+    ids = index.resolve(kind, df[column], scopes)
+    return pd.Series(ids, index=df.index, dtype='Int64')
+
+
+def _store_ids(conn: sqlite3.Connection, table: str, column: str, df: pd.DataFrame) -> None:
+    """Writes the ids in the given column of df onto the table's rows with the same rowid."""
+    df = df.dropna(subset=[column])
+    conn.executemany('UPDATE ' + table + ' SET ' + column + ' = ? WHERE rowid = ?',
+                     zip(df[column].astype(int).tolist(), df['rowid'].tolist()))
+
+
+@timed
+def index_store(path: str = DEFAULT_STORE) -> Dict[str, int]:
+    """Gives an id to every team, speaker, adjudicator and institution in the store, writes the
+    ids of teams and speakers onto their rows of the results, speakers and speaker_scores tables,
+    and links every room of the results to its adjudicators in the result_adjudicators table.
+    Only rows without ids and rooms without links are resolved, so indexing again after an import
+    only reads the new tournaments. Returns the number of entities of each kind."""
+    index = EntityIndex(path)
+    conn = index.conn
+    results_df = pd.read_sql_query('SELECT rowid, tournament_id, team FROM results '
+                                   'WHERE team_id IS NULL', conn)
+    speakers_df = pd.read_sql_query('SELECT rowid, tournament_id, speaker, name, team '
+                                    'FROM speakers WHERE team_id IS NULL OR speaker_id IS NULL',
+                                    conn)
+
+    # every team of a tournament once, teams being scoped by tournament
+    teams = pd.concat([results_df[['tournament_id', 'team']],
+                       speakers_df[['tournament_id', 'team']]])
+    teams = teams.dropna().drop_duplicates(ignore_index=True)
+    teams['team_id'] = _get_ids(index, 'team', teams, 'team',
+                                [(tournament_id, None) for tournament_id in teams['tournament_id']])
+    results_df = results_df.merge(teams, how='left', on=['tournament_id', 'team'])
+    speakers_df = speakers_df.merge(teams, how='left', on=['tournament_id', 'team'])
+
+    # placeholder speakers are scoped by tournament and team (or by their own row if they have no
+    # team, like the '—' team of redacted speakers), the others resolved across tournaments
+    speakers_df['speaker_id'] = _get_ids(
+        index, 'speaker', speakers_df, 'name',
+        [(tournament_id, 'team ' + team if normalize_name(team) != '' else
+          'speaker ' + str(speaker))
+         for tournament_id, speaker, team in speakers_df[['tournament_id', 'speaker', 'team']]
+         .fillna({'team': ''}).itertuples(index=False)])
+    _store_ids(conn, 'results', 'team_id', results_df)
+    _store_ids(conn, 'speakers', 'team_id', speakers_df)
+    _store_ids(conn, 'speakers', 'speaker_id', speakers_df)
+    conn.execute('UPDATE speaker_scores SET speaker_id = (SELECT s.speaker_id FROM speakers s '
+                 'WHERE s.tournament_id = speaker_scores.tournament_id AND '
+                 's.speaker = speaker_scores.speaker) WHERE speaker_id IS NULL')
+
+    rooms_df = pd.read_sql_query(
+        'SELECT DISTINCT tournament_id, round, room, panel FROM results r '
+        'WHERE panel IS NOT NULL AND NOT EXISTS (SELECT 1 FROM result_adjudicators a '
+        'WHERE a.tournament_id = r.tournament_id AND a.round IS r.round AND a.room IS r.room)',
+        conn)
+    adjudicators = [(tournament_id, round_name, room, name, role) for tournament_id, round_name,
+                    room, panel in rooms_df.itertuples(index=False)
+                    for name, role in get_panel_roles(panel)]
+    adjudicator_ids = index.resolve('adjudicator', [row[3] for row in adjudicators],
+                                    [(row[0], None) for row in adjudicators])
+    conn.executemany('INSERT INTO result_adjudicators VALUES (?, ?, ?, ?, ?)',
+                     [(int(tournament_id), round_name, None if pd.isna(room) else int(room),
+                       adjudicator_id, role)
+                      for (tournament_id, round_name, room, _, role), adjudicator_id
+                      in zip(adjudicators, adjudicator_ids) if adjudicator_id is not None])
+    index.resolve('institution', dict.fromkeys(filter(None, map(get_institution,
+                                                                teams['team'].unique()))))
+    counts = {kind: len(index.get_names(kind)) for kind in ENTITY_KINDS}
+    index.close()
+    return counts
+
+
+if __name__ == '__main__':
+    print(index_store())
@@ -0,0 +1,167 @@
+"""Fetchers that download tab pages for the scrapers.
+
+The scrapers only need the HTML of each page, so by default pages are downloaded with a pooled
+HTTP session. A Selenium browser is kept as a fallback for pages that need one."""
+
+import threading
+import time
+import requests
+from instrumentation import METRICS
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+from typing import Callable, Dict, Mapping, NamedTuple, Optional
+
+
+FALLBACK_STATUSES = {403, 429, 500, 502, 503, 504}  # statuses worth retrying in a real browser
+CONNECT_TIMEOUT = 10.0  # seconds to wait for a connection, so dead hosts fail fast
+
+
+class Page(NamedTuple):
+    """A downloaded page."""
+    url: str
+    status: int
+    text: str
+    headers: Mapping[str, str]
+
+
+class Fetcher:
+    """Abstract fetcher. Subclasses implement _fetch."""
+
+    def __init__(self) -> None:
+        self.pages = 0  # number of pages fetched so far
+        self.seconds = 0.0  # total time spent fetching
+        self._stats_lock = threading.Lock()
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        raise NotImplementedError
+
+    def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> Page:
+        """Downloads the given URL, sending any extra request headers, and returns the page.
+
+        Each fetch is recorded in instrumentation.METRICS by fetcher class and host, so wrapping
+        fetchers (e.g. the page cache) and the fetchers doing the downloads are told apart."""
+        labels = {'fetcher': type(self).__name__, 'host': urlparse(url).netloc.lower()}
+        start = time.perf_counter()
+        try:
+            page = self._fetch(url, headers)
+        except Exception:
+            METRICS.increment('fetch_failures', **labels)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            METRICS.observe('fetch_seconds', seconds, url, **labels)
+        if page.status >= 400:
+            METRICS.increment('fetch_failures', **labels)
+        METRICS.increment('fetch_bytes', len(page.text.encode('utf-8', 'replace')), **labels)
+        with self._stats_lock:
+            self.pages += 1
+            self.seconds += seconds
+        return page
+
+    def get(self, url: str) -> str:
+        """Returns the HTML of the given URL."""
+        return self.fetch(url).text
+
+    def pages_per_second(self) -> float:
+        """Returns the average fetch throughput of this fetcher."""
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def close(self) -> None:
+        """Releases connections or browsers held by this fetcher."""
+
+
+class HttpFetcher(Fetcher):
+    """Downloads pages with a keep-alive, gzip-enabled requests session. Connecting gives up
+    after connect_timeout seconds, and reading a page after timeout seconds without data."""
+
+    def __init__(self, pool_size: int = 10, timeout: float = 30.0,
+                 connect_timeout: float = CONNECT_TIMEOUT) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                     'User-Agent': 'Debate-Tabs scraper'})
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        response = self.session.get(url, headers=headers,
+                                    timeout=(self.connect_timeout, self.timeout))
+        return Page(response.url, response.status_code, response.text, response.headers)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class SeleniumFetcher(Fetcher):
+    """Loads pages in headless Edge browsers leased from a driver pool and returns the rendered
+    page source. By default, every Selenium fetcher shares one pool."""
+
+    def __init__(self, pool=None) -> None:
+        super().__init__()
+        self.pool = pool
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        if self.pool is None:  # only create the pool once a page needs a browser
+            from driver_pool import get_shared_pool
+            self.pool = get_shared_pool()
+        with self.pool.lease() as driver:
+            driver.get(url)
+            return Page(driver.current_url, 200, driver.page_source, {})
+
+
+class FallbackFetcher(Fetcher):
+    """Uses the primary fetcher, and the fallback fetcher whenever the primary one fails."""
+
+    def __init__(self, primary: Fetcher, fallback: Fetcher) -> None:
+        super().__init__()
+        self.primary = primary
+        self.fallback = fallback
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        try:
+            page = self.primary.fetch(url, headers)
+        except requests.RequestException:
+            return self.fallback.fetch(url, headers)
+        if page.status in FALLBACK_STATUSES:
+            return self.fallback.fetch(url, headers)
+        return page
+
+    def close(self) -> None:
+        self.primary.close()
+        self.fallback.close()
+
+
+FETCHER_BACKENDS: Dict[str, Callable[[], Fetcher]] = {
+    'http': HttpFetcher,
+    'selenium': SeleniumFetcher,
+    'auto': lambda: FallbackFetcher(HttpFetcher(), SeleniumFetcher()),
+}
+
+
+def make_fetcher(backend: str = 'auto', cache_dir: Optional[str] = 'page_cache/',
+                 ttl: Optional[float] = None, offline: bool = False, retries: Optional[int] = None,
+                 breaker=None, limiter=None) -> Fetcher:
+    """Returns a new fetcher for the given backend: 'http', 'selenium' or 'auto'.
+
+    'auto' fetches over plain HTTP and only starts a browser if a page can't be fetched that way.
+    Failed fetches are retried retries times (by default politeness.RETRIES) with backoff, skipping
+    sites the given politeness.CircuitBreaker considers dead and holding a host slot of the given
+    politeness.AdaptiveLimiter for each attempt. Pages go through the page cache in cache_dir,
+    unless cache_dir is None. In offline mode, only cached pages are returned."""
+    if backend not in FETCHER_BACKENDS:
+        raise ValueError('Unknown fetcher backend: ' + backend)
+    fetcher = FETCHER_BACKENDS[backend]()
+    if retries != 0 or breaker is not None or limiter is not None:
+        from politeness import RETRIES, RetryingFetcher
+        fetcher = RetryingFetcher(fetcher, RETRIES if retries is None else retries,
+                                  breaker=breaker, limiter=limiter)
+    if cache_dir is None:
+        return fetcher
+
+    from page_cache import CachingFetcher, PageCache, DEFAULT_TTL
+    return CachingFetcher(fetcher, PageCache(cache_dir), DEFAULT_TTL if ttl is None else ttl,
+                          offline)
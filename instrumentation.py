@@ -0,0 +1,238 @@
+"""Instrumentation of crawls and analyses: counters, latency histograms and a run report.
+
+Fetchers, scrapers and analyses record into the shared METRICS registry as they run: how long each
+fetch and parse took, how many bytes and rows they produced and how many failed, by fetcher,
+scraper and host. Durations go into histograms with fixed buckets, so recording stays cheap and
+takes constant memory over a multi-hour crawl, and the slowest URLs are kept apart to point at the
+hot spots. The registry exports as a JSON run report or in the Prometheus text format, so runs can
+be compared over time."""
+
+import bisect
+import heapq
+import json
+import math
+import threading
+import time
+import pandas as pd
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# upper bounds in seconds of the histogram buckets, from a cached page to a cold-starting dyno
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+           60.0)
+SLOWEST = 20  # slowest URLs kept in the report
+DEFAULT_REPORT = 'run_report.json'
+PROMETHEUS_PREFIX = 'debate_tabs_'
+
+Labels = Tuple[Tuple[str, str], ...]  # sorted (name, value) pairs
+
+
+class Histogram:
+    """The number of observations in each of the given buckets, and their count and sum."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one for values above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q quantile (inf if it is above every
+        bound), or NaN if there are no observations."""
+        if self.count == 0:
+            return math.nan
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            if total >= q * self.count:
+                return bound
+        return math.inf
+
+
+def get_labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def get_finite(value: float) -> Optional[float]:
+    """Returns the value, or None if it is infinite or NaN, which JSON can't represent."""
+    return value if math.isfinite(value) else None
+
+
+def count_rows(records: Any) -> int:
+    """Returns the number of rows in records parsed from a page: the length of a list of records,
+    or of the first column of a tuple of columns (as parse_motions returns)."""
+    if isinstance(records, tuple):
+        return len(records[0]) if len(records) > 0 else 0
+    return len(records) if isinstance(records, (list, dict)) else 0
+
+
+class Metrics:
+    """Counters and histograms by name and labels, and the slowest timed URLs. Safe to share
+    between threads."""
+
+    def __init__(self, slowest: int = SLOWEST) -> None:
+        self.slowest = slowest
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._slowest: List[Tuple[float, str, str]] = []  # a min-heap of (seconds, name, url)
+
+    def increment(self, name: str, amount: float = 1, **labels: Any) -> None:
+        """Adds amount to the counter of the given name and labels."""
+        key = (name, get_labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, url: Optional[str] = None, **labels: Any) -> None:
+        """Adds value to the histogram of the given name and labels. With a URL, the observation
+        is also kept if it is one of the slowest."""
+        key = (name, get_labels(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+            if url is not None:
+                if len(self._slowest) < self.slowest:
+                    heapq.heappush(self._slowest, (value, name, url))
+                elif value > self._slowest[0][0]:
+                    heapq.heapreplace(self._slowest, (value, name, url))
+
+    @contextmanager
+    def timer(self, name: str, url: Optional[str] = None, **labels: Any) -> Iterator[None]:
+        """Observes the seconds the with block takes in the histogram of the given name and
+        labels, and counts '<name>_failures' if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment(name.replace('_seconds', '') + '_failures', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, url, **labels)
+
+    def get_report(self) -> Dict[str, Any]:
+        """Returns every counter and histogram, with each histogram's estimated median and 95th
+        percentile (None if above every bucket), and the slowest URLs, as JSON-serializable
+        data."""
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, histogram, list(histogram.counts))
+                          for key, histogram in self._histograms.items()]
+            slowest = sorted(self._slowest, reverse=True)
+        return {
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in counters],
+            'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram.count,
+                            'sum': histogram.sum, 'p50': get_finite(histogram.get_quantile(0.5)),
+                            'p95': get_finite(histogram.get_quantile(0.95)),
+                            'buckets': dict(zip([str(bound) for bound in histogram.buckets] +
+                                                ['+Inf'], counts))}
+                           for (name, labels), histogram, counts in histograms],
+            'slowest': [{'name': name, 'url': url, 'seconds': seconds}
+                        for seconds, name, url in slowest],
+        }
+
+    def get_table(self) -> pd.DataFrame:
+        """Returns one row per histogram with its labels, count, total and mean seconds and
+        estimated percentiles, the ones that took longest in total first."""
+        df = pd.DataFrame([{'name': histogram['name'],
+                            'labels': ', '.join(key + '=' + value
+                                                for key, value in histogram['labels'].items()),
+                            'count': histogram['count'], 'seconds': histogram['sum'],
+                            'p50': histogram['p50'], 'p95': histogram['p95']}
+                           for histogram in self.get_report()['histograms']],
+                          columns=['name', 'labels', 'count', 'seconds', 'p50', 'p95'])
+        df.insert(4, 'mean', df['seconds'] / df['count'])
+        return df.sort_values('seconds', ascending=False, ignore_index=True)
+
+    def to_prometheus(self) -> str:
+        """Returns the counters and histograms in the Prometheus text exposition format."""
+        report = self.get_report()
+        lines, types = [], set()
+
+        def format_labels(labels: Dict[str, str]) -> str:
+            if len(labels) == 0:
+                return ''
+            return '{' + ','.join(name + '="' + value.replace('\\', '\\\\').replace('"', '\\"')
+                                  .replace('\n', '\\n') + '"'
+                                  for name, value in labels.items()) + '}'
+
+        for counter in sorted(report['counters'], key=lambda counter: counter['name']):
+            name = PROMETHEUS_PREFIX + counter['name'] + '_total'
+            if name not in types:
+                lines.append('# TYPE ' + name + ' counter')
+                types.add(name)
+            lines.append(name + format_labels(counter['labels']) + ' ' + repr(counter['value']))
+        for histogram in sorted(report['histograms'], key=lambda histogram: histogram['name']):
+            name = PROMETHEUS_PREFIX + histogram['name']
+            if name not in types:
+                lines.append('# TYPE ' + name + ' histogram')
+                types.add(name)
+            total = 0
+            for bound, count in histogram['buckets'].items():
+                total += count  # Prometheus buckets are cumulative
+                bucket_labels = {**histogram['labels'], 'le': bound}
+                lines.append(name + '_bucket' + format_labels(bucket_labels) + ' ' + str(total))
+            lines.append(name + '_sum' + format_labels(histogram['labels']) + ' ' +
+                         repr(histogram['sum']))
+            lines.append(name + '_count' + format_labels(histogram['labels']) + ' ' +
+                         str(histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def save_report(self, path: str = DEFAULT_REPORT) -> None:
+        """Saves the run report to the given file: in the Prometheus text format if its name ends
+        with .prom, and as JSON otherwise."""
+        if path.endswith('.prom'):
+            Path(path).write_text(self.to_prometheus(), encoding='utf-8')
+        else:
+            Path(path).write_text(json.dumps(self.get_report(), indent=1), encoding='utf-8')
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self.started = time.time()
+            self._counters.clear()
+            self._histograms.clear()
+            self._slowest.clear()
+
+
+METRICS = Metrics()  # the registry every module records into
+
+
+def report_run(path: Optional[str] = DEFAULT_REPORT, top: int = 10) -> None:
+    """Prints the top histograms by total time and, unless path is None, saves the run report
+    there (see Metrics.save_report)."""
+    print(METRICS.get_table().head(top).to_string(index=False))
+    if path is not None:
+        METRICS.save_report(path)
+
+
+def parse_timed(parse: Callable[[str], Any], html: str, url: str, scraper: str) -> Any:
+    """Returns parse(html) for the page at the given URL, recording the parse's duration as
+    'parse_seconds' and its rows as 'parsed_rows', labelled with the scraper, e.g. 'results'."""
+    with METRICS.timer('parse_seconds', url, scraper=scraper):
+        records = parse(html)
+    METRICS.increment('parsed_rows', count_rows(records), scraper=scraper)
+    return records
+
+
+def timed(function: Callable) -> Callable:
+    """Decorates an analysis function to record its duration as 'analysis_seconds', labelled
+    with the function's name."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with METRICS.timer('analysis_seconds', function=function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,164 @@
+"""Groups reruns of the same motion, so motion statistics can be pooled across tournaments.
+
+Motions are normalized (case, punctuation, 'This House Would' vs. 'THW'), cut into character
+shingles and summarized by MinHash signatures. Locality-sensitive hashing on bands of the signatures
+finds candidate pairs without comparing every motion with every other, and candidates sharing a
+bucket whose estimated Jaccard similarity reaches the threshold are merged with a union-find.
+
+A cluster's id is derived from the text of its earliest motion, so ids stay the same across reruns
+unless an even older variant of the motion is added."""
+
+import hashlib
+import re
+import numpy as np
+import pandas as pd
+from analyze_motions import get_motion_statistics
+from dataset_store import DEFAULT_STORE, MASTER_CSV, BP_POSITIONS, load_motions
+from instrumentation import timed
+
+from typing import List, Optional
+
+
+SHINGLE_SIZE = 5  # characters per shingle
+BANDS, ROWS = 25, 5  # LSH bands and signature rows per band; finds 99% of pairs above 0.7
+THRESHOLD = 0.7  # estimated Jaccard similarity of shingles for two motions to be merged
+SEED = 2022  # fixed, so that signatures are the same on every run
+
+# spelled-out motion openings and their abbreviations, applied in order
+MOTION_PREFIXES = [(r'\bthis house\b', 'th'), (r'\bth would\b', 'thw'),
+                   (r'\bth(?: believes|b) that\b', 'thbt'), (r'\bth regrets\b', 'thr'),
+                   (r'\bth supports\b', 'ths'), (r'\bth opposes\b', 'tho'),
+                   (r'\bth prefers\b', 'thp')]
+
+_MULTIPLIERS = np.random.default_rng(SEED).integers(1, 2 ** 63, BANDS * ROWS, dtype=np.uint64) | 1
+_OFFSETS = np.random.default_rng(SEED + 1).integers(0, 2 ** 63, BANDS * ROWS, dtype=np.uint64)
+
+
+def normalize_motion(motion: str) -> str:
+    """Returns the motion in lowercase, with 'This House ...' abbreviated and punctuation and
+    repeated spaces removed."""
+    motion = motion.lower()
+    for pattern, abbreviation in MOTION_PREFIXES:
+        motion = re.sub(pattern, abbreviation, motion)
+    return ' '.join(re.sub(r'[^\w\s]', ' ', motion).split())
+
+
+def get_shingles(text: str) -> np.ndarray:
+    """Returns the 32-bit hashes of the distinct character shingles of the given text."""
+    data = np.frombuffer(text.encode('utf-8').ljust(SHINGLE_SIZE), dtype=np.uint8)
+    windows = np.lib.stride_tricks.sliding_window_view(data, SHINGLE_SIZE).astype(np.uint64)
+    # a polynomial hash of each window, computed for all windows at once
+    hashes = windows @ (np.uint64(257) ** np.arange(SHINGLE_SIZE, dtype=np.uint64))
+    return np.unique(hashes & np.uint64(0xFFFFFFFF))
+
+
+def get_signatures(texts: List[str]) -> np.ndarray:
+    """Returns the MinHash signature of each text, one row of BANDS * ROWS hashes per text."""
+    signatures = np.empty((len(texts), BANDS * ROWS), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        shingles = get_shingles(text)
+        # multiply-shift hashing: each row is an independent hash of every shingle
+        hashes = (_MULTIPLIERS[:, None] * shingles[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+        signatures[i] = hashes.min(axis=1)
+    return signatures
+
+
+def _find(parents: np.ndarray, i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]  # path halving
+        i = parents[i]
+    return i
+
+
+def cluster_motions(motions: pd.Series, dates: Optional[pd.Series] = None,
+                    threshold: float = THRESHOLD) -> pd.Series:
+    """Returns the cluster id of each of the given motions. Motions whose estimated shingle
+    similarity reaches the threshold share a cluster, as do motions linked through others.
+
+    dates (aligned with motions) decide which motion is a cluster's earliest, and so its id."""
+    normalized = motions.fillna('').astype(str).map(normalize_motion)
+    texts, inverse = np.unique(normalized.to_numpy(dtype=str), return_inverse=True)
+    signatures = get_signatures(list(texts))
+
+    parents = np.arange(len(texts))
+    for band in range(BANDS):
+        rows = signatures[:, band * ROWS:(band + 1) * ROWS]
+        _, buckets = np.unique(rows, axis=0, return_inverse=True)
+        order = np.argsort(buckets, kind='stable')
+        starts = np.flatnonzero(np.diff(buckets[order], prepend=-1))
+        for group in np.split(order, starts[1:]):
+            if len(group) < 2:
+                continue
+            # compare every pair of candidates, so merges don't depend on the bucket's order
+            for k, i in enumerate(group[:-1]):
+                others = group[k + 1:]
+                similarity = (signatures[others] == signatures[i]).mean(axis=1)
+                for j in others[similarity >= threshold]:
+                    parents[_find(parents, j)] = _find(parents, i)
+    roots = np.array([_find(parents, i) for i in range(len(texts))])
+
+    # name each cluster after its earliest motion, breaking ties by text
+    df = pd.DataFrame({'root': roots[inverse], 'text': normalized.to_numpy(),
+                       'date': pd.NaT if dates is None else pd.to_datetime(dates).to_numpy()})
+    earliest = df.sort_values(['date', 'text'], na_position='last').groupby('root')['text'].first()
+    ids = earliest.map(lambda text: 'M' + hashlib.sha1(text.encode()).hexdigest()[:10])
+    return pd.Series(ids.reindex(df['root']).to_numpy(), index=motions.index, name='cluster')
+
+
+def load_motion_corpus(master_csv: Optional[str] = MASTER_CSV,
+                       path: Optional[str] = DEFAULT_STORE) -> pd.DataFrame:
+    """Returns the motion, tournament, date and round of every motion in the master CSV and in the
+    store's scraped motions. Either source is skipped if it is None."""
+    corpora = []
+    if master_csv is not None:
+        df = pd.read_csv(master_csv, usecols=['Date', 'Tournament', 'Round', 'Motion'], dtype=str)
+        corpora.append(pd.DataFrame({'motion': df['Motion'], 'tournament': df['Tournament'],
+                                     'date': pd.to_datetime(df['Date'], errors='coerce'),
+                                     'round': df['Round'], 'source': 'master'}))
+    if path is not None:
+        df = load_motions(path)
+        corpora.append(pd.DataFrame({'motion': df['motion'], 'tournament': df['tournament'],
+                                     'date': df['date'], 'round': df['round'], 'source': 'store'}))
+    corpus = pd.concat(corpora, ignore_index=True)
+    return corpus.dropna(subset=['motion']).reset_index(drop=True)
+
+
+@timed
+def get_motion_clusters(master_csv: Optional[str] = MASTER_CSV,
+                        path: Optional[str] = DEFAULT_STORE, threshold: float = THRESHOLD) \
+        -> pd.DataFrame:
+    """Returns the motion corpus (see load_motion_corpus) with the cluster id of each motion."""
+    corpus = load_motion_corpus(master_csv, path)
+    return corpus.assign(cluster=cluster_motions(corpus['motion'], corpus['date'], threshold))
+
+
+def get_pooled_side_balance(path: str = DEFAULT_STORE, master_csv: Optional[str] = MASTER_CSV,
+                            threshold: float = THRESHOLD, **filters) -> pd.DataFrame:
+    """Returns the position and side scores of every BP motion in the store (see
+    analyze_motions.get_motion_statistics), summed over all reruns of the motion, with the number
+    of rounds it was set in and the share of points won by Gov.
+
+    Motions of the master CSV are clustered too, so that reruns linked only through a variant in
+    the master CSV are still pooled."""
+    stats_df = get_motion_statistics(path, **filters).dropna(subset=['motion'])
+    corpus = load_motion_corpus(master_csv, None) if master_csv is not None else \
+        pd.DataFrame(columns=['motion', 'date'])
+    motions = pd.concat([stats_df['motion'], corpus['motion']], ignore_index=True)
+    dates = pd.concat([stats_df['date'], corpus['date']], ignore_index=True)
+    clusters = cluster_motions(motions, dates, threshold)
+    stats_df = stats_df.assign(cluster=clusters.iloc[:len(stats_df)].to_numpy())
+
+    columns = BP_POSITIONS + ['Gov', 'Opp', 'Opening', 'Closing']
+    pooled = stats_df.groupby('cluster')[columns].sum()
+    pooled.insert(0, 'rounds', stats_df.groupby('cluster').size())
+    pooled.insert(0, 'motion', stats_df.sort_values('date').groupby('cluster')['motion'].first())
+    pooled['gov_share'] = pooled['Gov'] / (pooled['Gov'] + pooled['Opp'])
+    return pooled.sort_values('rounds', ascending=False)
+
+
+if __name__ == '__main__':
+    clusters = get_motion_clusters(path=None)
+    sizes = clusters.groupby('cluster').size().sort_values(ascending=False)
+    print(len(clusters), 'motions in', len(sizes), 'clusters')
+    for cluster in sizes.index[:5]:
+        print(clusters.loc[clusters['cluster'] == cluster, 'motion'].head(3).tolist())
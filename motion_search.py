@@ -0,0 +1,178 @@
+"""Full-text search over the motion bank: the motions master CSV and every scraped motions tab.
+
+Motions are kept in an SQLite FTS5 index, stored in its own file, with their info slides, topic
+areas and tournament details. Queries are plain words, each of which must match, or raw FTS5
+syntax ("quoted phrases", OR, NOT, prefix* and column filters like circuit:europe), and are ranked
+by BM25, with matches in the motion text counting the most. The index is updated incrementally:
+only sources (the master CSV or a tournament's motions) that changed since they were last indexed
+are re-read."""
+
+import os
+import re
+import sqlite3
+import pandas as pd
+from instrumentation import timed
+
+from typing import Optional
+
+
+DEFAULT_SEARCH_INDEX = 'motion_search.sqlite'
+MASTER_SOURCE = 'master'  # the source name of motions from the master CSV
+MASTER_COLUMNS = ['Date', 'Tournament', 'Circuit', 'Round', 'Motion', 'Infoslide', 'Topic_Area_1',
+                  'Topic_Area_2', 'Topic_Area_3', 'Topic_Area_Specific_1']
+CHUNK_ROWS = 2000  # master CSV rows indexed at a time
+# BM25 weights of the motion, info_slide, topics, tournament, round and circuit columns
+WEIGHTS = (10.0, 2.0, 5.0, 1.0, 0.5, 1.0)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS motions USING fts5 (
+    motion, info_slide, topics, tournament, round, circuit,
+    date UNINDEXED,
+    source UNINDEXED,  -- 'master', or the '<date> <tournament>' name of a scraped tournament
+    tokenize = 'porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    version TEXT  -- modification time of the indexed file
+);
+"""
+
+COLUMNS = ['motion', 'info_slide', 'topics', 'tournament', 'round', 'circuit', 'date', 'source']
+
+
+def connect(path: str = DEFAULT_SEARCH_INDEX) -> sqlite3.Connection:
+    """Opens the search index at the given path, creating it if needed."""
+    conn = sqlite3.connect(path, timeout=30)  # scrapers may update it from several threads
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _replace_source(conn: sqlite3.Connection, source: str, version: Optional[str],
+                    rows: pd.DataFrame) -> None:
+    """Replaces every indexed motion of the given source with the given rows."""
+    conn.execute('DELETE FROM motions WHERE source = ?', (source,))
+    _insert(conn, rows)
+    conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (source, version))
+
+
+def _insert(conn: sqlite3.Connection, rows: pd.DataFrame) -> None:
+    rows = rows[COLUMNS].astype(object).where(rows[COLUMNS].notna(), None)
+    conn.executemany('INSERT INTO motions (' + ', '.join(COLUMNS) + ') VALUES (' +
+                     ', '.join('?' * len(COLUMNS)) + ')', rows.itertuples(index=False))
+
+
+def _is_indexed(conn: sqlite3.Connection, source: str, version: str) -> bool:
+    row = conn.execute('SELECT version FROM sources WHERE source = ?', (source,)).fetchone()
+    return row is not None and row[0] == version
+
+
+def _get_version(filepath: str) -> str:
+    return str(os.path.getmtime(filepath))
+
+
+def index_master_csv(master_csv: str, path: str = DEFAULT_SEARCH_INDEX,
+                     chunk_rows: int = CHUNK_ROWS) -> bool:
+    """Indexes the motions of the master CSV, streamed in chunks, unless it is unchanged since it
+    was last indexed. Returns whether it was indexed."""
+    conn = connect(path)
+    version = _get_version(master_csv)
+    if _is_indexed(conn, MASTER_SOURCE, version):
+        conn.close()
+        return False
+
+    with conn:  # one transaction, so searches never see a half-indexed master CSV
+        conn.execute('DELETE FROM motions WHERE source = ?', (MASTER_SOURCE,))
+        for chunk in pd.read_csv(master_csv, usecols=MASTER_COLUMNS,
+                                 dtype=dict.fromkeys(MASTER_COLUMNS, str), chunksize=chunk_rows):
+            chunk = chunk.dropna(subset=['Motion'])
+            if chunk.empty:
+                continue
+            # the topic area columns, searched as one
+            topics = chunk.filter(like='Topic_Area').fillna('').agg(' '.join, axis=1).str.strip()
+            _insert(conn, pd.DataFrame({
+                'motion': chunk['Motion'], 'info_slide': chunk['Infoslide'],
+                'topics': topics, 'tournament': chunk['Tournament'],
+                'round': chunk['Round'], 'circuit': chunk['Circuit'], 'date': chunk['Date'],
+                'source': MASTER_SOURCE}))
+        conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (MASTER_SOURCE, version))
+    conn.close()
+    return True
+
+
+def index_tournament(tournament_name: str, motions_df: pd.DataFrame,
+                     circuit: Optional[str] = None, path: str = DEFAULT_SEARCH_INDEX,
+                     version: Optional[str] = None) -> None:
+    """Indexes the scraped motions of the given '<date> <tournament>' tournament, replacing any
+    motions indexed for it before. motions_df has the columns saved by save_all_motions."""
+    date = tournament_name[:10] if re.match(r'\d{4}-\d{2}-\d{2} ', tournament_name) else None
+    rows = pd.DataFrame({'motion': motions_df['Motion'], 'info_slide': motions_df['Info Slide'],
+                         'topics': None, 'round': motions_df['Round'], 'circuit': circuit,
+                         'tournament': tournament_name[11:] if date else tournament_name,
+                         'date': date, 'source': tournament_name})
+    conn = connect(path)
+    with conn:
+        _replace_source(conn, tournament_name, version, rows)
+    conn.close()
+
+
+def index_csv_directory(folder: str = 'scraped_data/', path: str = DEFAULT_SEARCH_INDEX) -> int:
+    """Indexes every '<date> <tournament> - Motions.csv' file in the given folder that changed
+    since it was last indexed. Returns the number of files indexed."""
+    conn = connect(path)
+    indexed = 0
+    for file in os.listdir(folder):
+        match = re.fullmatch(r'(.+) - Motions\.csv', file)
+        if match is None:
+            continue
+        filepath = os.path.join(folder, file)
+        if _is_indexed(conn, match.group(1), _get_version(filepath)):
+            continue
+        index_tournament(match.group(1), pd.read_csv(filepath, index_col=0), path=path,
+                         version=_get_version(filepath))
+        indexed += 1
+    conn.close()
+    return indexed
+
+
+def quote(text: str) -> str:
+    """Returns the text as an FTS5 string, which matches it as a phrase whatever it contains."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def get_match_query(query: str, phrase: bool = False, raw: bool = False) -> str:
+    """Returns the FTS5 query searching for the given text: every whitespace-separated word of it
+    (so that "women's rights", "covid-19" or "AND" are just words), the whole text as one exact
+    phrase if phrase is True, or the text itself if raw is True."""
+    if raw:
+        return query
+    if phrase:
+        return quote(query)
+    return ' '.join(quote(word) for word in query.split())
+
+
+@timed
+def search(query: str, path: str = DEFAULT_SEARCH_INDEX, limit: int = 20,
+           phrase: bool = False, raw: bool = False) -> pd.DataFrame:
+    """Returns the motions best matching the given words, best first, with their tournament
+    details and BM25 score (lower is better). See get_match_query for phrase and raw. Raises
+    ValueError if the query is not valid FTS5 syntax."""
+    match_query = get_match_query(query, phrase, raw)
+    if match_query.strip() == '':
+        raise ValueError('empty search query')
+    conn = connect(path)
+    try:
+        return pd.read_sql_query('SELECT ' + ', '.join(COLUMNS) + ', bm25(motions, ' +
+                                 ', '.join(map(str, WEIGHTS)) + ') AS score FROM motions '
+                                 'WHERE motions MATCH ? ORDER BY score LIMIT ?', conn,
+                                 params=(match_query, limit))
+    except pd.errors.DatabaseError as error:
+        raise ValueError('invalid search query ' + repr(query) + ': ' +
+                         str(error.__cause__ or error)) from error
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    index_master_csv('Debating_Motions - Motions (Grey-_Added).csv')
+    print(index_csv_directory(), 'scraped motions tabs indexed')
+    print(search('social media', limit=10)[['motion', 'tournament', 'date']])
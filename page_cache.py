@@ -0,0 +1,161 @@
+"""A persistent on-disk cache of downloaded tab pages.
+
+Page bodies are stored gzipped under the hash of their content, so identical pages are only kept
+once, and each URL points at the body it last returned. This lets every scraper be re-run over
+already downloaded pages without touching the network."""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from fetchers import Fetcher, Page
+from typing import Dict, Optional
+
+
+DEFAULT_CACHE_DIR = 'page_cache/'
+DEFAULT_TTL = 7 * 24 * 60 * 60  # a week, in seconds
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB of compressed pages
+
+
+def hash_text(text: str) -> str:
+    """Returns the hex SHA-256 hash of the given text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PageNotCached(LookupError):
+    """Raised in offline mode when a page was never downloaded."""
+
+
+class PageCache:
+    """Stores page bodies by content hash and URL metadata by URL hash.
+
+    Once the stored bodies exceed max_bytes, the least recently used ones are evicted."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES) \
+            -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._objects = self.directory / 'objects'
+        self._urls = self.directory / 'urls'
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._urls.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(path.stat().st_size for path in self._objects.glob('*/*.html.gz'))
+
+    def _object_path(self, content_hash: str) -> Path:
+        return self._objects / content_hash[:2] / (content_hash + '.html.gz')
+
+    def _url_path(self, url: str) -> Path:
+        return self._urls / (hash_text(url) + '.json')
+
+    def get_entry(self, url: str) -> Optional[Dict]:
+        """Returns the metadata stored for the given URL, or None if its body isn't cached."""
+        try:
+            entry = json.loads(self._url_path(url).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if not self._object_path(entry['content_hash']).exists():  # body was evicted
+            return None
+        return entry
+
+    def read(self, entry: Dict) -> str:
+        """Returns the page body of the given entry and marks it as recently used."""
+        path = self._object_path(entry['content_hash'])
+        os.utime(path)  # eviction goes by modification time
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return f.read()
+
+    def store(self, url: str, text: str, etag: Optional[str] = None,
+              last_modified: Optional[str] = None) -> Dict:
+        """Stores the page body for the given URL and returns its new metadata."""
+        content_hash = hash_text(text)
+        path = self._object_path(content_hash)
+        if path.exists():
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix('.tmp' + str(threading.get_ident()))
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)  # readers never see half-written bodies
+            with self._lock:
+                self._size += path.stat().st_size
+            self.evict()
+
+        entry = {'url': url, 'content_hash': content_hash, 'fetched_at': time.time(),
+                 'etag': etag, 'last_modified': last_modified}
+        self._write_entry(url, entry)
+        return entry
+
+    def touch(self, url: str, entry: Dict) -> None:
+        """Marks the given entry as freshly revalidated."""
+        entry['fetched_at'] = time.time()
+        self._write_entry(url, entry)
+
+    def _write_entry(self, url: str, entry: Dict) -> None:
+        path = self._url_path(url)
+        temp_path = path.with_suffix('.tmp' + str(threading.get_ident()))
+        temp_path.write_text(json.dumps(entry), encoding='utf-8')
+        os.replace(temp_path, path)
+
+    def evict(self) -> None:
+        """Deletes the least recently used page bodies until the cache fits in max_bytes."""
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            paths = sorted(self._objects.glob('*/*.html.gz'), key=lambda p: p.stat().st_mtime)
+            for path in paths:
+                if self._size <= self.max_bytes:
+                    break
+                size = path.stat().st_size
+                path.unlink()
+                self._size -= size
+
+
+class CachingFetcher(Fetcher):
+    """Serves pages from a PageCache, only going to the wrapped fetcher for missing or stale pages.
+
+    Stale pages with an ETag or Last-Modified header are revalidated with a conditional request,
+    so unchanged pages cost a 304 instead of a full download. In offline mode, cached pages are
+    always used and missing pages raise PageNotCached."""
+
+    def __init__(self, fetcher: Fetcher, cache: PageCache, ttl: float = DEFAULT_TTL,
+                 offline: bool = False) -> None:
+        super().__init__()
+        self.fetcher = fetcher
+        self.cache = cache
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0  # pages served without a full download
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        entry = self.cache.get_entry(url)
+        if entry is not None and (self.offline or time.time() - entry['fetched_at'] < self.ttl):
+            self.hits += 1
+            return Page(url, 200, self.cache.read(entry), {})
+        if self.offline:
+            raise PageNotCached(url)
+
+        headers = dict(headers or {})
+        if entry is not None:  # ask the server whether our copy is still current
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        page = self.fetcher.fetch(url, headers)
+        if page.status == 304 and entry is not None:
+            self.cache.touch(url, entry)
+            self.hits += 1
+            return Page(url, 200, self.cache.read(entry), page.headers)
+        if page.status == 200:
+            self.cache.store(url, page.text, page.headers.get('ETag'),
+                             page.headers.get('Last-Modified'))
+        return page
+
+    def close(self) -> None:
+        self.fetcher.close()
@@ -0,0 +1,48 @@
+"""Shared HTML parsing helpers for the scrapers.
+
+Pages are parsed with lxml when it is installed, which is several times faster than Python's
+html.parser. Scrapers can also pass a SoupStrainer so that only the part of the page they read
+(e.g. the results table) is turned into a tree, and cut the page down to that part with
+slice_html before parsing, so navigation bars and scripts are never even tokenized."""
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from typing import Dict, List, Optional
+
+try:
+    import lxml  # noqa: F401, only needed as a BeautifulSoup backend
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+
+def set_parser(parser: str) -> None:
+    """Sets the BeautifulSoup parser backend used by every scraper, e.g. 'lxml' or 'html.parser'."""
+    global PARSER
+    PARSER = parser
+
+
+def make_soup(html: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """Returns the parsed tree of the given HTML, limited to the parse_only elements if given."""
+    return BeautifulSoup(html, features=PARSER, parse_only=parse_only)
+
+
+def slice_html(html: str, start_tags: List[str], end_tag: str) -> str:
+    """Returns the part of html from the first of the given opening tags to the last closing
+    end_tag, e.g. slice_html(html, ['table'], 'table') for the page's tables. Returns the whole html
+    if none of the tags are in it."""
+    starts = [html.find('<' + tag) for tag in start_tags]
+    starts = [start for start in starts if start != -1]
+    end = html.rfind('</' + end_tag + '>')
+    if len(starts) == 0 or end == -1:
+        return html
+    return html[min(starts):end + len(end_tag) + 3]
+
+
+def get_column_indexes(headers: List[str]) -> Dict[str, int]:
+    """Returns a dictionary mapping each table header to the index of its first column, so rows
+    can look up columns without searching the header list."""
+    indexes = {}
+    for i, header in enumerate(headers):
+        indexes.setdefault(header, i)
+    return indexes
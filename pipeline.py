@@ -0,0 +1,352 @@
+"""Crawls tournaments as a pipeline of fetching, parsing and writing stages.
+
+save_tournament fetches, parses and writes each page in turn, so a crawl is either waiting on the
+network or parsing, never both. Here the three overlap:
+
+- fetch threads find each tournament's pages from its site map and download them,
+- a process pool parses the pages, so that parsing, which holds the GIL, scales with the number
+  of cores, and
+- one writer thread collects the parsed pages of each tab, saves the tab's CSV file once all its
+  pages are in and records the pages in the crawl manifest.
+
+At most backlog downloaded pages wait for or are in parsing, and at most backlog parsed pages wait
+for the writer, so fetchers that get ahead block rather than filling memory with HTML. Each host's
+concurrency adapts to how it answers, and hosts that keep failing are skipped (see politeness)."""
+
+import os
+import queue
+import threading
+import time
+import pandas as pd
+import parsing
+import validators
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from crawl_manifest import CrawlManifest, DEFAULT_MANIFEST, is_tab_saved
+from driver_pool import close_shared_pool
+from fetchers import Fetcher, make_fetcher
+from instrumentation import DEFAULT_REPORT, METRICS, count_rows, report_run
+from motion_search import index_tournament
+from page_cache import DEFAULT_CACHE_DIR, hash_text, PageNotCached
+from pathlib import Path
+from politeness import AdaptiveLimiter, CircuitBreaker
+from scrape_motions import make_motions_df, parse_motions
+from scrape_results import make_results_df, parse_results
+from scrape_speaker_tab import make_speaker_df, parse_speaker_tab
+from scrape_tournaments import get_tournaments, order_by_host
+from site_map import get_site_map
+
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+
+FETCH_WORKERS = 8
+BACKLOG = 32  # pages that may wait between two stages
+MAX_PER_HOST = 2  # pages fetched from the same host at once
+# the name of each tab's CSV files, and the kind of its pages' records in the crawl manifest
+TABS = {'motions': ('Motions', 'motions'), 'speakers': ('Speakers', 'speaker rounds'),
+        'results': ('Results', 'results')}
+
+
+class PageJob(NamedTuple):
+    """A page to fetch and parse."""
+    tournament: str
+    tab: str  # 'motions', 'speakers' or 'results'
+    url: str
+
+
+def parse_page(tab: str, html: str, url: str) -> Any:
+    """Returns the records parsed from the given page of the given tab. Runs in the parsing
+    processes."""
+    if tab == 'motions':
+        return parse_motions(html, url)
+    elif tab == 'speakers':
+        return parse_speaker_tab(html)
+    return parse_results(html, url)
+
+
+def parse_page_timed(tab: str, html: str, url: str) -> Tuple[Any, float]:
+    """Returns parse_page's records and the seconds it took, since parsing processes can't record
+    into the parent's instrumentation."""
+    start = time.perf_counter()
+    records = parse_page(tab, html, url)
+    return records, time.perf_counter() - start
+
+
+def make_tab_df(tab: str, pages: List[Any]) -> pd.DataFrame:
+    """Returns the dataframe of the given tab from the records parsed from each of its pages."""
+    if tab == 'motions':
+        return make_motions_df(pages[0])
+    elif tab == 'speakers':
+        return make_speaker_df(pages[0])
+    return make_results_df(pages)
+
+
+def get_tab_path(folder: str, tournament: str, tab: str) -> Path:
+    """Returns the path of the CSV file of the given tab of the tournament."""
+    return Path(folder) / (tournament + ' - ' + TABS[tab][0] + '.csv')
+
+
+class TabWriter:
+    """Collects the parsed pages of each tab and saves the tab once all of them are in. Only used
+    by the writer thread."""
+
+    def __init__(self, folder: str, manifest: Optional[CrawlManifest]) -> None:
+        self.folder = folder
+        self.manifest = manifest
+        self.urls: Dict[Tuple[str, str], List[str]] = {}  # (tournament, tab) to its pages
+        self.records: Dict[Tuple[str, str], Dict[str, Any]] = {}  # parsed records by page
+        self.failed: Set[Tuple[str, str]] = set()
+        self.saved = 0  # number of tabs saved
+
+    def plan(self, tournament: str, tab: str, urls: List[str]) -> None:
+        """Expects the pages at the given URLs for the given tab."""
+        self.urls[(tournament, tab)] = urls
+        self.records[(tournament, tab)] = {}
+        self._save_if_complete(tournament, tab)
+
+    def add(self, job: PageJob, content_hash: Optional[str], records: Any,
+            error: Optional[str]) -> None:
+        """Adds the records parsed from the given page, or the error that stopped it. Records
+        from the manifest have no content_hash, as there is nothing new to record."""
+        kind = TABS[job.tab][1]
+        if error is not None:
+            print(job.tournament, job.url, 'failed:', error)
+            self.failed.add((job.tournament, job.tab))
+            if self.manifest is not None:
+                self.manifest.record_failure(job.url, job.tournament, kind, error)
+        elif content_hash is not None and self.manifest is not None:
+            self.manifest.record_page(job.url, job.tournament, kind, content_hash, records)
+        self.records[(job.tournament, job.tab)][job.url] = records
+        self._save_if_complete(job.tournament, job.tab)
+
+    def _save_if_complete(self, tournament: str, tab: str) -> None:
+        key = (tournament, tab)
+        if len(self.records[key]) < len(self.urls[key]):
+            return
+        urls, records = self.urls.pop(key), self.records.pop(key)
+        if key in self.failed:  # a partial tab is not saved, so the next crawl tries it again
+            self.failed.discard(key)
+            return
+
+        self.save(tournament, tab, make_tab_df(tab, [records[url] for url in urls])
+                  if len(urls) > 0 else None)
+
+    def save(self, tournament: str, tab: str, df: Optional[pd.DataFrame]) -> None:
+        """Saves the given tab of the tournament, unless it is empty or None, and marks it as
+        crawled."""
+        if df is not None and not df.empty:
+            df.to_csv(get_tab_path(self.folder, tournament, tab))
+            if tab == 'motions':
+                index_tournament(tournament, df)
+        if self.manifest is not None:
+            self.manifest.complete_tournament(tournament, tab)
+        self.saved += 1
+
+
+class Pipeline:
+    """Saves the motions, speaker tabs and results of tournaments, overlapping the fetching,
+    parsing and writing of their pages."""
+
+    def __init__(self, backend: str = 'auto', fetch_workers: int = FETCH_WORKERS,
+                 parse_workers: Optional[int] = None, backlog: int = BACKLOG,
+                 max_per_host: int = MAX_PER_HOST, manifest: Optional[CrawlManifest] = None,
+                 overwrite: bool = False, offline: bool = False, folder: str = 'scraped_data/',
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> None:
+        self.backend = backend
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.limiter = AdaptiveLimiter(max_per_host)
+        self.breaker = CircuitBreaker(manifest=manifest)
+        self.manifest = manifest
+        self.overwrite = overwrite
+        self.offline = offline
+        self.folder = folder
+        self.cache_dir = cache_dir
+
+        self._tournaments: queue.Queue = queue.Queue()
+        self._page_jobs: queue.Queue = queue.Queue()  # pages of the tournaments being crawled
+        self._planning = 0  # tournaments whose pages are being planned
+        self._planned = threading.Condition()  # notified whenever a tournament is planned
+        self._parse_slots = threading.BoundedSemaphore(backlog)  # pages waiting to be parsed
+        self._written: queue.Queue = queue.Queue(maxsize=backlog)  # messages for the writer
+        self._parsers: Optional[ProcessPoolExecutor] = None
+        self.fetchers: List[Fetcher] = []
+        self._fetchers_lock = threading.Lock()
+
+    def _is_saved(self, tournament: str, tab: str) -> bool:
+        """Returns whether the given tab of the tournament is saved and needs no refresh."""
+        if self.overwrite:
+            return False
+        return is_tab_saved(get_tab_path(self.folder, tournament, tab), tournament, tab,
+                            self.manifest)
+
+    def _plan(self, tournament: str, event_links: str, fetcher: Fetcher) -> None:
+        """Queues the pages of every tab of the tournament that isn't saved yet, from the site map
+        of its first tabbycat link whose landing page loads."""
+        tabs = [tab for tab in TABS if not self._is_saved(tournament, tab)]
+        for url in event_links.split() if len(tabs) > 0 else []:
+            if not validators.url(url) or ('calico' not in url and 'heroku' not in url):
+                continue
+            try:
+                site_map = get_site_map(url, fetcher, self.manifest, tournament)
+            except PageNotCached:  # tournament was never downloaded
+                continue
+            except Exception as error:  # e.g. politeness.HostUnavailable for a dead site
+                print(tournament, url, 'failed:', repr(error))
+                continue
+            # tournaments without a motions tab may still publish motion statistics
+            tab_urls = {'motions': [site_map.motions or site_map.motion_statistics],
+                        'speakers': [site_map.speaker_tab], 'results': site_map.rounds}
+            for tab in tabs:
+                urls = [tab_url for tab_url in tab_urls[tab] if tab_url != '']
+                self._written.put(('plan', tournament, tab, urls))  # before any of its pages
+                for tab_url in urls:
+                    self._page_jobs.put(PageJob(tournament, tab, tab_url))
+            return
+
+    def _fetch(self, job: PageJob, fetcher: Fetcher) -> None:
+        """Downloads the given page and hands it to the parsers, unless the manifest already has
+        its records."""
+        kind = TABS[job.tab][1]
+        if self.manifest is not None:
+            records = self.manifest.get_records(job.url, kind)
+            if records is not None:
+                METRICS.increment('manifest_hits', scraper=kind)
+                self._written.put(('page', job, None, records, None))
+                return
+        try:
+            html = fetcher.get(job.url)
+        except Exception as error:
+            self._written.put(('page', job, None, None, repr(error)))
+            return
+
+        content_hash = hash_text(html)
+        if self.manifest is not None:
+            records = self.manifest.get_records(job.url, kind, content_hash)
+            if records is not None:  # unchanged since it was last parsed
+                METRICS.increment('manifest_hits', scraper=kind)
+                self._written.put(('page', job, None, records, None))
+                return
+        self._parse_slots.acquire()  # wait while the parsers are backlog pages behind
+        try:
+            future = self._parsers.submit(parse_page_timed, job.tab, html, job.url)
+        except Exception as error:  # e.g. BrokenProcessPool once a parsing process died
+            self._parse_slots.release()
+            METRICS.increment('parse_failures', scraper=kind)
+            self._written.put(('page', job, None, None, repr(error)))
+            return
+        future.add_done_callback(lambda future: self._parsed(job, content_hash, future))
+
+    def _parsed(self, job: PageJob, content_hash: str, future: Future) -> None:
+        self._parse_slots.release()
+        kind = TABS[job.tab][1]
+        try:
+            records, seconds = future.result()
+        except Exception as error:
+            METRICS.increment('parse_failures', scraper=kind)
+            self._written.put(('page', job, None, None, repr(error)))
+            return
+        METRICS.observe('parse_seconds', seconds, job.url, scraper=kind)
+        METRICS.increment('parsed_rows', count_rows(records), scraper=kind)
+        self._written.put(('page', job, content_hash, records, None))
+
+    def _fetch_worker(self) -> None:
+        """Fetches pages until no tournament is left. Pages of tournaments already planned come
+        first, so a worker only plans a new tournament when there are no pages to fetch. A worker
+        with nothing to do waits while other workers are planning, since their tournaments may
+        still have pages, and only stops once no tournament is left to plan or being planned."""
+        fetcher = make_fetcher(self.backend, self.cache_dir, offline=self.offline,
+                               breaker=self.breaker, limiter=self.limiter)
+        with self._fetchers_lock:
+            self.fetchers.append(fetcher)
+        while True:
+            try:
+                job = self._page_jobs.get_nowait()
+            except queue.Empty:
+                with self._planned:
+                    try:
+                        tournament = self._tournaments.get_nowait()
+                    except queue.Empty:
+                        if self._planning == 0 and self._page_jobs.empty():
+                            return
+                        self._planned.wait()  # for the pages of the tournaments being planned
+                        continue
+                    self._planning += 1
+                try:
+                    self._plan(*tournament, fetcher)
+                finally:
+                    with self._planned:
+                        self._planning -= 1
+                        self._planned.notify_all()
+                continue
+            self._fetch(job, fetcher)
+
+    def _write(self, writer: TabWriter) -> None:
+        while True:
+            message = self._written.get()
+            if message is None:
+                return
+            elif message[0] == 'plan':
+                writer.plan(*message[1:])
+            else:
+                writer.add(*message[1:])
+
+    def run(self, tournaments: List[Tuple[str, str]]) -> int:
+        """Saves every tab of the given (tournament name, tab links) pairs that isn't saved yet.
+        Returns the number of tabs saved."""
+        for tournament in tournaments:
+            self._tournaments.put(tournament)
+        Path(self.folder).mkdir(parents=True, exist_ok=True)
+        writer = TabWriter(self.folder, self.manifest)
+        writer_thread = threading.Thread(target=self._write, args=(writer,))
+        writer_thread.start()
+
+        # parsing processes use the parser backend of this one
+        self._parsers = ProcessPoolExecutor(self.parse_workers, initializer=parsing.set_parser,
+                                            initargs=(parsing.PARSER,))
+        try:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+                for future in [executor.submit(self._fetch_worker)
+                               for _ in range(self.fetch_workers)]:
+                    future.result()
+        finally:
+            self._parsers.shutdown(wait=True)  # every parsed page is handed to the writer
+            self._written.put(None)
+            writer_thread.join()
+            for fetcher in self.fetchers:
+                fetcher.close()
+        return writer.saved
+
+
+def save_tournaments_pipelined(filepath: str, backend: str = 'auto',
+                               fetch_workers: int = FETCH_WORKERS,
+                               parse_workers: Optional[int] = None,
+                               max_per_host: int = MAX_PER_HOST, offline: bool = False,
+                               manifest_path: Optional[str] = DEFAULT_MANIFEST,
+                               report_path: Optional[str] = DEFAULT_REPORT,
+                               folder: str = 'scraped_data/',
+                               cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> None:
+    """Same as scrape_tournaments.save_tournaments_concurrently, but runs fetching, parsing and
+    writing as a pipeline: fetch_workers threads download pages while parse_workers processes
+    (by default one per core) parse them. Tabs are saved to folder, pages cached in cache_dir and
+    the run report saved to report_path.
+
+    In offline mode, every tournament is re-parsed from the page cache and its files replaced."""
+    tournaments = order_by_host(get_tournaments(filepath))
+    # re-parsing offline must not reuse records parsed by older code
+    manifest = CrawlManifest(manifest_path) if manifest_path and not offline else None
+    pipeline = Pipeline(backend, fetch_workers, parse_workers, max_per_host=max_per_host,
+                        manifest=manifest, overwrite=offline, offline=offline, folder=folder,
+                        cache_dir=cache_dir)
+    try:
+        saved = pipeline.run(tournaments)
+    finally:
+        close_shared_pool()  # quit any browsers the fallback started
+        if manifest is not None:
+            manifest.close()
+    print(saved, 'tabs saved,', sum(fetcher.pages for fetcher in pipeline.fetchers),
+          'pages fetched')
+    report_run(report_path)
+
+
+if __name__ == '__main__':
+    save_tournaments_pipelined('Debating_Motions - Motions (Grey-_Added).csv')
@@ -0,0 +1,304 @@
+"""Per-host politeness limits shared by the concurrent scrapers.
+
+Many tab sites are free herokuapp dynos that start slowly, time out or are gone for good, so a
+crawl mostly waits on a few bad hosts. Besides fixed limits, this module has what keeps that
+waiting short:
+
+- AdaptiveLimiter adapts each host's concurrency and spacing to how it answers: one more
+  connection while it answers quickly, half as many once it is slow or answers 429 or 5xx,
+- RetryingFetcher retries failed fetches after a jittered, exponentially growing delay, and
+- CircuitBreaker stops fetching a tournament's pages after repeated failures, or a whole host's
+  once it refuses connections, remembering dead tournaments and hosts across runs in the crawl
+  manifest."""
+
+import email.utils
+import random
+import requests
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from crawl_manifest import CrawlManifest
+from fetchers import Fetcher, Page
+from urllib.parse import urlparse
+
+from typing import Dict, Iterator, Optional, Tuple
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # statuses of a busy or starting host, worth retrying
+RETRIES = 3  # attempts after the first one
+BASE_DELAY = 1.0  # seconds before the first retry, doubled on each retry
+MAX_DELAY = 60.0  # longest wait between two attempts
+SLOW_SECONDS = 10.0  # a page taking longer than this counts as a sign of an overloaded host
+MAX_INTERVAL = 30.0  # longest spacing the adaptive limiter puts between two requests to a host
+FAILURE_THRESHOLD = 5  # pages failing in a row, after retries, for a tournament or host to be dead
+COOLDOWN = 15 * 60.0  # seconds a dead tournament or host is skipped, doubled when found dead again
+MAX_COOLDOWN = 7 * 24 * 60 * 60.0  # a week
+
+
+class HostUnavailable(Exception):
+    """Raised instead of fetching from a tournament or host whose circuit breaker is open."""
+
+
+def get_host(url: str) -> str:
+    """Returns the host part of the given URL, e.g. 'hhiv2020.calicotab.com'."""
+    return urlparse(url).netloc.lower()
+
+
+def get_tournament_url(url: str) -> str:
+    """Returns the base URL of the tabbycat tournament the given page belongs to, e.g.
+    'https://hhiv2020.calicotab.com/hhiv2020/': tabbycat puts every page of a tournament under
+    its slug, and one host may have many tournaments."""
+    parts = urlparse(url)
+    segments = [segment for segment in parts.path.split('/') if segment != '']
+    return parts.scheme + '://' + parts.netloc.lower() + '/' + \
+        (segments[0] + '/' if len(segments) > 0 else '')
+
+
+def get_backoff(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY,
+                retry_after: Optional[float] = None) -> float:
+    """Returns the seconds to wait before retry number attempt (from 0): a random time up to
+    base_delay * 2 ** attempt ("full jitter"), so that workers backing off from the same host don't
+    retry in lockstep. A Retry-After the host asked for is waited at least."""
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+def get_retry_after(page: Optional[Page]) -> Optional[float]:
+    """Returns the seconds the page's Retry-After header asks to wait, if it has a valid one."""
+    value = page.headers.get('Retry-After') if page is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:  # an HTTP date instead of seconds
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """Limits how many workers may talk to the same host at once, and how often.
+
+    Different hosts never block each other, so tournaments on different calicotab or herokuapp
+    sites can be crawled in parallel while each single site only sees a few connections."""
+
+    def __init__(self, max_per_host: int = 1, min_interval: float = 0.0) -> None:
+        self.max_per_host = max_per_host  # concurrent slots for each host
+        self.min_interval = min_interval  # seconds between two slots starting on the same host
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+        self._next_start: Dict[str, float] = {}  # earliest time the host may be used again
+
+    def _get_semaphore(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    def _get_interval(self, host: str) -> float:
+        return self.min_interval
+
+    def _wait_for_turn(self, host: str) -> None:
+        """Sleeps until the host's interval has passed since its last slot started."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self._get_interval(host)
+        if start > now:
+            time.sleep(start - now)
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Holds one of the URL host's slots for the duration of the with block."""
+        host = get_host(url)
+        semaphore = self._get_semaphore(host)
+        with semaphore:
+            self._wait_for_turn(host)
+            yield
+
+
+class AdaptiveLimiter(HostLimiter):
+    """A host limiter whose limits follow each host's health, as reported with record.
+
+    Every host starts at initial_per_host slots. Each quick success adds 1 / limit slots, so the
+    limit grows by about one slot per limit successes, up to max_per_host. Each slow page, 429,
+    5xx or error halves the limit (to at least one slot) and doubles the host's spacing between
+    requests (up to MAX_INTERVAL), which quick successes halve back to min_interval."""
+
+    def __init__(self, max_per_host: int = 4, min_interval: float = 0.0,
+                 initial_per_host: int = 1, slow_seconds: float = SLOW_SECONDS) -> None:
+        super().__init__(max_per_host, min_interval)
+        self.initial_per_host = initial_per_host
+        self.slow_seconds = slow_seconds
+        self._changed = threading.Condition(self._lock)
+        self._limits: Dict[str, float] = {}  # slots allowed on each host
+        self._active: Dict[str, int] = {}  # slots held on each host
+        self._intervals: Dict[str, float] = {}  # seconds between two slots starting on each host
+
+    def _get_interval(self, host: str) -> float:
+        return self._intervals.get(host, self.min_interval)
+
+    def get_limit(self, host: str) -> int:
+        """Returns the number of slots the given host currently allows."""
+        return int(self._limits.get(host, self.initial_per_host))
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        host = get_host(url)
+        with self._changed:
+            while self._active.get(host, 0) >= self.get_limit(host):
+                self._changed.wait()
+            self._active[host] = self._active.get(host, 0) + 1
+        try:
+            self._wait_for_turn(host)
+            yield
+        finally:
+            with self._changed:
+                self._active[host] -= 1
+                self._changed.notify_all()
+
+    def record(self, url: str, seconds: float, status: Optional[int]) -> None:
+        """Adapts the limits of the URL's host to a fetch that took the given seconds and returned
+        the given status (None if it raised)."""
+        host = get_host(url)
+        with self._changed:
+            limit = self._limits.get(host, float(self.initial_per_host))
+            interval = self._get_interval(host)
+            if status is None or status in RETRY_STATUSES or seconds > self.slow_seconds:
+                self._limits[host] = max(1.0, limit / 2)
+                self._intervals[host] = min(MAX_INTERVAL, max(2 * interval, BASE_DELAY))
+            else:
+                self._limits[host] = min(float(self.max_per_host), limit + 1 / limit)
+                self._intervals[host] = max(self.min_interval,
+                                            interval / 2 if interval > BASE_DELAY else 0.0)
+            self._changed.notify_all()
+
+
+class CircuitBreaker:
+    """Stops requests to tournaments and hosts that keep failing.
+
+    A page that fails counts against its tournament (see get_tournament_url), so a host with many
+    tournaments keeps serving the others while one of them is broken; only pages whose host
+    refused or dropped the connection count against the whole host. After threshold failures in a
+    row, the tournament's or host's breaker opens and check raises HostUnavailable for cooldown
+    seconds. The first request after that is let through as a trial: a success closes the
+    breaker, a failure opens it again for twice as long. With a crawl manifest, open breakers are
+    stored in it, so the next run skips the same dead tournaments and hosts without trying them."""
+
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN,
+                 manifest: Optional[CrawlManifest] = None) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        # keyed by tournament URL or by host, which never look alike
+        self._failures: Dict[str, int] = {}  # failures in a row of each tournament or host
+        # times each was found dead in a row, and the time until which it is skipped
+        self._dead: Dict[str, Tuple[int, float]] = {}
+        if manifest is not None:
+            self._dead.update(manifest.get_dead_hosts())
+            self._dead.update(manifest.get_dead_tournaments())
+
+    def check(self, url: str) -> None:
+        """Raises HostUnavailable if the URL's tournament or host is dead and its cooldown hasn't
+        passed."""
+        with self._lock:
+            for key in [get_host(url), get_tournament_url(url)]:
+                if key in self._dead and time.time() < self._dead[key][1]:
+                    raise HostUnavailable(key + ' is dead until ' +
+                                          time.strftime('%Y-%m-%d %H:%M',
+                                                        time.localtime(self._dead[key][1])))
+
+    def record_success(self, url: str) -> None:
+        """Closes the breakers of the URL's tournament and host."""
+        keys = [get_host(url), get_tournament_url(url)]
+        with self._lock:
+            was_dead = []
+            for key in keys:
+                self._failures.pop(key, None)
+                was_dead.append(self._dead.pop(key, None) is not None)
+        if self.manifest is not None:
+            if was_dead[0]:
+                self.manifest.clear_dead_host(keys[0])
+            if was_dead[1]:
+                self.manifest.clear_dead_tournament(keys[1])
+
+    def record_failure(self, url: str, connection: bool = False) -> None:
+        """Counts a failure of the URL's tournament, or of its host if the connection failed,
+        opening the breaker once it failed threshold times in a row, or at once if it was dead
+        before."""
+        key = get_host(url) if connection else get_tournament_url(url)
+        with self._lock:
+            failures = self._failures.get(key, 0) + 1
+            trips = self._dead[key][0] if key in self._dead else 0
+            if failures < self.threshold and trips == 0:
+                self._failures[key] = failures
+                return
+            self._failures.pop(key, None)
+            dead_until = time.time() + min(MAX_COOLDOWN, self.cooldown * 2 ** trips)
+            self._dead[key] = (trips + 1, dead_until)
+        if self.manifest is None:
+            return
+        elif connection:
+            self.manifest.record_dead_host(key, trips + 1, dead_until)
+        else:
+            self.manifest.record_dead_tournament(key, trips + 1, dead_until)
+
+
+class RetryingFetcher(Fetcher):
+    """Retries the wrapped fetcher's failed fetches: errors and RETRY_STATUSES are tried up to
+    retries more times, after a backoff from get_backoff.
+
+    With a circuit breaker, tournaments and hosts it considers dead raise HostUnavailable instead
+    of being fetched. A page counts as one failure once all its attempts failed: of its host if
+    the last attempt couldn't connect, and of its tournament otherwise. Any page fetched resets
+    the counts. With an adaptive limiter, every attempt holds one of the host's slots, and its
+    time and status are reported to the limiter; backoffs are waited without a slot."""
+
+    def __init__(self, fetcher: Fetcher, retries: int = RETRIES, base_delay: float = BASE_DELAY,
+                 breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AdaptiveLimiter] = None) -> None:
+        super().__init__()
+        self.fetcher = fetcher
+        self.retries = retries
+        self.base_delay = base_delay
+        self.breaker = breaker
+        self.limiter = limiter
+        self.retried = 0  # number of retries so far
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        for attempt in range(self.retries + 1):
+            if self.breaker is not None:
+                self.breaker.check(url)
+            page, error = None, None
+            with self.limiter.slot(url) if self.limiter is not None else nullcontext():
+                start = time.perf_counter()
+                try:
+                    page = self.fetcher.fetch(url, headers)
+                except Exception as exception:  # e.g. a timeout, or a refused connection
+                    error = exception
+            if self.limiter is not None:
+                self.limiter.record(url, time.perf_counter() - start,
+                                    page.status if page is not None else None)
+
+            if page is not None and page.status not in RETRY_STATUSES:
+                if self.breaker is not None:
+                    self.breaker.record_success(url)
+                return page
+            if attempt < self.retries:
+                with self._stats_lock:
+                    self.retried += 1
+                time.sleep(get_backoff(attempt, self.base_delay,
+                                       retry_after=get_retry_after(page)))
+        if self.breaker is not None:  # one failure per page, however often it was tried
+            self.breaker.record_failure(url, isinstance(error, requests.ConnectionError))
+        if error is not None:
+            raise error
+        return page
+
+    def close(self) -> None:
+        self.fetcher.close()
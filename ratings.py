@@ -0,0 +1,204 @@
+"""Elo ratings of teams and speakers across every tournament in the store.
+
+Rooms are rated in chronological order, by tournament date and then by round in the order the
+rounds were scraped. A room of n teams (4 in BP, 2 in 2-team formats) is treated as every pair of
+its teams playing each other: a team gains K / (n - 1) points for each team it beats minus its
+expected score against it. Rooms of one round are independent, so each round is rated in one array
+operation.
+
+Ratings live in numpy arrays indexed by entity, and the state can be saved and loaded, so that a new
+tournament is rated on top of the saved state without replaying history. Teams and speakers are
+identified by their entity_index ids, so the same speaker is recognized across tournaments despite
+differences in spelling, while a team is only the same team within its tournament. Speaker ratings
+treat a team's rating as the mean of its speakers' ratings, and give each speaker the team's
+change."""
+
+import numpy as np
+import pandas as pd
+from dataset_store import DEFAULT_STORE, load_results, load_speakers
+from entity_index import EntityIndex, index_store, is_placeholder
+from instrumentation import timed
+
+from typing import Dict, Iterable, List, Optional
+
+
+K_FACTOR = 32.0
+INITIAL_RATING = 1500.0
+MAX_TEAMS = 4  # teams per room; bigger 'rooms' are scraping errors and are skipped
+MAX_SPEAKERS = 3  # speakers per team that count towards its rating
+TEAM_RATINGS = 'team_ratings.npz'  # where rate_store keeps the rating state of each kind
+SPEAKER_RATINGS = 'speaker_ratings.npz'
+
+
+class Ratings:
+    """The rating and number of rated rooms of every entity (team or speaker), and the tournaments
+    rated so far."""
+
+    def __init__(self, k_factor: float = K_FACTOR, initial_rating: float = INITIAL_RATING) -> None:
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.ids: List[int] = []  # entity id of each array index
+        self.indexes: Dict[int, int] = {}  # entity id to its index in the arrays
+        self.ratings = np.empty(0, dtype=np.float64)
+        self.rooms = np.empty(0, dtype=np.int32)
+        self.tournaments = set()  # names of the rated tournaments
+
+    def get_indexes(self, ids: Iterable[int]) -> np.ndarray:
+        """Returns the array index of each of the given entity ids, adding new entities at the
+        initial rating."""
+        indexes = []
+        for entity_id in ids:
+            if entity_id not in self.indexes:
+                self.indexes[entity_id] = len(self.ids)
+                self.ids.append(entity_id)
+            indexes.append(self.indexes[entity_id])
+        if len(self.ids) > len(self.ratings):  # grow the arrays, doubling their capacity
+            new = max(len(self.ids), 2 * len(self.ratings)) - len(self.ratings)
+            self.ratings = np.concatenate([self.ratings, np.full(new, self.initial_rating)])
+            self.rooms = np.concatenate([self.rooms, np.zeros(new, dtype=np.int32)])
+        return np.array(indexes, dtype=np.int64)
+
+    def rate_round(self, members: np.ndarray, points: np.ndarray) -> None:
+        """Updates ratings with the rooms of one round. members[room, team, speaker] holds entity
+        indexes and points[room, team] the team's points, both padded with -1."""
+        present = members >= 0
+        speakers = np.where(present, self.ratings[np.maximum(members, 0)], 0.0)
+        teams = present.any(axis=2)
+        team_ratings = speakers.sum(axis=2) / np.maximum(present.sum(axis=2), 1)
+
+        # expected and actual score of team i against team j, for every pair in every room
+        expected = 1 / (1 + 10 ** ((team_ratings[:, None, :] - team_ratings[:, :, None]) / 400))
+        actual = (points[:, :, None] > points[:, None, :]) + \
+            0.5 * (points[:, :, None] == points[:, None, :])
+        pairs = teams[:, :, None] & teams[:, None, :] & ~np.eye(teams.shape[1], dtype=bool)
+        opponents = np.maximum(teams.sum(axis=1) - 1, 1)[:, None]
+        changes = self.k_factor * ((actual - expected) * pairs).sum(axis=2) / opponents
+
+        changes = np.broadcast_to(changes[:, :, None], members.shape)
+        np.add.at(self.ratings, members[present], changes[present])
+        np.add.at(self.rooms, members[present], 1)
+
+    def update(self, results_df: pd.DataFrame, speakers_df: Optional[pd.DataFrame] = None) -> int:
+        """Rates the rooms of every tournament in results_df (as loaded by
+        dataset_store.load_results) that wasn't rated before, in chronological order. With
+        speakers_df (from load_speakers), speakers are rated instead of teams. Returns the number
+        of tournaments rated.
+
+        Both need the entity ids of their teams and speakers in their team_id and speaker_id
+        columns, as stored by entity_index.index_store. Swing and other placeholder teams, and
+        placeholder speakers like 'Speaker 1' or 'Redacted', are left out: they are different
+        people from one tournament to the next, so their results say nothing about anyone's
+        rating."""
+        results_df = results_df[~results_df['tournament'].isin(self.tournaments)]
+        results_df = results_df[~is_placeholder_name(results_df['team'], 'team')]
+        results_df = results_df.assign(order=np.arange(len(results_df)))  # scraping order
+        results_df = results_df.sort_values(['date', 'tournament_id', 'order'], kind='stable',
+                                            na_position='last')
+        by_room = results_df.groupby(['tournament_id', 'round', 'room'], observed=True, sort=False)
+        results_df = results_df.assign(slot=by_room.cumcount())  # each team's place in its room
+        sizes = by_room['team'].transform('size')
+        results_df = results_df[(sizes >= 2) & (sizes <= MAX_TEAMS)]
+
+        members_df = get_members(results_df, speakers_df)
+        for _, round_df in results_df.groupby(['tournament_id', 'round'], observed=True,
+                                              sort=False):
+            rooms = round_df.groupby('room', sort=False).ngroup().to_numpy()
+            teams = round_df['slot'].to_numpy()
+            members = np.full((rooms.max() + 1, MAX_TEAMS, MAX_SPEAKERS), -1, dtype=np.int64)
+            points = np.full((rooms.max() + 1, MAX_TEAMS), -1, dtype=np.int64)
+            points[rooms, teams] = round_df['points'].to_numpy()
+            for speaker, ids in enumerate(members_df.loc[round_df.index].T.to_numpy()):
+                known = pd.notna(ids)
+                members[rooms[known], teams[known], speaker] = self.get_indexes(ids[known])
+            self.rate_round(members, points)
+
+        new = set(results_df['tournament'].astype(str))
+        self.tournaments |= new
+        return len(new)
+
+    def get_table(self, names: Optional[Dict[int, str]] = None) -> pd.DataFrame:
+        """Returns the id of every rated entity with its rating and number of rated rooms, best
+        first, and its name if names (as from EntityIndex.get_names) are given."""
+        n = len(self.ids)
+        df = pd.DataFrame({'id': self.ids, 'rating': self.ratings[:n], 'rooms': self.rooms[:n]})
+        if names is not None:
+            df.insert(1, 'name', df['id'].map(names))
+        return df.sort_values('rating', ascending=False, ignore_index=True)
+
+    def save(self, path: str) -> None:
+        """Saves the state to the given .npz file."""
+        n = len(self.ids)
+        np.savez_compressed(path, ids=np.array(self.ids, dtype=np.int64),
+                            ratings=self.ratings[:n], rooms=self.rooms[:n],
+                            tournaments=np.array(sorted(self.tournaments), dtype=str),
+                            settings=np.array([self.k_factor, self.initial_rating]))
+
+    @classmethod
+    def load(cls, path: str) -> 'Ratings':
+        """Returns the state saved to the given .npz file."""
+        with np.load(path) as data:
+            ratings = cls(*data['settings'])
+            ratings.get_indexes(data['ids'].tolist())
+            ratings.ratings[:len(ratings.ids)] = data['ratings']
+            ratings.rooms[:len(ratings.ids)] = data['rooms']
+            ratings.tournaments = set(data['tournaments'].tolist())
+        return ratings
+
+
+def is_placeholder_name(names: pd.Series, kind: str) -> pd.Series:
+    """Returns whether each of the given team or speaker names is a placeholder (see
+    entity_index.is_placeholder). Each distinct name is checked once."""
+    names = names.astype(object)
+    distinct = names.dropna().unique()
+    placeholders = pd.Series([is_placeholder(kind, name) for name in distinct], index=distinct,
+                             dtype=bool)
+    return names.map(placeholders).fillna(False).astype(bool)
+
+
+def get_members(results_df: pd.DataFrame, speakers_df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Returns, for each row of results_df, the ids of the entities rated for its team, one per
+    column (up to MAX_SPEAKERS, missing ones NaN): the team itself, or its speakers if speakers_df
+    is given. Teams without known speakers are left unrated."""
+    if speakers_df is None:
+        return pd.DataFrame({0: results_df['team_id']}, index=results_df.index)
+
+    speakers_df = speakers_df.dropna(subset=['team_id', 'speaker_id'])
+    speakers_df = speakers_df[~is_placeholder_name(speakers_df['name'], 'speaker')]
+    speakers_df = speakers_df.assign(slot=speakers_df.groupby(['tournament_id', 'team_id'])
+                                     .cumcount())
+    speakers_df = speakers_df[speakers_df['slot'] < MAX_SPEAKERS]
+    table = speakers_df.pivot_table(index=['tournament_id', 'team_id'], columns='slot',
+                                    values='speaker_id', aggfunc='first')
+    keys = pd.MultiIndex.from_arrays([results_df['tournament_id'], results_df['team_id']])
+    members = table.reindex(keys).set_axis(results_df.index)
+    return members.reindex(columns=range(MAX_SPEAKERS))
+
+
+@timed
+def rate_store(path: str = DEFAULT_STORE, speakers: bool = False,
+               state_path: Optional[str] = None, persist: bool = True, **filters) -> Ratings:
+    """Returns the ratings of every team (or speaker) in the store.
+
+    If persist is True, the state saved at state_path (by default TEAM_RATINGS or SPEAKER_RATINGS)
+    is loaded if it exists, only the tournaments it hasn't rated are rated, and the new state is
+    saved. Tournaments can be filtered as in dataset_store.load_results. Entity ids are given to
+    any rows of the store that have none yet first."""
+    if state_path is None:
+        state_path = SPEAKER_RATINGS if speakers else TEAM_RATINGS
+    try:
+        ratings = Ratings.load(state_path) if persist else Ratings()
+    except FileNotFoundError:
+        ratings = Ratings()
+    index_store(path)
+    results_df = load_results(path, **filters)
+    speakers_df = load_speakers(path, **filters) if speakers else None
+    ratings.update(results_df, speakers_df)
+    if persist:
+        ratings.save(state_path)
+    return ratings
+
+
+if __name__ == '__main__':
+    index = EntityIndex()
+    print(rate_store(persist=False).get_table(index.get_names('team')).head(20).to_string())
+    index.close()
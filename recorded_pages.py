@@ -0,0 +1,116 @@
+"""Records real tab pages for the offline benchmarks, and reads them back.
+
+record_fixtures fetches the landing, motions, motion statistics, speaker tab and results pages of
+the tournaments in FIXTURES, running the scrapers through a RecordingFetcher so that exactly the
+pages they read are saved, as fetched and with all their markup. Pages come from the live sites
+or, offline, from the page cache of an earlier crawl. Each page is saved at
+<folder>/<host>/<path>/index.html, where FixtureFetcher reads it back.
+
+    python recorded_pages.py            # from the live sites
+    python recorded_pages.py --offline  # from page_cache/"""
+
+import sys
+from driver_pool import close_shared_pool
+from fetchers import Fetcher, Page, make_fetcher
+from page_cache import DEFAULT_CACHE_DIR, PageNotCached
+from pathlib import Path
+from scrape_motions import scrape_motions
+from scrape_results import scrape_results
+from scrape_speaker_tab import scrape_speaker_tab
+from site_map import get_site_map
+from urllib.parse import urlparse
+
+from typing import Dict, List, Optional
+
+
+FIXTURES_DIR = 'benchmark_fixtures/'
+# the tournaments recorded as fixtures, from both calicotab and herokuapp sites
+FIXTURES = ['https://hhiv2021.calicotab.com/HHIV2021/',  # Hart House IV 2021
+            'https://bdc.calicotab.com/17pw2020/',  # BDC Pre-Worlds 2020
+            'https://doxbridge-four-tab.herokuapp.com/doxbridge4/',  # Doxbridge IV 2021
+            'https://hkowsdci-2.herokuapp.com/hkowsdci_2/']  # HK WSDC 2021
+
+
+def get_fixture_path(url: str, folder: str = FIXTURES_DIR) -> Path:
+    """Returns where the page at the given URL is recorded: <folder>/<host>/<path>/index.html,
+    whatever the URL's scheme or query."""
+    parts = urlparse(url)
+    return Path(folder) / parts.netloc.lower() / parts.path.strip('/') / 'index.html'
+
+
+def is_recorded(url: str, folder: str = FIXTURES_DIR) -> bool:
+    """Returns whether the landing page of the tournament at the given URL is recorded."""
+    return get_fixture_path(url, folder).exists()
+
+
+class FixtureFetcher(Fetcher):
+    """Reads recorded pages from the fixture folder. Pages that weren't recorded are 404s."""
+
+    def __init__(self, folder: str = FIXTURES_DIR) -> None:
+        super().__init__()
+        self.folder = folder
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        filepath = get_fixture_path(url, self.folder)
+        if not filepath.exists():
+            return Page(url, 404, '', {})
+        return Page(url, 200, filepath.read_text(encoding='utf-8'), {})
+
+
+class RecordingFetcher(Fetcher):
+    """Fetches pages with the given fetcher and saves every page it gets to the fixture folder."""
+
+    def __init__(self, fetcher: Fetcher, folder: str = FIXTURES_DIR) -> None:
+        super().__init__()
+        self.fetcher = fetcher
+        self.folder = folder
+        self.recorded: List[str] = []  # URLs of the pages saved
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> Page:
+        page = self.fetcher.fetch(url, headers)
+        if page.status == 200:
+            filepath = get_fixture_path(url, self.folder)
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            filepath.write_text(page.text, encoding='utf-8')
+            self.recorded.append(url)
+        return page
+
+    def close(self) -> None:
+        self.fetcher.close()
+
+
+def record_tournament(url: str, fetcher: Fetcher) -> None:
+    """Fetches, through the given fetcher, every page the scrapers read for the tournament at
+    the given URL."""
+    site_map = get_site_map(url, fetcher)
+    scrape_motions(url, fetcher, site_map=site_map)
+    if site_map.motion_statistics != '':
+        scrape_motions(url, fetcher, site_map=site_map._replace(motions=''))
+    scrape_speaker_tab(url, fetcher, site_map=site_map)
+    for round_url in site_map.rounds:
+        scrape_results(round_url, fetcher)
+
+
+def record_fixtures(urls: List[str] = FIXTURES, folder: str = FIXTURES_DIR,
+                    backend: str = 'auto', cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                    offline: bool = False) -> int:
+    """Records the pages of the tournaments at the given URLs to the fixture folder, fetched with
+    the given backend through the page cache in cache_dir, or only from the cache in offline mode.
+    Tournaments that fail are reported and skipped. Returns the number of pages recorded."""
+    fetcher = RecordingFetcher(make_fetcher(backend, cache_dir, offline=offline), folder)
+    try:
+        for url in urls:
+            try:
+                record_tournament(url, fetcher)
+            except PageNotCached:
+                print(url, 'is not in the page cache')
+            except Exception as error:  # e.g. a site that is gone, so record the others
+                print(url, 'failed:', repr(error))
+    finally:
+        fetcher.close()
+        close_shared_pool()  # quit any browsers the fallback started
+    return len(set(fetcher.recorded))
+
+
+if __name__ == '__main__':
+    print(record_fixtures(offline='--offline' in sys.argv[1:]), 'pages recorded')
@@ -1,64 +1,78 @@
 """Scrapes motions tabs. Not Motion statistics tabs."""
 
 import pandas as pd
-import os.path
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-
-from typing import List, Dict, Tuple
+from bs4 import BeautifulSoup, SoupStrainer
+from crawl_manifest import CrawlManifest, fetch_and_parse, is_tab_saved
+from fetchers import Fetcher, make_fetcher
+from motion_search import index_tournament
+from parsing import make_soup
+from site_map import SiteMap, get_site_map
+
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
-from urllib.parse import urljoin
 
 
-def save_all_motions(tournament_name: str, base_url: str, driver: webdriver.Edge) -> None:
-    """Saves in a csv file all motions from the given tournament"""
+def save_all_motions(tournament_name: str, base_url: str, fetcher: Fetcher,
+                     overwrite: bool = False, manifest: Optional[CrawlManifest] = None,
+                     site_map: Optional[SiteMap] = None) -> None:
+    """Saves in a csv file all motions from the given tournament.
+
+    With a crawl manifest, a tournament it saved is refreshed once it considers it stale.
+    The tournament's site map is looked up unless it is given. Saved motions are also added to the
+    motion search index."""
     filepath = Path('scraped_data/' + tournament_name + ' - Motions.csv')
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    if os.path.exists(filepath):
-        return
-
-    df = scrape_motions(base_url, driver)
-    if df.empty:
+    if not overwrite and is_tab_saved(filepath, tournament_name, 'motions', manifest):
         return
 
-    df.to_csv(filepath)  # save as csv
+    df = scrape_motions(base_url, fetcher, manifest, tournament_name, site_map)
+    if not df.empty:
+        df.to_csv(filepath)  # save as csv
+        index_tournament(tournament_name, df)
+    if manifest is not None:
+        manifest.complete_tournament(tournament_name, 'motions')
 
 
-def scrape_motions(base_url: str, driver: webdriver.Edge) -> pd.DataFrame:
+def scrape_motions(base_url: str, fetcher: Fetcher, manifest: Optional[CrawlManifest] = None,
+                   tournament_name: str = '', site_map: Optional[SiteMap] = None) -> pd.DataFrame:
     """Given a filepath containing tournament name and basic URL, extracts each round's name,
     motion and infoslide."""
-    valid_url = get_valid_motions_url(base_url, driver)
+    if site_map is None:
+        site_map = get_site_map(base_url, fetcher, manifest, tournament_name)
+    # tournaments without a motions tab may still publish motion statistics
+    valid_url = site_map.motions or site_map.motion_statistics
     if valid_url == '':
         return pd.DataFrame()
 
-    driver.get(valid_url)  # load website
-    soup = BeautifulSoup(driver.page_source, features="html.parser")  # feed HTML into bs4
-
-    round_names, info_slides, motions = choose_scraper(soup, valid_url)
+    # load website, or reuse what the manifest has from it
+    parsed = fetch_and_parse(valid_url, fetcher, lambda html: parse_motions(html, valid_url),
+                             manifest, tournament_name, 'motions')
 
     # create a dataframe out of this data
-    df = pd.DataFrame()
-    df['Round'] = round_names
-    df['Info Slide'] = info_slides
-    df['Motion'] = motions
+    return make_motions_df(parsed)
+
 
-    return df
+def make_motions_df(parsed: Tuple[List, List, List]) -> pd.DataFrame:
+    """Returns the motions tab dataframe of the round names, infoslides and motions parsed by
+    parse_motions."""
+    round_names, info_slides, motions = parsed
+    return pd.DataFrame({'Round': round_names, 'Info Slide': info_slides, 'Motion': motions})
 
 
-def get_valid_motions_url(base_url: str, driver: webdriver.Edge) -> str:
-    """Returns a valid speaker tab if the given URl leads to one, and returns '' otherwise."""
-    driver.get(base_url)  # doing this means that we no longer need to use the URL in the caller
-    soup = BeautifulSoup(driver.page_source, features="html.parser")
+def parse_motions(html: str, url: str) -> Tuple[List, List, List]:
+    """Return the round names, infoslides and motions of the given motions page HTML.
 
-    for a in soup.findAll('a', {'class': 'nav-link'}):
-        if 'motions' in a['href']:
-            return urljoin(base_url, a['href'])
-    return ''
+    Only the round elements of the page are parsed."""
+    rounds_tag, round_name_tag, motion_text_tag = get_scraper_tags(url)
+    if rounds_tag[0] == '':  # if the URL is invalid
+        return [], [], []
+    soup = make_soup(html, SoupStrainer(*rounds_tag))  # feed the rounds into bs4
+    return scrape_rounds(soup, rounds_tag, round_name_tag, motion_text_tag)
 
 
-def choose_scraper(soup: BeautifulSoup, url: str) -> Tuple[List, List, List]:
-    """Choose the scraper to use based on the website then return the columns"""
+def get_scraper_tags(url: str) -> Tuple[Tuple[str, dict], Tuple[str, dict], Tuple[str, dict]]:
+    """Return the tags holding each round, round name and motion text for the website of the
+    given URL. The tag names are empty if the URL is not a known motions page."""
     # choose the scraper by setting the appropriate values of these three variables
     # based on the if-else cases
     rounds_tag, round_name_tag, motion_text_tag = ('', {}), ('', {}), ('', {})
@@ -73,8 +87,6 @@ def choose_scraper(soup: BeautifulSoup, url: str) -> Tuple[List, List, List]:
             rounds_tag = ('div', {'class': 'list-group list-group-flush'})
             round_name_tag = ('h4', {'class': 'card-title mt-0 mb-2 d-inline-block'})
             motion_text_tag = ('div', {'class': 'mr-auto pr-3 lead'})
-
-        return scrape_rounds(soup, rounds_tag, round_name_tag, motion_text_tag)
     elif 'heroku' in url:  # if herokuapp website
         if 'statistics' in url:  # if it's a motion statistics URL
             rounds_tag = ('div', {'class': 'list-group mt-3'})
@@ -86,9 +98,7 @@ def choose_scraper(soup: BeautifulSoup, url: str) -> Tuple[List, List, List]:
             round_name_tag = ('h4', {'class': 'card-title mt-0 mb-2 d-inline-block'})
             motion_text_tag = ('div', {'class': 'mr-auto pr-3 lead'})
 
-        return scrape_rounds(soup, rounds_tag, round_name_tag, motion_text_tag)
-
-    return [], [], []  # if the URL is invalid
+    return rounds_tag, round_name_tag, motion_text_tag
 
 
 def scrape_rounds(soup: BeautifulSoup, rounds_tag: tuple, round_name_tag: Tuple[str, dict],
@@ -99,43 +109,40 @@ def scrape_rounds(soup: BeautifulSoup, rounds_tag: tuple, round_name_tag: Tuple[
     round_names, info_slides, motions = [], [], []
     for round in rounds:  # search list of rounds
         # get round name
-        round_name = round.findAll(*round_name_tag)[0].text.strip()
+        round_name = round.find(*round_name_tag).text.strip()
         round_names.append(round_name)
 
         # search for the motion text
-        print(rounds_tag, round_name_tag, motion_text_tag)
-        motion_elements = round.findAll(*motion_text_tag)
-        if len(motion_elements) == 0:
+        motion_element = round.find(*motion_text_tag)  # stops at the first match
+        if motion_element is None:
             motions.append('')
         else:
-            motions.append(motion_elements[0].text.strip())
+            motions.append(motion_element.text.strip())
 
         # search for anything that could be an infoslide
-        infoslide_elements = round.findAll('div', {'class': 'modal-body'})
-        if len(infoslide_elements) > 0:  # if there is an infoslide, add it
+        infoslide_element = round.find('div', {'class': 'modal-body'})
+        if infoslide_element is not None:  # if there is an infoslide, add it
             # collect the paragraphs in the infoslide
             infoslide_text = str.join('\n', [paragraph.text.strip()
-                                             for paragraph in
-                                             infoslide_elements[0].findAll('p')])
+                                             for paragraph in infoslide_element.findAll('p')])
             info_slides.append(infoslide_text)
         else:  # if there are no infoslides, add an empty string
             info_slides.append('')
     return round_names, info_slides, motions
 
 
-def test_scrapers() -> None:
+def test_scrapers(backend: str = 'auto') -> None:
     """Test each scraper."""
-    s = Service('C:\\Users\\Dell\\.wdm\\drivers\\edgedriver\\win64\\98.0.1108.62\\msedgedriver.exe')
-    driver = webdriver.Edge(service=s)
+    fetcher = make_fetcher(backend)
 
     # websites corresponding to each scraper.
-    # print(scrape_motions("https://hhiv2020.calicotab.com/hhiv2020/", driver))
-    # print(scrape_motions('https://naudc2021.calicotab.com/', driver))
-    # print(scrape_motions('https://chancellors2019.herokuapp.com/', driver))
-    # print(scrape_motions('https://yaleiv2018.herokuapp.com/', driver))
-    print(scrape_motions('https://salty-wildwood-56548.herokuapp.com/Anudc19/motions/', driver))
+    # print(scrape_motions("https://hhiv2020.calicotab.com/hhiv2020/", fetcher))
+    # print(scrape_motions('https://naudc2021.calicotab.com/', fetcher))
+    # print(scrape_motions('https://chancellors2019.herokuapp.com/', fetcher))
+    # print(scrape_motions('https://yaleiv2018.herokuapp.com/', fetcher))
+    print(scrape_motions('https://salty-wildwood-56548.herokuapp.com/Anudc19/motions/', fetcher))
 
-    driver.close()
+    fetcher.close()
 
 
 if __name__ == '__main__':
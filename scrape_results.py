@@ -1,89 +1,124 @@
 """A script to scrape results tabs for team data."""
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
 import re
-import os.path
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from urllib.parse import urljoin
-from webdriver_manager.microsoft import EdgeChromiumDriverManager
+from concurrent.futures import ThreadPoolExecutor
+from crawl_manifest import CrawlManifest, fetch_and_parse, is_tab_saved
+from fetchers import Fetcher, make_fetcher
+from parsing import make_soup, get_column_indexes, slice_html
+from site_map import SiteMap, get_site_map
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
-def save_all_results(tournament_name: str, base_url: str, driver: webdriver.Edge) -> None:
+# one row per team per room; Room numbers the rooms of each round from 0, and Ambiguous Room is
+# True for rooms only told apart from another room of the round by their teams' positions
+RESULTS_COLUMNS = ['Round Name', 'Room', 'Panel', 'Team', 'Position', 'Points', 'Ambiguous Room']
+# row attributes holding the id of the row's debate
+DEBATE_ATTRIBUTES = ['data-debate-id', 'data-debate']
+# the id in the link to an adjudicator's page, e.g. /hhiv2021/participants/adjudicator/1234/
+ADJUDICATOR_ID = re.compile(r'/adjudicators?/(\d+)')
+ROUND_WORKERS = 4  # round pages of one tournament fetched at once, within the fetcher's limits
+
+
+def save_all_results(tournament_name: str, base_url: str, fetcher: Fetcher,
+                     overwrite: bool = False, manifest: Optional[CrawlManifest] = None,
+                     site_map: Optional[SiteMap] = None) -> None:
+    """Saves in a csv file all results from the given tournament.
+
+    With a crawl manifest, a tournament it saved is refreshed once it considers it stale,
+    and only its new or changed round pages are parsed again. The tournament's site map is looked
+    up unless it is given."""
     filepath = Path('scraped_data/' + tournament_name + ' - Results.csv')
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    if os.path.exists(filepath):
+    if not overwrite and is_tab_saved(filepath, tournament_name, 'results', manifest):
         return
 
-    df = scrape_all_results(base_url, driver)
-    if df.empty:
-        return
+    df = scrape_all_results(base_url, fetcher, manifest=manifest, tournament_name=tournament_name,
+                            site_map=site_map)
+    if not df.empty:
+        df.to_csv(filepath)  # save as csv
+    if manifest is not None:
+        manifest.complete_tournament(tournament_name, 'results')
 
-    df.to_csv(filepath)  # save as csv
 
-
-def scrape_all_results(tournament_url: str, driver: webdriver.Edge) -> pd.DataFrame:
+def scrape_all_results(tournament_url: str, fetcher: Fetcher, workers: int = ROUND_WORKERS,
+                       manifest: Optional[CrawlManifest] = None, tournament_name: str = '',
+                       site_map: Optional[SiteMap] = None) -> pd.DataFrame:
     """Return a single dataframe containing scraped results data from all rounds at the given
     tournament URL.
 
+    Round pages are fetched and parsed on up to the given number of worker threads. How many of
+    them hit the tournament's host at once is up to the fetcher: one made by make_fetcher with a
+    politeness.AdaptiveLimiter holds one of the host's slots for each fetch, shared with every
+    other fetch of the crawl, so the crawl's limit per host holds. Rounds keep the order of
+    the rounds menu. With a crawl manifest, rounds parsed before are reused unless their page
+    changed, and each round is recorded as soon as it is parsed.
+
     Preconditions:
         - url is a tabbycat link"""
-    driver.get(tournament_url)
-    soup = BeautifulSoup(driver.page_source, features="html.parser")
+    if site_map is None:
+        site_map = get_site_map(tournament_url, fetcher, manifest, tournament_name)
+    # the results page of each round. Note: if there are none, an empty dataframe is returned.
+    result_urls = site_map.rounds
+
+    def scrape_round(result_url: str) -> List[Dict]:
+        return fetch_and_parse(result_url, fetcher, lambda html: parse_results(html, result_url),
+                               manifest, tournament_name, 'results')
 
-    # Find all results links. Note: if there are none, an empty dataframe is returned.
-    round_menu = soup.findAll('div', {'class': 'dropdown-menu', 'aria-labelledby': 'roundsDrop'})
-    if len(round_menu) == 0:
-        return pd.DataFrame()
-    else:
-        rounds = round_menu[0].findAll('a', {'class': 'dropdown-item'})
+    # fill list with the scraped records from each round, in menu order
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rounds_records = list(executor.map(scrape_round, result_urls))
 
-    # fill list with the scraped data from each round
-    rounds_dfs = []
-    for round in rounds:
-        result_url = urljoin(tournament_url, round['href'])  # get the full url for the results page
-        rounds_dfs.append(scrape_results(result_url, driver))  # append scraped results data
+    return make_results_df(rounds_records)
 
-    # concatenate the results into one dataframe
-    df = pd.DataFrame()
-    for round_df in rounds_dfs:
-        df = pd.DataFrame.append(self=df, other=round_df, ignore_index=True)
 
-    return df
+def make_results_df(rounds_records: List[List[Dict]]) -> pd.DataFrame:
+    """Returns the results dataframe of the records parsed by parse_results from each round, in
+    the given order."""
+    # build the dataframe in one go rather than appending round by round
+    records = [record for round_records in rounds_records for record in round_records]
+    return pd.DataFrame.from_records(records, columns=RESULTS_COLUMNS)
 
 
-def scrape_results(results_url: str, driver: webdriver.Edge) -> pd.DataFrame:
+def scrape_results(results_url: str, fetcher: Fetcher) -> pd.DataFrame:
     """Returns a dataframe containing adjudicators and team rankings for the given round URL."""
-    driver.get(results_url)
-    soup = BeautifulSoup(driver.page_source, features="html.parser")  # feed HTML into bs4
+    return make_results_df([parse_results(fetcher.get(results_url), results_url)])
 
-    tables = soup.findAll('div', {'class': 'table-responsive-md'})  # find table
-    if len(tables) == 0:
-        tables = soup.findAll('table', {'class': 'table-responsive-md'})
-    table = tables[0]
-    table_headers = get_table_headers(table)  # find table headers
+
+def parse_results(html: str, results_url: str) -> List[Dict]:
+    """Returns one record per team in each room, holding its round name, room number, panel, team
+    name, position (e.g. 'OG'), points and whether its room is ambiguous (see process_row), for the
+    given results page HTML. Teams in a room are ordered by ranking.
+
+    Only the page's tables and the <small> round title are parsed."""
+    html = slice_html(html, ['small', 'table'], 'table')  # skip the navigation and scripts
+    soup = make_soup(html, SoupStrainer(['small', 'table']))  # feed HTML into bs4
+
+    # the results table is the one with a header and body
+    table = [table for table in soup.findAll('table') if table.find('tbody') is not None][0]
+    # find the column of each table header once rather than for every row
+    columns = get_column_indexes(get_table_headers(table))
 
     rooms_dict = {}  # this will be filled with the data from every room in the round
     for row in table.find('tbody').findAll('tr'):  # for each row in the tab table
         # enter row into rounds_dict
-        process_row(rooms_dict, row, results_url, table_headers)
+        process_row(rooms_dict, row, results_url, columns)
 
-    rooms_panel, rooms_rankings = [], []
-    for adj in rooms_dict:
-        rooms_panel.append(adj)
-        # room[0] is the ranking score, sort in descending order of ranking
-        room_rankings = sorted(rooms_dict[adj], key=lambda room: int(room[0]), reverse=True)
-        rooms_rankings.append(room_rankings)
+    round_name = soup.find('small').text.strip()[4:]
+    records = []
+    # rooms without an id sharing their venue and panel were only split by position
+    rooms = [(panel, teams, room_id is None and len(panel_rooms) > 1)
+             for (venue, panel, room_id), panel_rooms in rooms_dict.items()
+             for teams in panel_rooms]
+    for room, (panel, teams, ambiguous) in enumerate(rooms):
+        # team[0] is the ranking score, sort in descending order of ranking
+        for points, team, position in sorted(teams, key=lambda team: team[0], reverse=True):
+            records.append({'Round Name': round_name, 'Room': room, 'Panel': panel, 'Team': team,
+                            'Position': position, 'Points': points, 'Ambiguous Room': ambiguous})
 
-    df = pd.DataFrame()
-    df['Round Name'] = [soup.find('small').text.strip()[4:]] * len(rooms_panel)
-    df['Panel'] = rooms_panel
-    df['Rankings'] = rooms_rankings
-
-    return df
+    return records
 
 
 def get_table_headers(table: BeautifulSoup) -> List[str]:
@@ -100,36 +135,66 @@ def get_table_headers(table: BeautifulSoup) -> List[str]:
     return table_headers
 
 
-def process_row(rooms_dict: dict, row: BeautifulSoup, url: str, headers: list) -> None:
-    """Mutates rounds_dict to add the panel as a key and list of teams (ordered by ranking) as
-    value."""
-    round_adj_elements = row.findAll('td', {'class': 'adjudicator-name'})  # find adjudicator td
+def get_room_id(row: BeautifulSoup, adjudicator_element: BeautifulSoup) -> Optional[str]:
+    """Returns what identifies the room of the given results row: the id of its debate if the row
+    has one, or else the ids in the links to its adjudicators' pages, or None if it has neither."""
+    for attribute in DEBATE_ATTRIBUTES:
+        if row.has_attr(attribute):
+            return 'debate ' + row[attribute]
+    ids = [match.group(1) for link in adjudicator_element.findAll('a', href=True)
+           for match in [ADJUDICATOR_ID.search(link['href'])] if match is not None]
+    return 'adjudicators ' + ' '.join(ids) if len(ids) > 0 else None
+
+
+def process_row(rooms_dict: dict, row: BeautifulSoup, url: str, columns: Dict[str, int]) \
+        -> None:
+    """Mutates rounds_dict to add the team in the given row to its room. Rooms are keyed by their
+    (venue, panel, room id), with venue '' if the table has no venue column and the room id from
+    get_room_id, and each key holds a list of rooms, each a list of (points, team name, position)
+    tuples. columns maps each table header to its column index.
+
+    Without a room id, two rooms with the same venue and panel (e.g. chairs with the same name and
+    no venues) can only be told apart by their positions: a team joins the first room whose
+    position it isn't already taken in. Which teams share a room then depends on the order of the
+    rows, so parse_results marks those rooms as ambiguous."""
+    cols = row.findAll('td')  # get row elements
+    # find adjudicator td
+    round_adj_elements = [element for element in cols
+                          if 'adjudicator-name' in element.get('class', [])]
     if len(round_adj_elements) == 0:  # if no td element of class 'adjudicator-name' name found
-        round_adj_elements = [element for element in row.findAll('td')  # collect row elements
+        round_adj_elements = [element for element in cols  # collect row elements
                               if 'adj' in str(element)]  # if 'adj' anywhere in element
         if len(round_adj_elements) == 0:  # if still no adj name found, don't modify rounds_dict
             return
     # get adj name from the correct span element
     round_adj_name = round_adj_elements[0].find('span', {'class': 'tooltip-trigger'}).text.strip()
-    if round_adj_name not in rooms_dict:  # if the current room isn't already in rooms_dict
-        rooms_dict[round_adj_name] = []
+    venue = ''
+    if 'Venue' in columns:
+        venue = cols[columns['Venue']].text.strip()
+    room_id = get_room_id(row, round_adj_elements[0])
+    panel_rooms = rooms_dict.setdefault((venue, round_adj_name, room_id), [])
 
     # todo: outrounds don't have all four rankings
     # todo: finals rounds go 2-1-1-1
-    cols = row.findAll('td')  # get row elements
-    team_name = cols[headers.index('Team')].find('span').text.strip()  # scrape team name
+    team_name = cols[columns['Team']].find('span').text.strip()  # scrape team name
     # scrape the words in team position e.g. ['Opening', 'Opposition'] or ['Government']
-    team_position_list = cols[headers.index('Side')].find('span').text.split()
+    team_position_list = cols[columns['Side']].find('span').text.split()
     team_position = team_position_list[0][0]  # abbreviate position
     if len(team_position_list) > 1:
         team_position += team_position_list[1][0]
 
     # scrape number of points earned by the team e.g. 3 for 1st
-    ranking = int(cols[headers.index('Result')].find('span').text.strip()) - 1
-    rooms_dict[round_adj_name].append(str(ranking) + ' ' + team_name + ' (' + team_position + ')')
+    ranking = int(cols[columns['Result']].find('span').text.strip()) - 1
+    # the first room of this panel without a team in this position, or a new one
+    room = next((room for room in panel_rooms
+                 if team_position not in [team[2] for team in room]), None)
+    if room is None:
+        room = []
+        panel_rooms.append(room)
+    room.append((ranking, team_name, team_position))
 
 
-def find_tabs_without_results_from_csv(filepath: str, driver: webdriver.Edge) -> list:
+def find_tabs_without_results_from_csv(filepath: str, fetcher: Fetcher) -> list:
     """Returns a list of URLs that have no results."""
     urls = []
     df = pd.read_csv(filepath)
@@ -138,28 +203,25 @@ def find_tabs_without_results_from_csv(filepath: str, driver: webdriver.Edge) ->
             # todo: deal with (lse2021.herokuapp.com)
             if 'calico' in url or 'heroku' in url:  # if tabbycat link
                 print(url)
-                driver.get(url)
-                if 'results/round/1' not in driver.page_source:
+                if 'results/round/1' not in fetcher.get(url):
                     print('no results')
                     urls.append(url)
     return urls
 
 
-def test_scrape_results() -> None:
-    s = Service('C:\\Users\\Dell\\.wdm\\drivers\\edgedriver\\win64\\98.0.1108.62\\msedgedriver.exe')
-    driver = webdriver.Edge(service=s)
-    # print(scrape_all_results('https://westerniv.herokuapp.com/', driver))
-    # print(scrape_all_results('https://hhiv2020.calicotab.com/hhiv2020/', driver))
-    # print(scrape_all_results('https://cinnamonscroll.herokuapp.com/cinnamonscroll2020/', driver))
-    print(scrape_all_results('http://easters2016.herokuapp.com/auea16/', driver))
+def test_scrape_results(backend: str = 'auto') -> None:
+    fetcher = make_fetcher(backend)
+    # print(scrape_all_results('https://westerniv.herokuapp.com/', fetcher))
+    # print(scrape_all_results('https://hhiv2020.calicotab.com/hhiv2020/', fetcher))
+    # print(scrape_all_results('https://cinnamonscroll.herokuapp.com/cinnamonscroll2020/', fetcher))
+    print(scrape_all_results('http://easters2016.herokuapp.com/auea16/', fetcher))
 
-    driver.close()
+    fetcher.close()
 
 
 if __name__ == '__main__':
     # test_scrape_results()
-    s = Service('C:\\Users\\Dell\\.wdm\\drivers\\edgedriver\\win64\\98.0.1108.62\\msedgedriver.exe')
-    driver = webdriver.Edge(service=s)
-    save_all_results('2021-07-07 WUDC 2021', 'https://wudckorea.calicotab.com/2021/', driver)
-    driver.close()
-    # find_tabs_without_results_from_csv("Debating_Motions - Motions (Grey-_Added).csv", driver)
+    fetcher = make_fetcher()
+    save_all_results('2021-07-07 WUDC 2021', 'https://wudckorea.calicotab.com/2021/', fetcher)
+    fetcher.close()
+    # find_tabs_without_results_from_csv("Debating_Motions - Motions (Grey-_Added).csv", fetcher)
@@ -1,73 +1,86 @@
 """A script to scrape results tabs for speakers data."""
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
 import re
-import os
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.microsoft import EdgeChromiumDriverManager
+from crawl_manifest import CrawlManifest, fetch_and_parse, is_tab_saved
+from fetchers import Fetcher, make_fetcher
+from parsing import make_soup, get_column_indexes, slice_html
 from pathlib import Path
-from urllib.parse import urljoin
+from site_map import SiteMap, get_site_map
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 
 
-BASE_DIR = "D:\\GitHub\\Debate-Tabs"
+# followed by one column per round (R1, R2, ...) with the speaker's score, NaN if they didn't speak
+SPEAKER_COLUMNS = ['Name', 'Team', 'Categories']
 
 
-def save_speaker_tab(tournament_name: str, speaks_url: str, driver: webdriver.Edge) -> None:
+def save_speaker_tab(tournament_name: str, speaks_url: str, fetcher: Fetcher,
+                     overwrite: bool = False, manifest: Optional[CrawlManifest] = None,
+                     site_map: Optional[SiteMap] = None) -> None:
+    """Saves in a csv file the speaker tab of the given tournament.
+
+    With a crawl manifest, a tournament it saved is refreshed once it considers it stale.
+    The tournament's site map is looked up unless it is given."""
     filepath = Path('scraped_data/' + tournament_name + ' - Speakers.csv')
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    if os.path.exists(filepath):
-        return
-
-    df = scrape_speaker_tab(speaks_url, driver)  # get database containing speaker tabs
-    if df.empty:
+    if not overwrite and is_tab_saved(filepath, tournament_name, 'speakers', manifest):
         return
 
-    df.to_csv(filepath)  # save as csv
+    # get database containing speaker tabs
+    df = scrape_speaker_tab(speaks_url, fetcher, manifest, tournament_name, site_map)
+    if not df.empty:
+        df.to_csv(filepath)  # save as csv
+    if manifest is not None:
+        manifest.complete_tournament(tournament_name, 'speakers')
 
 
-def scrape_speaker_tab(url: str, driver: webdriver.Edge) -> pd.DataFrame:
+def scrape_speaker_tab(url: str, fetcher: Fetcher, manifest: Optional[CrawlManifest] = None,
+                       tournament_name: str = '', site_map: Optional[SiteMap] = None) \
+        -> pd.DataFrame:
     """Returns a dataframe containing adjudicators and team rankings for the given round URL."""
-    valid_url = get_speaker_tab_url(url, driver)
+    if site_map is None:
+        site_map = get_site_map(url, fetcher, manifest, tournament_name)
+    valid_url = site_map.speaker_tab
     if valid_url == '':
         return pd.DataFrame()
 
-    driver.get(valid_url)  # load results url
-    soup = BeautifulSoup(driver.page_source, features="html.parser")
+    # load results url, or reuse what the manifest has from it
+    records = fetch_and_parse(valid_url, fetcher, parse_speaker_tab, manifest, tournament_name,
+                              'speaker rounds')
+    return make_speaker_df(records)
 
-    table = soup.find('div', {'class': 'table-responsive-md'})  # find table
-    table_headers = get_table_headers(table)  # find table headers
-
-    names, teams, categories, rounds_speaks = [], [], [], []
-    for row in table.find('tbody').findAll('tr'):  # for each row in the tab table
-        # enter row into rounds_dict
-        name, team, category, round_speak = process_row(row, table_headers)
-        names.append(name)
-        teams.append(team)
-        categories.append(category)
-        rounds_speaks.append(round_speak)
 
-    df = pd.DataFrame()
-    df['Name'] = names
-    df['Team'] = teams
-    df['Categories'] = categories
-    df['Speaker Scores'] = rounds_speaks
+def make_speaker_df(records: List[Dict]) -> pd.DataFrame:
+    """Returns the speaker tab dataframe of the records parsed by parse_speaker_tab, with float
+    round scores."""
+    columns = list(records[0]) if len(records) > 0 else SPEAKER_COLUMNS
+    return pd.DataFrame.from_records(records, columns=columns).astype(
+        {column: float for column in columns[len(SPEAKER_COLUMNS):]})
 
-    return df
 
+def parse_speaker_tab(html: str) -> List[Dict]:
+    """Returns a record for each speaker in the given speaker tab page HTML, holding their name,
+    team, categories and their score in each round (None if they didn't speak). Only the page's
+    tables are parsed."""
+    html = slice_html(html, ['table'], 'table')  # skip the navigation and scripts
+    soup = make_soup(html, SoupStrainer('table'))
 
-def get_speaker_tab_url(speaks_url: str, driver: webdriver.Edge) -> str:
-    """Returns a valid speaker tab if the given URl leads to one, and returns '' otherwise."""
-    driver.get(speaks_url)  # doing this means that we no longer need to use the URL in the caller
-    soup = BeautifulSoup(driver.page_source, features="html.parser")
+    # the speaker tab is the table with a header and body
+    table = [table for table in soup.findAll('table') if table.find('tbody') is not None][0]
+    table_headers = get_table_headers(table)  # find table headers
+    # find the columns once rather than for every row
+    columns, round_indexes = get_column_indexes(table_headers), get_round_indexes(table_headers)
 
-    for a in soup.findAll('a', {'class': 'nav-link'}):
-        if 'Speaker Tab' in a:
-            return urljoin(speaks_url, a['href'])
-    return ''
+    # one record for each row in the tab table
+    rounds = [table_headers[i] for i in round_indexes]
+    records = []
+    for row in table.find('tbody').findAll('tr'):
+        name, team, categories, scores = process_row(row, columns, round_indexes)
+        records.append({'Name': name, 'Team': team, 'Categories': categories,
+                        **dict(zip(rounds, scores))})
+    return records
 
 
 def get_table_headers(table: BeautifulSoup) -> List[str]:
@@ -82,30 +95,42 @@ def get_table_headers(table: BeautifulSoup) -> List[str]:
     return table_headers
 
 
-def process_row(row: BeautifulSoup, headers: list) -> tuple:
+def get_round_indexes(headers: List[str]) -> List[int]:
+    """Returns the indexes of the round score columns (R1, R2, ...) in the given headers."""
+    re_round = re.compile(r'R[0-9]+')
+    # headers[i] = headers[i].replace('R', 'Round ')
+    return [i for i in range(len(headers)) if re_round.match(headers[i])]
+
+
+def parse_score(text: str) -> Optional[float]:
+    """Returns the speaker score in the given cell text, or None if it isn't a number, e.g. '—'
+    for a missed round."""
+    try:
+        return float(text.strip())
+    except ValueError:
+        return None
+
+
+def process_row(row: BeautifulSoup, columns: Dict[str, int], round_indexes: List[int]) -> tuple:
+    """Returns the name, team, categories and round scores in the given speaker tab row, with None
+    for rounds the speaker missed. columns maps each table header to its column index."""
     cols = row.findAll('td')
     name, team, categories = '', '', ''
 
-    name = cols[headers.index('Name')].find('span').text.strip()
-    if 'Team' in headers:
-        team = cols[headers.index('Team')].find('span').text.strip()
-    if 'Categories' in headers:
-        categories = cols[headers.index('Categories')].find('span').text.strip()
+    name = cols[columns['Name']].find('span').text.strip()
+    if 'Team' in columns:
+        team = cols[columns['Team']].find('span').text.strip()
+    if 'Categories' in columns:
+        categories = cols[columns['Categories']].find('span').text.strip()
 
-    rounds_speak = []
-    re_round = re.compile(r'R[0-9]+')
-    for i in range(len(headers)):
-        if re_round.match(headers[i]):
-            # headers[i] = headers[i].replace('R', 'Round ')
-            rounds_speak.append(cols[i].find('span').text.strip())
+    rounds_speak = [parse_score(cols[i].find('span').text) for i in round_indexes]
 
     return name, team, categories, rounds_speak
 
 
 if __name__ == '__main__':
-    s = Service(EdgeChromiumDriverManager().install())
-    driver = webdriver.Edge(service=s)
+    fetcher = make_fetcher()
     save_speaker_tab("Western IV 2021", 'https://westerniv.herokuapp.com/western2021/tab/speaker/',
-                     driver)
-    save_speaker_tab("HHIV 2020", 'https://naudc2021.calicotab.com/_/tab/speaker/', driver)
-    driver.close()
+                     fetcher)
+    save_speaker_tab("HHIV 2020", 'https://naudc2021.calicotab.com/_/tab/speaker/', fetcher)
+    fetcher.close()
@@ -1,43 +1,155 @@
 import scrape_results
 import scrape_motions
 import scrape_speaker_tab
-import pandas as pd
+import threading
 import validators
 
 from bs4 import BeautifulSoup
-from webdriver_manager.microsoft import EdgeChromiumDriverManager
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from crawl_manifest import CrawlManifest, DEFAULT_MANIFEST
+from driver_pool import close_shared_pool, get_shared_pool
+from fetchers import Fetcher, make_fetcher
+from instrumentation import DEFAULT_REPORT, report_run
+from page_cache import DEFAULT_CACHE_DIR, PageNotCached
+from itertools import zip_longest
+from politeness import AdaptiveLimiter, CircuitBreaker, HostUnavailable, get_host
+from site_map import get_site_map
+from tournament_index import DEFAULT_INDEX, load_tournament_index
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 
-def save_tournaments_from_file_tabbycat(filepath: str) -> None:
-    df = pd.read_csv(filepath)
+def get_tournaments(filepath: str, index_path: Optional[str] = DEFAULT_INDEX) \
+        -> List[Tuple[str, str]]:
+    """Returns a list of (tournament name, tab links) pairs from the given motions CSV, one per
+    tournament with tabbycat links. The links are space-separated.
 
-    tournaments_set = {(str(row['Date']) + ' ' + str(row['Tournament']), str(row['Event_Link']))
-                       for index, row in df.iterrows()  # iterate rows
-                       if str(row['Event_Link']) != 'nan'}  # if there is an event link
-    tournaments = list(tournaments_set)  # convert set to tournaments list
+    Tournaments are read from the CSV's tournament index at index_path (by default next to the
+    CSV), which is only rebuilt when the CSV changes."""
+    index = load_tournament_index(filepath, index_path)
+    index = index[index['links'] != '']  # tournaments without a tabbycat site
+    return list(zip(index['name'], index['links']))
 
-    # s = Service(EdgeChromiumDriverManager().install())  # install Edge drivers
-    # driver = webdriver.Edge(service=s)  # start web driver service
-    s = Service('C:\\Users\\Dell\\.wdm\\drivers\\edgedriver\\win64\\98.0.1108.62\\msedgedriver.exe')
-    driver = webdriver.Edge(service=s)
 
-    filepath = Path('scraped_data/Motions.csv')
-    filepath.parent.mkdir(parents=True, exist_ok=True)
+def save_tournament(tournament_name: str, event_links: str, fetcher: Fetcher,
+                    overwrite: bool = False, manifest: Optional[CrawlManifest] = None) -> None:
+    """Saves the motions, speaker tab and results of the given tournament, replacing any saved
+    files if overwrite is True. With a crawl manifest, only new or changed pages are parsed.
+
+    Each tournament's landing page is fetched once, to find the pages of all three tabs."""
+    for url in event_links.split():  # sometimes there are multiple links, so analyze each
+        if not validators.url(url):
+            continue
+        elif 'calico' in url or 'heroku' in url:  # if it's a tabbycat link
+            site_map = get_site_map(url, fetcher, manifest, tournament_name)
+            scrape_motions.save_all_motions(tournament_name, url, fetcher, overwrite, manifest,
+                                            site_map)
+            scrape_speaker_tab.save_speaker_tab(tournament_name, url, fetcher, overwrite, manifest,
+                                                site_map)
+            scrape_results.save_all_results(tournament_name, url, fetcher, overwrite, manifest,
+                                            site_map)
+
+
+def save_tournaments_from_file_tabbycat(filepath: str, backend: str = 'auto',
+                                        offline: bool = False,
+                                        manifest_path: Optional[str] = DEFAULT_MANIFEST,
+                                        report_path: Optional[str] = DEFAULT_REPORT,
+                                        cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> None:
+    """Saves every tabbycat tournament in the given motions CSV, fetching pages with the given
+    fetcher backend ('http', 'selenium' or 'auto').
+
+    Progress is tracked in the crawl manifest at manifest_path (unless it is None), so a rerun
+    resumes where the last one stopped and only refreshes stale tournaments. Failed pages are
+    retried with backoff and spaced out on hosts that are slow or failing, and tournaments or hosts
+    that keep failing are skipped, in later runs too while the manifest remembers them as dead. In
+    offline mode, every tournament is re-parsed from the page cache in cache_dir and its files
+    replaced. The run report is saved to report_path."""
+    tournaments = get_tournaments(filepath)
+    # re-parsing offline must not reuse records parsed by older code
+    manifest = CrawlManifest(manifest_path) if manifest_path and not offline else None
+    fetcher = make_fetcher(backend, cache_dir, offline=offline,
+                           breaker=CircuitBreaker(manifest=manifest),
+                           limiter=AdaptiveLimiter())
+
+    Path('scraped_data/').mkdir(parents=True, exist_ok=True)
+    try:
+        for tournament in tournaments:
+            print(tournament)
+            try:
+                save_tournament(*tournament, fetcher=fetcher, overwrite=offline, manifest=manifest)
+            except PageNotCached:  # tournament was never downloaded
+                pass
+            except HostUnavailable as error:  # its site is dead, so don't wait on it
+                print(tournament, 'skipped:', error)
+    finally:
+        fetcher.close()
+        close_shared_pool()  # quit any browsers the fallback started
+        if manifest is not None:
+            manifest.close()
+    print(fetcher.pages, 'pages at', round(fetcher.pages_per_second(), 2), 'pages/second')
+    report_run(report_path)
+
+
+def order_by_host(tournaments: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Returns the tournaments reordered so that consecutive tournaments are on different hosts.
+
+    This keeps workers from queueing up behind the same host while other hosts sit idle."""
+    hosts: Dict[str, List[Tuple[str, str]]] = {}
     for tournament in tournaments:
+        hosts.setdefault(get_host(tournament[1].split()[0]), []).append(tournament)
+    # take one tournament from each host in turn
+    return [tournament for group in zip_longest(*hosts.values())
+            for tournament in group if tournament is not None]
+
+
+def save_tournaments_concurrently(filepath: str, workers: int = 4, max_per_host: int = 1,
+                                  min_interval: float = 0.0, backend: str = 'auto',
+                                  manifest_path: Optional[str] = DEFAULT_MANIFEST,
+                                  browsers: int = 2,
+                                  report_path: Optional[str] = DEFAULT_REPORT,
+                                  cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> None:
+    """Same as save_tournaments_from_file_tabbycat, but crawls tournaments on several workers.
+
+    Each worker gets its own fetcher, and all share the crawl manifest, the circuit breaker that
+    skips dead tournaments and hosts, and the adaptive limiter that lets at most max_per_host
+    requests reach the same host at once, at least min_interval seconds apart. Pages that need a
+    browser share a pool of at most browsers headless drivers."""
+    tournaments = order_by_host(get_tournaments(filepath))
+    limiter = AdaptiveLimiter(max_per_host, min_interval)
+    manifest = CrawlManifest(manifest_path) if manifest_path else None
+    breaker = CircuitBreaker(manifest=manifest)
+    if backend != 'http':
+        get_shared_pool(size=browsers)  # drivers are only started once a page needs one
+
+    local = threading.local()  # holds each worker thread's fetcher
+    fetchers, fetchers_lock = [], threading.Lock()
+
+    def get_fetcher() -> Fetcher:
+        if not hasattr(local, 'fetcher'):
+            local.fetcher = make_fetcher(backend, cache_dir, breaker=breaker, limiter=limiter)
+            with fetchers_lock:
+                fetchers.append(local.fetcher)
+        return local.fetcher
+
+    def crawl(tournament: Tuple[str, str]) -> None:
         print(tournament)
-        # todo: deal with (lse2021.herokuapp.com)
-        for url in tournament[1].split():  # sometimes there are multiple links, so analyze each
-            if not validators.url(url):
-                continue
-            elif 'calico' in url or 'heroku' in url:  # if it's a tabbycat link
-                # append this tournament's motions to motions_df
-                scrape_motions.save_all_motions(*tournament, driver=driver)  # save motions
-                scrape_speaker_tab.save_speaker_tab(*tournament, driver=driver)  # save speaks
-                scrape_results.save_all_results(*tournament, driver=driver)  # save results tabs
+        try:
+            save_tournament(*tournament, fetcher=get_fetcher(), manifest=manifest)
+        except Exception as error:  # one broken tab shouldn't stop the whole crawl
+            print(tournament, 'failed:', repr(error))
+
+    Path('scraped_data/').mkdir(parents=True, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(crawl, tournaments))
+    finally:
+        for fetcher in fetchers:
+            fetcher.close()
+        close_shared_pool()
+        if manifest is not None:
+            manifest.close()
+    print(sum(fetcher.pages for fetcher in fetchers), 'pages fetched')
+    report_run(report_path)
 
 
 if __name__ == '__main__':
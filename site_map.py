@@ -0,0 +1,67 @@
+"""Finds the pages of a tabbycat tournament from its landing page.
+
+Every page the scrapers need (motions, motion statistics, speaker tab, team tab and the results of
+each round) is linked from the navigation bar, so one fetch and parse of the landing page finds them
+all. With a crawl manifest, the site map is stored and reused on recrawls without fetching the
+landing page at all."""
+
+from crawl_manifest import CrawlManifest
+from fetchers import Fetcher
+from parsing import make_soup, slice_html
+from urllib.parse import urljoin
+
+from typing import List, NamedTuple, Optional
+
+
+class SiteMap(NamedTuple):
+    """The URLs of a tournament's pages. Pages that aren't linked are ''."""
+    motions: str
+    motion_statistics: str
+    speaker_tab: str
+    team_tab: str
+    rounds: List[str]  # the results page of each round, in menu order
+
+
+def get_site_map(base_url: str, fetcher: Fetcher, manifest: Optional[CrawlManifest] = None,
+                 tournament_name: str = '') -> SiteMap:
+    """Returns the site map of the tournament at the given URL, reusing the manifest's copy if
+    it was checked recently."""
+    if manifest is not None:
+        links = manifest.get_site_map(base_url)
+        if links is not None:
+            return SiteMap(**links)
+
+    site_map = parse_site_map(fetcher.get(base_url), base_url)
+    if manifest is not None:
+        manifest.record_site_map(base_url, tournament_name, site_map._asdict())
+    return site_map
+
+
+def parse_site_map(html: str, base_url: str) -> SiteMap:
+    """Returns the site map linked from the navigation bar of the given tournament page HTML."""
+    html = slice_html(html, ['nav'], 'nav')  # only the navigation bar has the links
+    soup = make_soup(html)
+
+    links = {'motions': '', 'motion_statistics': '', 'speaker_tab': '', 'team_tab': ''}
+    for a in soup.findAll('a', href=True):
+        classes = a.get('class', [])
+        if 'nav-link' not in classes and 'dropdown-item' not in classes:
+            continue
+        url, text = urljoin(base_url, a['href']), a.get_text(strip=True)
+        if 'motions' in a['href'] and 'statistics' in a['href']:
+            key = 'motion_statistics'
+        elif 'motions' in a['href'] and 'nav-link' in classes:
+            key = 'motions'
+        elif text == 'Speaker Tab':
+            key = 'speaker_tab'
+        elif text == 'Team Tab':
+            key = 'team_tab'
+        else:
+            continue
+        if links[key] == '':  # keep the first link to each page
+            links[key] = url
+
+    # Find all results links. Note: if there are none, no rounds are returned.
+    round_menu = soup.find('div', {'class': 'dropdown-menu', 'aria-labelledby': 'roundsDrop'})
+    rounds = [] if round_menu is None else round_menu.findAll('a', {'class': 'dropdown-item'})
+    return SiteMap(rounds=[urljoin(base_url, round['href']) for round in rounds], **links)
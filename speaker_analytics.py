@@ -0,0 +1,109 @@
+"""Speaker score statistics across every tournament in the store.
+
+Scores are loaded as floats, one row per speaker per round with NaN for missed rounds, and
+pivoted into a speaker x round matrix, so every statistic is a NaN-aware array operation over all
+speakers at once.
+
+Some rounds are scored harder than others, so scores can also be adjusted for round difficulty:
+a round's difficulty is how far its average score is below its tournament's average, and the
+adjusted score adds it back."""
+
+import re
+import numpy as np
+import pandas as pd
+from dataset_store import DEFAULT_STORE, load_speaker_scores, load_speakers
+from instrumentation import timed
+
+
+TRIM = 0.2  # share of a speaker's scores cut from each end for their trimmed mean
+PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def get_round_number(round: str) -> int:
+    """Returns the number of the given round, e.g. 3 for 'R3', or -1 if it has none."""
+    number = re.search(r'\d+', str(round))
+    return int(number.group()) if number else -1
+
+
+def get_speaker_matrix(scores_df: pd.DataFrame, column: str = 'score') -> pd.DataFrame:
+    """Returns the given speaker scores (as loaded by dataset_store.load_speaker_scores) as a
+    matrix with one row per (tournament_id, speaker) and one column per round in round order, NaN
+    where the speaker missed the round."""
+    matrix = scores_df.pivot_table(index=['tournament_id', 'speaker'], columns='round',
+                                   values=column, aggfunc='first', observed=True, dropna=False)
+    matrix = matrix.dropna(how='all')  # speakers of other tournaments, from the round categories
+    return matrix[sorted(matrix.columns, key=get_round_number)]
+
+
+def trimmed_mean(scores: np.ndarray, proportion: float = TRIM) -> np.ndarray:
+    """Returns the mean of each row of scores, ignoring NaN, after cutting the given share of its
+    scores from each end (rounded down, so speakers with few rounds keep them all)."""
+    counts = np.sum(~np.isnan(scores), axis=1)
+    cut = np.floor(counts * proportion).astype(int)
+    ordered = np.sort(scores, axis=1)  # NaN sort last
+    # the sum of each row's scores from position cut to count - cut, from running totals
+    totals = np.concatenate([np.zeros((len(scores), 1)), np.nancumsum(ordered, axis=1)], axis=1)
+    rows = np.arange(len(scores))
+    kept = totals[rows, counts - cut] - totals[rows, cut]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return kept / (counts - 2 * cut)
+
+
+def get_round_difficulty(scores_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the difficulty of every round of every tournament in the given speaker scores: its
+    tournament's average score minus its own, so rounds scored harder than usual are positive."""
+    averages = scores_df.groupby(['tournament_id', 'round'], observed=True)['score'].mean()
+    tournament_averages = scores_df.groupby('tournament_id')['score'].mean()
+    difficulty = tournament_averages.reindex(averages.index.get_level_values(0)).to_numpy() - \
+        averages
+    return difficulty.rename('difficulty').reset_index()
+
+
+def adjust_scores(scores_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the given speaker scores with an adjusted_score column: each score plus its round's
+    difficulty."""
+    difficulty = get_round_difficulty(scores_df)
+    scores_df = scores_df.merge(difficulty, how='left', on=['tournament_id', 'round'])
+    return scores_df.assign(adjusted_score=scores_df['score'] + scores_df['difficulty'])
+
+
+@timed
+def get_speaker_statistics(path: str = DEFAULT_STORE, adjusted: bool = False,
+                           **filters) -> pd.DataFrame:
+    """Returns every speaker in the store with their team, number of rounds spoken, and the mean,
+    standard deviation and trimmed mean of their scores. If adjusted is True, the statistics are of
+    scores adjusted for round difficulty.
+
+    Tournaments can be filtered as in dataset_store.load_speaker_scores, e.g. year=2021."""
+    scores_df = load_speaker_scores(path, **filters)
+    if adjusted:
+        scores_df = adjust_scores(scores_df)
+    matrix = get_speaker_matrix(scores_df, 'adjusted_score' if adjusted else 'score')
+
+    statistics = pd.DataFrame({'rounds': matrix.count(axis=1), 'mean': matrix.mean(axis=1),
+                               'std': matrix.std(axis=1),
+                               'trimmed_mean': trimmed_mean(matrix.to_numpy(dtype=float))},
+                              index=matrix.index)
+    speakers_df = load_speakers(path, **filters).set_index(['tournament_id', 'speaker'])
+    return speakers_df[['tournament', 'date', 'name', 'team']].join(statistics, how='inner')
+
+
+def get_tournament_statistics(path: str = DEFAULT_STORE, adjusted: bool = False,
+                              **filters) -> pd.DataFrame:
+    """Returns the number of scores and the mean, standard deviation and percentile bands of the
+    speaker scores of every tournament in the store, optionally adjusted for round difficulty.
+    See get_speaker_statistics for filters."""
+    scores_df = load_speaker_scores(path, **filters)
+    column = 'score'
+    if adjusted:
+        scores_df, column = adjust_scores(scores_df), 'adjusted_score'
+    groups = scores_df.groupby('tournament', observed=True)[column]
+    statistics = groups.agg(['count', 'mean', 'std'])
+    percentiles = groups.quantile(PERCENTILES).unstack()
+    percentiles.columns = ['p' + str(round(percentile * 100)) for percentile in PERCENTILES]
+    return statistics.join(percentiles)
+
+
+if __name__ == '__main__':
+    print(get_speaker_statistics(adjusted=True).sort_values('trimmed_mean', ascending=False)
+          .head(20).to_string())
@@ -0,0 +1,93 @@
+"""An index of the tournaments in the motions master CSV, with one row per tournament.
+
+The master CSV has one row per motion, so each tournament appears once per round. The index is
+built by streaming the CSV in chunks, reading only the columns it needs, and keeps one row per
+tournament with its circuit and the normalized tab links found in its Event_Link cells. It is saved
+next to the master CSV and only rebuilt when the master CSV changes, so planning a crawl reads a few
+hundred rows instead of the whole sheet."""
+
+import os
+import re
+import pandas as pd
+from urllib.parse import urlsplit, urlunsplit
+
+from typing import Dict, List, Optional, Tuple
+
+
+# the index of each master CSV is saved next to it, e.g. 'Motions.index.csv' for 'Motions.csv'
+DEFAULT_INDEX = '{stem}.index.csv'
+CHUNK_ROWS = 2000  # master CSV rows read at a time
+INDEX_COLUMNS = ['Date', 'Tournament', 'Event_Link', 'Circuit']  # all read as strings
+TAB_HOSTS = ('calicotab.com', 'herokuapp.com')  # hosts of tabbycat sites
+
+# full URLs, and bare hosts in brackets as pasted from browser tab titles, e.g.
+# 'LSE Juniors | Welcome to LSE Juniors 2021 (lse2021.herokuapp.com)'
+URL_PATTERN = re.compile(r'https?://[^\s,;|()]+|(?<=\()[\w-]+(?:\.[\w-]+)+(?=\))')
+
+
+def normalize_url(url: str) -> str:
+    """Returns the given URL with an https scheme, a lowercase host, a trailing slash and no query
+    string or fragment, e.g. 'https://x.herokuapp.com/t/' for 'X.herokuapp.com/t?fbclid=1'."""
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    path = parts.path if parts.path.endswith('/') else parts.path + '/'
+    return urlunsplit(('https', parts.netloc.lower(), path, '', ''))
+
+
+def is_tab_url(url: str) -> bool:
+    """Returns whether the given normalized URL is on a tabbycat host."""
+    return urlsplit(url).netloc.endswith(TAB_HOSTS)
+
+
+def extract_tab_urls(event_link: str) -> List[str]:
+    """Returns the normalized tabbycat URLs in the given Event_Link cell, which may hold several
+    links mixed with text."""
+    urls = [normalize_url(url) for url in URL_PATTERN.findall(event_link)]
+    return [url for url in dict.fromkeys(urls) if is_tab_url(url)]  # unique, in order
+
+
+def build_tournament_index(master_csv: str, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Returns one row per tournament in the given master CSV, with its '<date> <tournament>' name,
+    date, tournament, circuit and space-separated tab links ('' if it has none).
+
+    Tournaments without a date have the date '' and are named 'nan <tournament>', as they always
+    were, so that the files scraped for them keep their names."""
+    tournaments: Dict[Tuple[str, str], Dict] = {}
+    chunks = pd.read_csv(master_csv, usecols=INDEX_COLUMNS,
+                         dtype=dict.fromkeys(INDEX_COLUMNS, str), chunksize=chunk_rows)
+    for chunk in chunks:
+        chunk = chunk[INDEX_COLUMNS].dropna(subset=['Tournament']).fillna({'Date': ''})
+        chunk = chunk.drop_duplicates(INDEX_COLUMNS)  # most rows repeat their tournament
+        for date, name, event_link, circuit in chunk.itertuples(index=False):
+            entry = tournaments.setdefault((date, name), {'circuit': None, 'links': {}})
+            if entry['circuit'] is None and isinstance(circuit, str):
+                entry['circuit'] = circuit.strip()
+            if isinstance(event_link, str):
+                entry['links'].update(dict.fromkeys(extract_tab_urls(event_link)))
+
+    return pd.DataFrame([{'name': (date or 'nan') + ' ' + name, 'date': date, 'tournament': name,
+                          'circuit': entry['circuit'], 'links': ' '.join(entry['links'])}
+                         for (date, name), entry in tournaments.items()],
+                        columns=['name', 'date', 'tournament', 'circuit', 'links'])
+
+
+def load_tournament_index(master_csv: str, index_path: Optional[str] = DEFAULT_INDEX) \
+        -> pd.DataFrame:
+    """Returns the tournament index of the given master CSV, reading the saved index at index_path
+    unless the master CSV is newer, in which case the index is rebuilt and saved. '{stem}' in
+    index_path is replaced with the master CSV's path without its extension, so that each master
+    CSV has its own index. The index is never saved if index_path is None."""
+    if index_path is None:
+        return build_tournament_index(master_csv)
+    index_path = index_path.format(stem=os.path.splitext(master_csv)[0])
+    if os.path.exists(index_path) and \
+            os.path.getmtime(index_path) >= os.path.getmtime(master_csv):
+        index = pd.read_csv(index_path, dtype=str, keep_default_na=False)
+        index['circuit'] = index['circuit'].mask(index['circuit'] == '')  # missing circuits
+        # indexes saved while undated tournaments were named without 'nan' are rebuilt
+        if not ((index['date'] == '') & ~index['name'].str.startswith('nan ')).any():
+            return index
+    index = build_tournament_index(master_csv)
+    index.to_csv(index_path, index=False)
+    return index